@@ -0,0 +1,2 @@
+# Python preprocessing of the eye tracking data (ioHub .hdf5) and trial data (.csv) of the tasks.
+# Run from the code folder, e.g.: python -m et_preprocessing.<module>
@@ -0,0 +1,240 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import argparse
+import logging
+import re
+import time
+import traceback
+
+import pandas
+
+from .blinks import detect_blinks, invalid_samples
+from .iohub_reader import read_samples
+from .manifest import Manifest
+from .pupil import preprocess_pupil
+from .trial_merge import merge_samples
+
+# Batch preprocessing of all sessions of a task: every (eye tracking .hdf5, trial data) pair is processed in its
+# own worker process, one .parquet file per session is written, then the merged dataset of all sessions.
+# Only new or changed sessions are processed (manifest.py), --force processes all sessions again.
+#   python -m et_preprocessing.batch <eyetracking folder> <trialdata folder> <output folder>
+#       [--task T] [--workers N] [--force]
+#
+# Files are paired by the file name the task scripts use for both outputs:
+#   {task_name}_{participant_id}_{timepoint}_{date}.hdf5 / .csv (date: %Y-%m-%d-%H%M)
+
+SESSION_PATTERN = re.compile(
+    r'^(?P<task>[a-z-]+)_(?P<participant>.+)_(?P<timepoint>[^_]+)_(?P<date>\d{4}-\d{2}-\d{2}-\d{4})$')
+
+TRIAL_SUFFIXES = ('.csv', '.tsv')  # saveAsWideText: .csv with delim=",", .tsv otherwise
+
+# Increase when the processing of a session changes: all sessions are processed again.
+PIPELINE_VERSION = 3
+
+
+class Session:
+    """One recording: the .hdf5 datastore and the trial data file of a participant and timepoint."""
+
+    def __init__(self, name, task, participant, timepoint, date, hdf5_path, trial_path):
+        self.name = name
+        self.task = task
+        self.participant = participant
+        self.timepoint = timepoint
+        self.date = date
+        self.hdf5_path = hdf5_path
+        self.trial_path = trial_path
+
+    def __repr__(self):
+        return f'Session({self.name})'
+
+
+def parse_session_name(name):
+    """Return the parts (task, participant, timepoint, date) of a session file name (without suffix), or None."""
+    match = SESSION_PATTERN.match(name)
+    if match is None:
+        return None
+    return match.group('task', 'participant', 'timepoint', 'date')
+
+
+def find_sessions(eyetracking_folder, trials_folder, task=None):
+    """Pair the .hdf5 and trial data files by session name. Returns (sessions, unpaired file names)."""
+    trial_files = {}
+    for path in sorted(Path(trials_folder).iterdir()):
+        if path.suffix in TRIAL_SUFFIXES and parse_session_name(path.stem) is not None:
+            trial_files.setdefault(path.stem, path)
+
+    sessions = []
+    unpaired = []
+    for path in sorted(Path(eyetracking_folder).glob('*.hdf5')):
+        parts = parse_session_name(path.stem)
+        if parts is None or (task is not None and parts[0] != task):
+            continue
+        trial_path = trial_files.pop(path.stem, None)
+        if trial_path is None:
+            unpaired.append(path.name)
+            continue
+        sessions.append(Session(path.stem, *parts, hdf5_path=path, trial_path=trial_path))
+    unpaired += [path.name for name, path in trial_files.items()
+                 if task is None or parse_session_name(name)[0] == task]
+    return sessions, unpaired
+
+
+def read_trials(path):
+    path = Path(path)
+    return pandas.read_csv(path, sep='\t' if path.suffix == '.tsv' else ',')
+
+
+def session_output(output_folder, session):
+    return Path(output_folder) / 'sessions' / f'{session.name}.parquet'
+
+
+def process_session(session, output_folder):
+    """Merge the samples of one session with its trials and write the session .parquet. Returns the timings."""
+    timings = {}
+    start = time.perf_counter()
+    samples = read_samples(session.hdf5_path)
+    trials = read_trials(session.trial_path)
+    timings['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    merged = merge_samples(session.task, samples, trials)
+    frame = merged.to_frame()
+    frame.insert(0, 'trial_index', merged.trial_index)
+    frame.insert(0, 'timepoint', session.timepoint)
+    frame.insert(0, 'id', session.participant)
+    timings['merge'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pupil = preprocess_pupil(
+        frame['left_pupil_measure1'].to_numpy(), frame['right_pupil_measure1'].to_numpy(),
+        frame['logged_time'].to_numpy(), segments=merged.trial_index)
+    frame['pd'] = pupil['pd']
+    timings['pupil'] = time.perf_counter() - start
+
+    # Blinks are detected on the whole recording, the mask is gathered for the merged samples:
+    start = time.perf_counter()
+    invalid = invalid_samples(samples['left_pupil_measure1'], samples['right_pupil_measure1'], samples['status'])
+    blinks, blink_mask = detect_blinks(samples['logged_time'], invalid)
+    frame['blink'] = blink_mask[merged.sample_index]
+    timings['blinks'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    path = session_output(output_folder, session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    frame.to_parquet(path, index=False)
+    timings['write'] = time.perf_counter() - start
+    return {'path': path, 'samples': len(samples), 'merged_samples': len(merged), 'trials': len(trials),
+            'blinks': len(blinks), 'timings': timings}
+
+
+def _run_session(session, output_folder):
+    # Worker process: failures are returned, one failing session does not stop the batch.
+    start = time.perf_counter()
+    try:
+        result = process_session(session, output_folder)
+        result['error'] = None
+    except Exception as e:
+        result = {'error': f'{type(e).__name__}: {e}', 'traceback': traceback.format_exc()}
+    result['duration'] = time.perf_counter() - start
+    return result
+
+
+def merge_sessions(paths, merged_path):
+    """Concatenate the session .parquet files into the merged dataset."""
+    frames = [pandas.read_parquet(path) for path in paths]
+    merged = pandas.concat(frames, ignore_index=True) if frames else pandas.DataFrame()
+    merged.to_parquet(merged_path, index=False)
+    return merged_path
+
+
+def run_batch(sessions, output_folder, name, workers=None, force=False):
+    """Process new and changed sessions in a process pool, write the merged dataset. Returns {session name: result}.
+
+    Unchanged sessions (manifest) are not processed again, force=True processes all sessions.
+    Writes <name>_merged.parquet and <name>_manifest.json in the output folder.
+    """
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    manifest = Manifest(output_folder / f'{name}_manifest.json', PIPELINE_VERSION)
+    removed = manifest.forget_missing({session.name for session in sessions})
+
+    pending = []
+    input_states = {}
+    for session in sessions:
+        input_states[session.name] = manifest.current_inputs(
+            session.name, {'eyetracking': session.hdf5_path, 'trials': session.trial_path})
+        if force or not manifest.is_current(session.name, input_states[session.name]):
+            pending.append(session)
+        else:
+            # Unchanged content, new mtime (e.g. copied again) is recorded:
+            manifest.record(session.name, input_states[session.name], manifest.sessions[session.name]['output'])
+    print(f'{len(pending)} of {len(sessions)} sessions new or changed ({round(time.perf_counter() - start, 2)} s)')
+
+    results = {}
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_run_session, session, output_folder): session for session in pending}
+            for future in as_completed(futures):
+                session = futures[future]
+                result = future.result()
+                results[session.name] = result
+                if result['error'] is None:
+                    manifest.record(session.name, input_states[session.name], result['path'])
+                    timings = ', '.join(f'{step} {duration:.2f} s' for step, duration in result['timings'].items())
+                    message = (f'done: {session.name} ({result["merged_samples"]} of {result["samples"]} samples, '
+                               f'{result["trials"]} trials, {result["blinks"]} blinks) '
+                               f'in {result["duration"]:.2f} s ({timings})')
+                    print(message)
+                    logging.info(message)
+                else:
+                    print(f'FAILED: {session.name}: {result["error"]}')
+                    logging.error(f'FAILED: {session.name}\n{result["traceback"]}')
+        # Processed sessions are kept even if a later step fails:
+        manifest.save()
+
+    # The merged dataset is rebuilt from the session files if any session was added, changed or removed:
+    merged_path = output_folder / f'{name}_merged.parquet'
+    current = [session.name for session in sessions if manifest.is_current(session.name, input_states[session.name])]
+    if pending or removed or not merged_path.exists():
+        merge_sessions(manifest.outputs(current), merged_path)
+        print(f'merged dataset: {merged_path} ({len(current)} sessions)')
+    else:
+        print(f'merged dataset unchanged: {merged_path}')
+    manifest.save()
+    print(f'total duration: {time.perf_counter() - start:.2f} s')
+    return results
+
+
+def print_failures(results, unpaired=()):
+    failed = {name: result for name, result in results.items() if result['error'] is not None}
+    print(f'\n{len(results) - len(failed)} of {len(results)} new or changed sessions processed')
+    for name, result in sorted(failed.items()):
+        print(f'  FAILED {name}: {result["error"]}')
+    for name in unpaired:
+        print(f'  NOT PAIRED {name}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge eye tracking and trial data of all sessions of a task.')
+    parser.add_argument('eyetracking', help='folder of the .hdf5 files')
+    parser.add_argument('trials', help='folder of the trial data files')
+    parser.add_argument('output', help='output folder')
+    parser.add_argument('--task', help='only sessions of this task (task_name of the file names)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: number of CPUs)')
+    parser.add_argument('--force', action='store_true', help='process all sessions, also unchanged ones')
+    args = parser.parse_args()
+
+    output_folder = Path(args.output)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(level=logging.INFO, filename=output_folder / 'batch.log', filemode='a',
+                        format='%(asctime)s:%(levelname)s:%(message)s')
+
+    sessions, unpaired = find_sessions(args.eyetracking, args.trials, args.task)
+    print(f'{len(sessions)} sessions found')
+    results = run_batch(sessions, output_folder, args.task or 'all', args.workers, args.force)
+    print_failures(results, unpaired)
+
+
+if __name__ == '__main__':
+    main()
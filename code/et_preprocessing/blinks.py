@@ -0,0 +1,95 @@
+import argparse
+
+import numpy as np
+import pandas
+
+from .iohub_reader import read_samples
+from .pupil import sampling_rate
+
+# Blink detection on the samples of a whole session in one pass, replaces the per-trial blink function of the R
+# scripts. Runs of invalid samples (both eyes without pupil) are found by run-length encoding, runs between
+# MIN_BLINK_DURATION and MAX_BLINK_DURATION are blinks (shorter: noise, longer: looking away / lost tracking).
+#   python -m et_preprocessing.blinks <datastore.hdf5>   prints the blinks of a recording
+
+MIN_BLINK_DURATION = 0.075  # s
+MAX_BLINK_DURATION = 0.5  # s
+BLINK_PADDING = (0.05, 0.1)  # s before and after a blink, partly closed eyelid
+
+BOTH_EYES_INVALID = 22  # status of ioHub binocular samples: 2 right eye invalid + 20 left eye invalid
+
+
+def invalid_samples(left_pupil, right_pupil, status=None):
+    """True for samples without a valid pupil of both eyes (pupil missing or <= 0, or status: both invalid)."""
+    left_pupil = np.asarray(left_pupil, dtype=float)
+    right_pupil = np.asarray(right_pupil, dtype=float)
+    with np.errstate(invalid='ignore'):
+        invalid = ~(left_pupil > 0) & ~(right_pupil > 0)
+    if status is not None:
+        invalid |= np.asarray(status) == BOTH_EYES_INVALID
+    return invalid
+
+
+def run_lengths(mask):
+    """Run-length encoding of the True runs of a boolean array: (start indices, lengths)."""
+    mask = np.asarray(mask, dtype=bool)
+    edges = np.diff(mask.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts, ends - starts
+
+
+def detect_blinks(timestamps, invalid, min_duration=MIN_BLINK_DURATION, max_duration=MAX_BLINK_DURATION,
+                  padding=BLINK_PADDING, rate=None):
+    """Blinks of a session: (blink table, mask of the padded blink samples).
+
+    timestamps: sample times in seconds (increasing), invalid: see invalid_samples().
+    The blink table has one row per blink: first and last sample index, onset, offset and duration (s).
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    starts, lengths = run_lengths(invalid)
+    mask = np.zeros(len(timestamps), dtype=bool)
+    if len(starts) == 0:
+        return pandas.DataFrame(columns=['first_sample', 'last_sample', 'onset', 'offset', 'duration']), mask
+
+    interval = 1 / (sampling_rate(timestamps) if rate is None else rate)
+    last = starts + lengths - 1
+    onset = timestamps[starts]
+    offset = timestamps[last] + interval  # the eye is open again at the next sample
+    duration = offset - onset
+    blink = (duration >= min_duration) & (duration <= max_duration)
+    starts, last, onset, offset, duration = starts[blink], last[blink], onset[blink], offset[blink], duration[blink]
+
+    # Padded blink samples, marked with a difference array:
+    pad_first = np.searchsorted(timestamps, onset - padding[0], side='left')
+    pad_stop = np.searchsorted(timestamps, offset + padding[1], side='left')
+    marks = np.zeros(len(timestamps) + 1, dtype=np.int64)
+    np.add.at(marks, pad_first, 1)
+    np.add.at(marks, pad_stop, -1)
+    mask = np.cumsum(marks[:-1]) > 0
+
+    blinks = pandas.DataFrame({
+        'first_sample': starts,
+        'last_sample': last,
+        'onset': onset,
+        'offset': offset,
+        'duration': duration,
+    })
+    return blinks, mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Detect the blinks of an ioHub recording.')
+    parser.add_argument('datastore', help='.hdf5 datastore of a task')
+    args = parser.parse_args()
+
+    samples = read_samples(args.datastore, ('logged_time', 'left_pupil_measure1', 'right_pupil_measure1', 'status'))
+    invalid = invalid_samples(samples['left_pupil_measure1'], samples['right_pupil_measure1'], samples['status'])
+    blinks, mask = detect_blinks(samples['logged_time'], invalid)
+    minutes = (samples['logged_time'][-1] - samples['logged_time'][0]) / 60
+    print(blinks.to_string(index=False))
+    print(f'{len(blinks)} blinks in {minutes:.1f} min ({len(blinks) / minutes:.1f} per min), '
+          f'{np.mean(mask) * 100:.1f} % of the samples in blinks')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import argparse
+import warnings
+
+import numpy as np
+import pandas
+
+from .pupil import sampling_rate
+
+# Epoching of the pupil data: the samples of a session are resampled on a common time grid around the trial onsets
+# (anchors) into one array of trials x time bins x channels, replaces the ts_trial loops and the per-trial data
+# frames of the R scripts. Baselines of all trials are computed in one step, as the mean of the baseline window.
+#   python -m et_preprocessing.epochs <session .parquet> <task> <output .npz>
+
+# Gap between the samples around a time bin above which the bin is missing (in sample intervals):
+MAX_GAP_INTERVALS = 2
+
+
+def _rss_event(trials):
+    # Rapid sound sequences (03_analysis_rss.R): transition of the transition conditions, 3 s after the sequence
+    # start for the control conditions.
+    control = trials['Condition'].isin(['RAND20', 'REG10']).to_numpy()
+    start = trials['start_timestamp_0'].to_numpy(dtype=float)
+    transition = trials['transition_timestamp_1'].to_numpy(dtype=float)
+    return np.where(control, start + 3, transition)
+
+
+class EpochDefinition:
+    """Epochs of a task.
+
+    anchor: trial data column (or function(trials) -> onsets) of time 0.
+    window: (start, end) of the epochs in seconds relative to the anchor.
+    baseline: (start, end) of the baseline window, relative to baseline_anchor (default: the anchor).
+    """
+
+    def __init__(self, anchor, window, baseline, baseline_anchor=None):
+        self.anchor = anchor
+        self.window = window
+        self.baseline = baseline
+        self.baseline_anchor = anchor if baseline_anchor is None else baseline_anchor
+
+
+def anchor_times(trials, anchor):
+    if callable(anchor):
+        return np.asarray(anchor(trials), dtype=float)
+    return trials[anchor].to_numpy(dtype=float)
+
+
+# As in 01_preprocessing_<task>.R / 03_analysis_<task>.R:
+EPOCHS = {
+    'auditory-oddball': EpochDefinition('timestamp_exp', window=(0, 2.2), baseline=(0, 0.25)),
+    'visual-oddball': EpochDefinition('stimulus_start_timestamp', window=(0, 2.0), baseline=(0, 0.25)),
+    # ISI-based baseline: last 250 ms of the ISI before the cue
+    'cued-visual-search': EpochDefinition(
+        'beep_phase_start_timestamp', window=(0, 2.15), baseline=(-0.25, 0), baseline_anchor='ISI_end_timestamp'),
+    'rapid-sound-sequences': EpochDefinition(_rss_event, window=(-1.0, 2.0), baseline=(-1.0, 0)),
+}
+
+
+def time_grid(window, rate):
+    """Time bins (s) of an epoch window: multiples of the sample interval, both ends included."""
+    return np.arange(int(np.ceil(window[0] * rate - 1e-9)), int(np.floor(window[1] * rate + 1e-9)) + 1) / rate
+
+
+def epoch(timestamps, values, onsets, grid, max_gap):
+    """Resample values (samples x channels) at onsets + grid: returns trials x bins x channels.
+
+    Linear interpolation between the two samples around each bin, bins outside the recording, with a gap of more
+    than max_gap seconds around them or with a missing onset are nan.
+    """
+    times = np.asarray(onsets, dtype=float)[:, None] + grid[None, :]
+    following = np.searchsorted(timestamps, times, side='left')
+    n = len(timestamps)
+    previous = np.clip(following - 1, 0, n - 1)
+    following_clipped = np.clip(following, 0, n - 1)
+    t0 = timestamps[previous]
+    t1 = timestamps[following_clipped]
+    exact = t1 == times  # bin on a sample: only this sample is used
+    previous = np.where(exact, following_clipped, previous)
+    t0 = np.where(exact, t1, t0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(exact, 1.0, (times - t0) / (t1 - t0))
+    valid = ((following > 0) | exact) & (following < n) & (exact | (t1 - t0 <= max_gap)) & ~np.isnan(times)
+    weight = np.where(valid, weight, 0)[..., None]
+    data = values[previous] * (1 - weight) + values[following_clipped] * weight
+    data[~valid] = np.nan
+    return data
+
+
+class Epochs:
+    """Epoch array of a session: data[trial, bin, channel] at times[bin], baseline[trial, channel]."""
+
+    def __init__(self, data, times, channels, baseline, trials):
+        self.data = data
+        self.times = times
+        self.channels = list(channels)
+        self.baseline = baseline
+        self.trials = trials
+
+    def channel(self, name):
+        return self.data[:, :, self.channels.index(name)]
+
+    def corrected(self, divisive=False):
+        """Baseline corrected epochs: subtractive (data - baseline) or divisive (data / baseline)."""
+        if divisive:
+            return self.data / self.baseline[:, None, :]
+        return self.data - self.baseline[:, None, :]
+
+    def window_mean(self, start, end, corrected=True):
+        """Mean of each trial and channel in a time window, e.g. the pupil response of 03_analysis."""
+        data = self.corrected() if corrected else self.data
+        in_window = (self.times >= start) & (self.times <= end)
+        return _nanmean(data[:, in_window, :], axis=1)
+
+
+def _nanmean(data, axis):
+    # Mean of an all-nan window is nan, without a RuntimeWarning:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(data, axis=axis)
+
+
+def make_epochs(timestamps, channels, trials, definition, rate=None):
+    """Epochs of a session.
+
+    timestamps: increasing sample times (s), channels: {name: sample values}, e.g. {'pd': pd}.
+    trials: trial data (DataFrame) with the anchor columns of the definition, one epoch per row.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    rate = sampling_rate(timestamps) if rate is None else rate
+    max_gap = MAX_GAP_INTERVALS / rate
+    values = np.column_stack([np.asarray(value, dtype=float) for value in channels.values()])
+
+    times = time_grid(definition.window, rate)
+    data = epoch(timestamps, values, anchor_times(trials, definition.anchor), times, max_gap)
+    # Baselines of all trials in one step: epochs of the baseline window, averaged over the bins.
+    baseline_epochs = epoch(timestamps, values, anchor_times(trials, definition.baseline_anchor),
+                            time_grid(definition.baseline, rate), max_gap)
+    baseline = _nanmean(baseline_epochs, axis=1)
+    return Epochs(data, times, channels.keys(), baseline, trials)
+
+
+def session_epochs(session, task, channels=('pd',), definition=None):
+    """Epochs of a session .parquet frame of et_preprocessing.batch (one row per merged sample)."""
+    definition = EPOCHS[task] if definition is None else definition
+    # Samples can be merged to several trials (open-ended baseline): every sample once, in time order. The copy of
+    # the latest trial (largest trial_index) is kept, its pd was preprocessed within the sample's own trial.
+    logged_time = session['logged_time'].to_numpy()
+    order = np.lexsort((session['trial_index'].to_numpy(), logged_time))
+    last = np.append(logged_time[order][1:] != logged_time[order][:-1], True)
+    samples = session.iloc[order[last]]
+    trials = session.drop_duplicates('trial_index').reset_index(drop=True)
+    return make_epochs(
+        samples['logged_time'].to_numpy(), {name: samples[name].to_numpy() for name in channels}, trials, definition)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Epochs of a preprocessed session (trials x time bins x channels).')
+    parser.add_argument('session', help='session .parquet of et_preprocessing.batch')
+    parser.add_argument('task', choices=sorted(EPOCHS))
+    parser.add_argument('output', help='.npz file: data, times, channels, baseline, trial_index')
+    args = parser.parse_args()
+
+    epochs = session_epochs(pandas.read_parquet(args.session), args.task)
+    np.savez(args.output, data=epochs.data, times=epochs.times, channels=np.array(epochs.channels),
+             baseline=epochs.baseline, trial_index=epochs.trials['trial_index'].to_numpy())
+    print(f'{args.output}: {epochs.data.shape[0]} trials x {epochs.data.shape[1]} bins x {len(epochs.channels)} '
+          f'channels ({epochs.times[0]:.3f} ... {epochs.times[-1]:.3f} s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import sys
+
+import h5py
+import numpy as np
+
+# Streaming reader of the ioHub datastores (.hdf5) written by launchHubServer(datastore_name=...).
+# Only the requested fields of the eye sample table are read from disk, in chunks of chunk_size samples, so a
+# multi-hour recording can be processed in bounded memory. The samples are structured NumPy arrays (one field
+# per column, as in the .hdf5 table).
+#   python -m et_preprocessing.iohub_reader <datastore.hdf5>   prints the sample tables and their fields
+
+BINOCULAR_SAMPLES = 'data_collection/events/eyetracker/BinocularEyeSampleEvent'
+MONOCULAR_SAMPLES = 'data_collection/events/eyetracker/MonocularEyeSampleEvent'  # testmode (mouse as eye tracker)
+
+# Fields used by the preprocessing, the other ~40 fields of the sample table are never read:
+SAMPLE_FIELDS = (
+    'logged_time',
+    'left_gaze_x', 'left_gaze_y',
+    'right_gaze_x', 'right_gaze_y',
+    'left_pupil_measure1', 'right_pupil_measure1',
+    'status',  # validity of the eyes (blinks.py)
+)
+
+CHUNK_SIZE = 100_000  # samples, ~5.6 MB for SAMPLE_FIELDS
+
+
+def _sample_table(file, table):
+    if table not in file:
+        raise KeyError(f'{file.filename}: no sample table {table}')
+    return file[table]
+
+
+def _check_fields(dataset, fields):
+    missing = [field for field in fields if field not in dataset.dtype.names]
+    if missing:
+        raise KeyError(f'{dataset.file.filename}: {dataset.name} has no fields {missing}')
+
+
+def sample_count(path, table=BINOCULAR_SAMPLES):
+    """Number of samples in the sample table of a datastore."""
+    with h5py.File(path, 'r') as file:
+        return len(_sample_table(file, table))
+
+
+def iter_samples(path, fields=SAMPLE_FIELDS, chunk_size=CHUNK_SIZE, table=BINOCULAR_SAMPLES, start=0, stop=None):
+    """Yield the samples of a datastore as structured arrays of at most chunk_size samples.
+
+    fields: names of the sample table fields to read (column projection).
+    start, stop: sample range, e.g. to continue reading a recording after the first chunks.
+    """
+    fields = list(fields)
+    with h5py.File(path, 'r') as file:
+        dataset = _sample_table(file, table)
+        _check_fields(dataset, fields)
+        stop = len(dataset) if stop is None else min(stop, len(dataset))
+        projection = dataset.fields(fields)
+        for chunk_start in range(start, stop, chunk_size):
+            yield projection[chunk_start:min(chunk_start + chunk_size, stop)]
+
+
+def read_samples(path, fields=SAMPLE_FIELDS, chunk_size=CHUNK_SIZE, table=BINOCULAR_SAMPLES):
+    """All samples of a datastore as one structured array (only the requested fields)."""
+    fields = list(fields)
+    with h5py.File(path, 'r') as file:
+        dataset = _sample_table(file, table)
+        _check_fields(dataset, fields)
+        samples = np.empty(len(dataset), dtype=[(field, dataset.dtype[field]) for field in fields])
+        projection = dataset.fields(fields)
+        # Chunked reads into the preallocated array, no temporary copy of the whole table:
+        for chunk_start in range(0, len(dataset), chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, len(dataset))
+            samples[chunk_start:chunk_stop] = projection[chunk_start:chunk_stop]
+    return samples
+
+
+def sample_tables(path):
+    """{table name: (number of samples, field names)} of the eye sample tables in a datastore."""
+    tables = {}
+    with h5py.File(path, 'r') as file:
+        for table in (BINOCULAR_SAMPLES, MONOCULAR_SAMPLES):
+            if table in file:
+                tables[table] = (len(file[table]), file[table].dtype.names)
+    return tables
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('usage: python -m et_preprocessing.iohub_reader <datastore.hdf5>')
+        sys.exit(1)
+    for table, (count, names) in sample_tables(sys.argv[1]).items():
+        print(f'{table}: {count} samples')
+        print(f'  fields: {", ".join(names)}')
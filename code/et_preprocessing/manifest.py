@@ -0,0 +1,76 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+
+# Manifest of the preprocessed sessions (manifest.json in the output folder): size, modification time and content
+# hash of the input files of every session, and the file written for it. A re-run only processes sessions that are
+# new or whose inputs changed. Size and mtime are compared first, the content is only hashed if they differ (e.g. a
+# file copied again to the network share keeps its hash and is not processed again).
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_state(path, known=None):
+    """{size, mtime_ns, sha1} of a file, the hash of known (state of the manifest) is reused if size and mtime match."""
+    stat = os.stat(path)
+    state = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if known is not None and known['size'] == state['size'] and known['mtime_ns'] == state['mtime_ns']:
+        state['sha1'] = known['sha1']
+    else:
+        state['sha1'] = file_hash(path)
+    return state
+
+
+class Manifest:
+    """{session name: {'version', 'inputs': {role: file state}, 'output': path}} stored as JSON."""
+
+    def __init__(self, path, version):
+        self.path = Path(path)
+        self.version = version
+        self.sessions = {}
+        if self.path.exists():
+            with open(self.path) as file:
+                self.sessions = json.load(file)['sessions']
+
+    def current_inputs(self, name, inputs):
+        """Return the file states of the inputs ({role: path}) of a session."""
+        known = self.sessions.get(name, {}).get('inputs', {})
+        return {role: file_state(path, known.get(role)) for role, path in inputs.items()}
+
+    def is_current(self, name, input_states):
+        """True if the session was processed from these inputs by this version and its output still exists."""
+        entry = self.sessions.get(name)
+        if entry is None or entry['version'] != self.version or not Path(entry['output']).exists():
+            return False
+        known = entry['inputs']
+        return known.keys() == input_states.keys() and all(
+            known[role]['sha1'] == state['sha1'] for role, state in input_states.items())
+
+    def record(self, name, input_states, output):
+        self.sessions[name] = {'version': self.version, 'inputs': input_states, 'output': str(output)}
+
+    def forget_missing(self, names):
+        """Remove the sessions that are not in names (input files deleted). Returns the removed names."""
+        removed = [name for name in self.sessions if name not in names]
+        for name in removed:
+            del self.sessions[name]
+        return removed
+
+    def outputs(self, names):
+        return [Path(self.sessions[name]['output']) for name in names if name in self.sessions]
+
+    def save(self):
+        # Written to a temporary file first: an interrupted run never leaves a truncated manifest.
+        temporary = self.path.with_name(self.path.name + '.tmp')
+        with open(temporary, 'w') as file:
+            json.dump({'sessions': self.sessions}, file, indent=1)
+        os.replace(temporary, self.path)
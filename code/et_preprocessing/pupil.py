@@ -0,0 +1,239 @@
+import argparse
+
+import numpy as np
+import pandas
+
+# Pupil preprocessing of whole sessions, replaces PupilPreprocess::pupil_preprocessing applied per trial with
+# pblapply. All steps are array operations on the samples of a session: trial boundaries are only used as
+# segments (segment id per sample, e.g. the trial index of trial_merge), nothing is interpolated, smoothed or
+# compared across a segment boundary. The sampling rate is taken from the timestamps of the recording.
+#
+# Steps (as in PupilPreprocess, after Kret & Sjak-Shie, 2019):
+#   1. admissible diameters (MIN_DIAMETER ... MAX_DIAMETER mm)
+#   2. dilation speed outliers: speed > median + SPEED_MAD_MULTIPLIER * MAD of the segment
+#   3. padding of gaps (e.g. blinks) longer than GAP_MIN_DURATION by GAP_PADDING before and after
+#   4. linear interpolation of gaps up to INTERPOLATION_MAX_GAP
+#   5. merging of left and right eye, a missing eye is replaced by the other eye plus the mean offset of the eyes
+#   6. smoothing with a centered moving average of SMOOTHING_WINDOW
+#
+# Validation against the R package: export pd of a session from R (columns logged_time, pd) and run
+#   python -m et_preprocessing.pupil <session .parquet> <R export .csv>
+
+MIN_DIAMETER = 1.5  # mm
+MAX_DIAMETER = 9.0  # mm
+SPEED_MAD_MULTIPLIER = 16
+GAP_MIN_DURATION = 0.075  # s
+GAP_PADDING = (0.05, 0.05)  # s before and after a gap
+INTERPOLATION_MAX_GAP = 0.25  # s
+SMOOTHING_WINDOW = 0.05  # s
+
+
+def sampling_rate(timestamps):
+    """Sampling rate (Hz) of a recording: inverse of the median interval between samples."""
+    intervals = np.diff(np.asarray(timestamps, dtype=float))
+    intervals = intervals[np.isfinite(intervals) & (intervals > 0)]
+    if len(intervals) == 0:
+        raise ValueError('no sampling rate: less than two increasing timestamps')
+    return 1 / np.median(intervals)
+
+
+def _segment_ids(segments, n):
+    # Consecutive ids 0..k-1, samples of a segment must be adjacent (e.g. MergedSamples order):
+    if segments is None:
+        return np.zeros(n, dtype=np.int64)
+    segments = np.asarray(segments)
+    return np.concatenate(([0], np.cumsum(segments[1:] != segments[:-1])))
+
+
+def _segment_bounds(ids):
+    # First and last sample index of the segment of every sample:
+    counts = np.bincount(ids)
+    ends = np.cumsum(counts)
+    return (ends - counts)[ids], ends[ids] - 1
+
+
+def _grouped_median(values, ids, n_groups):
+    valid = ~np.isnan(values)
+    values, ids = values[valid], ids[valid]
+    order = np.lexsort((values, ids))
+    values = values[order]
+    counts = np.bincount(ids, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    median = np.full(n_groups, np.nan)
+    has_values = counts > 0
+    low = starts[has_values] + (counts[has_values] - 1) // 2
+    high = starts[has_values] + counts[has_values] // 2
+    median[has_values] = (values[low] + values[high]) / 2
+    return median
+
+
+def _grouped_mean(values, ids, n_groups):
+    valid = ~np.isnan(values)
+    sums = np.bincount(ids[valid], weights=values[valid], minlength=n_groups)
+    counts = np.bincount(ids[valid], minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def admissible_diameter(diameter, minimum=MIN_DIAMETER, maximum=MAX_DIAMETER):
+    diameter = np.asarray(diameter, dtype=float)
+    return np.where((diameter >= minimum) & (diameter <= maximum), diameter, np.nan)
+
+
+def dilation_speed(diameter, timestamps, ids):
+    """Max. absolute change per second to the previous and next sample of the segment (nan if both are missing)."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        speed = np.abs(np.diff(diameter) / np.diff(timestamps))
+    speed[(ids[1:] != ids[:-1]) | ~np.isfinite(speed)] = np.nan
+    return np.fmax(np.concatenate(([np.nan], speed)), np.concatenate((speed, [np.nan])))
+
+
+def remove_speed_outliers(diameter, timestamps, ids, multiplier=SPEED_MAD_MULTIPLIER):
+    speed = dilation_speed(diameter, timestamps, ids)
+    n_groups = ids[-1] + 1
+    median = _grouped_median(speed, ids, n_groups)
+    mad = _grouped_median(np.abs(speed - median[ids]), ids, n_groups)
+    threshold = (median + multiplier * mad)[ids]
+    return np.where(speed > threshold, np.nan, diameter)
+
+
+def missing_runs(missing, ids):
+    """First and last index of every run of missing samples, runs end at segment boundaries."""
+    missing = np.asarray(missing, dtype=bool)
+    run_start = missing.copy()
+    run_start[1:] &= ~missing[:-1] | (ids[1:] != ids[:-1])
+    run_end = missing.copy()
+    run_end[:-1] &= ~missing[1:] | (ids[1:] != ids[:-1])
+    return np.flatnonzero(run_start), np.flatnonzero(run_end)
+
+
+def pad_gaps(diameter, ids, rate, min_duration=GAP_MIN_DURATION, padding=GAP_PADDING):
+    """Remove the samples around gaps of at least min_duration (padding: seconds before and after)."""
+    first, last = missing_runs(np.isnan(diameter), ids)
+    # Gap duration: number of missing samples / sampling rate
+    duration = (last - first + 1) / rate
+    long_gaps = duration >= min_duration
+    first, last = first[long_gaps], last[long_gaps]
+    if len(first) == 0:
+        return diameter
+    segment_first, segment_last = _segment_bounds(ids)
+    pad_first = np.maximum(first - int(round(padding[0] * rate)), segment_first[first])
+    pad_last = np.minimum(last + int(round(padding[1] * rate)), segment_last[last])
+    # Difference array: +1 at the first, -1 after the last padded sample of every gap:
+    marks = np.zeros(len(diameter) + 1, dtype=np.int64)
+    np.add.at(marks, pad_first, 1)
+    np.add.at(marks, pad_last + 1, -1)
+    return np.where(np.cumsum(marks[:-1]) > 0, np.nan, diameter)
+
+
+def interpolate_gaps(values, timestamps, ids, max_gap=INTERPOLATION_MAX_GAP):
+    """Linear interpolation of missing samples between two valid samples of the segment at most max_gap apart."""
+    n = len(values)
+    valid = ~np.isnan(values)
+    index = np.arange(n)
+    previous = np.maximum.accumulate(np.where(valid, index, -1))
+    following = np.minimum.accumulate(np.where(valid, index, n)[::-1])[::-1]
+    fill = np.flatnonzero(~valid & (previous >= 0) & (following < n))
+    previous, following = previous[fill], following[fill]
+    fillable = (ids[previous] == ids[following]) & (timestamps[following] - timestamps[previous] <= max_gap)
+    fill, previous, following = fill[fillable], previous[fillable], following[fillable]
+
+    result = values.copy()
+    weight = (timestamps[fill] - timestamps[previous]) / (timestamps[following] - timestamps[previous])
+    result[fill] = values[previous] + weight * (values[following] - values[previous])
+    return result
+
+
+def merge_eyes(left, right, ids):
+    """Mean of both eyes, a missing eye is replaced by the other eye corrected by the mean offset of the segment."""
+    n_groups = ids[-1] + 1
+    offset = _grouped_mean(left - right, ids, n_groups)[ids]  # nan if the eyes are never valid together
+    offset = np.where(np.isnan(offset), 0, offset)
+    left_filled = np.where(np.isnan(left), right + offset, left)
+    right_filled = np.where(np.isnan(right), left - offset, right)
+    return (left_filled + right_filled) / 2
+
+
+def smooth(values, ids, window_samples):
+    """Centered moving average (missing samples ignored) within segments, window in samples."""
+    half = window_samples // 2
+    if half == 0:
+        return values
+    n = len(values)
+    valid = ~np.isnan(values)
+    sums = np.concatenate(([0], np.cumsum(np.where(valid, values, 0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    segment_first, segment_last = _segment_bounds(ids)
+    index = np.arange(n)
+    low = np.maximum(index - half, segment_first)
+    high = np.minimum(index + half, segment_last) + 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (sums[high] - sums[low]) / (counts[high] - counts[low])
+    return np.where(valid, mean, np.nan)  # gaps stay gaps
+
+
+def preprocess_pupil(left, right, timestamps, segments=None, rate=None):
+    """Preprocessed pupil diameter (pd) of a session.
+
+    left, right: pupil diameters (mm, e.g. left_pupil_measure1/right_pupil_measure1), timestamps in seconds.
+    segments: segment id per sample (e.g. trial index), samples of a segment adjacent and in time order.
+    rate: sampling rate in Hz, estimated from the timestamps by default.
+    Returns a dict of arrays: pd, left and right (after steps 1-4).
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    n = len(timestamps)
+    if n == 0:
+        empty = np.zeros(0)
+        return {'pd': empty, 'left': empty, 'right': empty}
+    ids = _segment_ids(segments, n)
+    rate = sampling_rate(timestamps) if rate is None else rate
+
+    eyes = {}
+    for eye, diameter in (('left', left), ('right', right)):
+        diameter = admissible_diameter(diameter)
+        diameter = remove_speed_outliers(diameter, timestamps, ids)
+        diameter = pad_gaps(diameter, ids, rate)
+        eyes[eye] = interpolate_gaps(diameter, timestamps, ids)
+
+    pd = merge_eyes(eyes['left'], eyes['right'], ids)
+    pd = smooth(pd, ids, int(round(SMOOTHING_WINDOW * rate)) | 1)
+    return {'pd': pd, 'left': eyes['left'], 'right': eyes['right']}
+
+
+def compare_with_reference(timestamps, pd, reference_timestamps, reference_pd):
+    """Compare pd with the output of the R package for the same samples (matched by timestamp)."""
+    reference = pandas.Series(np.asarray(reference_pd, dtype=float), index=np.asarray(reference_timestamps))
+    reference = reference[~reference.index.duplicated()]
+    timestamps = np.asarray(timestamps)
+    matched = reference.reindex(timestamps).to_numpy()
+    both = ~np.isnan(pd) & ~np.isnan(matched)
+    return {
+        'samples': len(pd),
+        'matched_samples': int(np.count_nonzero(np.isin(timestamps, reference.index))),
+        'missing_agreement': float(np.mean(np.isnan(pd) == np.isnan(matched))),
+        'max_abs_difference': float(np.max(np.abs(pd[both] - matched[both]))) if both.any() else np.nan,
+        'correlation': float(np.corrcoef(pd[both], matched[both])[0, 1]) if both.sum() > 1 else np.nan,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the pupil preprocessing with the R PupilPreprocess output.')
+    parser.add_argument('session', help='session .parquet of et_preprocessing.batch')
+    parser.add_argument('reference', help='.csv exported from R with the columns logged_time and pd')
+    parser.add_argument('--segment', default='trial_index', help='segment column of the session')
+    args = parser.parse_args()
+
+    session = pandas.read_parquet(args.session)
+    result = preprocess_pupil(
+        session['left_pupil_measure1'].to_numpy(), session['right_pupil_measure1'].to_numpy(),
+        session['logged_time'].to_numpy(), session[args.segment].to_numpy())
+    reference = pandas.read_csv(args.reference)
+    comparison = compare_with_reference(
+        session['logged_time'].to_numpy(), result['pd'], reference['logged_time'], reference['pd'])
+    print(f'sampling rate: {sampling_rate(session["logged_time"].to_numpy()):.1f} Hz')
+    for key, value in comparison.items():
+        print(f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    main()
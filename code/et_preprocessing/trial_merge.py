@@ -0,0 +1,133 @@
+import numpy as np
+import pandas
+
+# Assignment of eye tracking samples (logged_time) to trials, replaces fun_merge_all_ids of the R preprocessing.
+# The trial windows are found by binary search (searchsorted) in the sorted sample timestamps, O(trials * log
+# samples), instead of one scan of the recording per trial. The result is a pair of int arrays (sample index,
+# trial index): trial attributes are joined by index when they are needed, trial rows are not repeated.
+#
+# Trial windows of the tasks, as in 01_preprocessing_<task>.R:
+#   auditory-oddball:      [timestamp_exp, next timestamp_exp), last trial until max(logged_time) + 0.1,
+#                          baseline trials (baseline_trial_counter == 1) have no upper bound
+#   visual-oddball:        [stimulus_start_timestamp, ISI_end_timestamp]
+#   cued-visual-search,
+#   rapid-sound-sequences: [timestamp_exp, next timestamp_exp], last trial until max(logged_time)
+# Windows overlap for the open-ended baseline of the auditory oddball: samples can belong to several trials.
+
+LAST_TRIAL_PADDING = 0.1  # s, auditory oddball: end of the last trial after the last sample
+
+
+def _numeric(values):
+    # Trial columns as float, empty/NA values of the trial CSV are nan:
+    return np.asarray(values, dtype=float)
+
+
+def _next_onsets(starts, last_end):
+    return np.append(starts[1:], last_end)
+
+
+def _auditory_oddball_windows(trials, sample_ts):
+    starts = _numeric(trials['timestamp_exp'])
+    ends = _next_onsets(starts, np.nanmax(sample_ts) + LAST_TRIAL_PADDING)
+    baseline = _numeric(trials['baseline_trial_counter']) == 1
+    ends[baseline] = np.inf  # no upper bound for baseline
+    return starts, ends, False
+
+
+def _visual_oddball_windows(trials, sample_ts):
+    return _numeric(trials['stimulus_start_timestamp']), _numeric(trials['ISI_end_timestamp']), True
+
+
+def _next_trial_windows(trials, sample_ts):
+    starts = _numeric(trials['timestamp_exp'])
+    return starts, _next_onsets(starts, np.nanmax(sample_ts)), True
+
+
+TRIAL_WINDOWS = {
+    'auditory-oddball': _auditory_oddball_windows,
+    'visual-oddball': _visual_oddball_windows,
+    'cued-visual-search': _next_trial_windows,
+    'rapid-sound-sequences': _next_trial_windows,
+}
+
+
+def trial_windows(task, trials, sample_ts):
+    """Return the start and end time of every trial and whether the end is part of the window (closed)."""
+    if task not in TRIAL_WINDOWS:
+        raise ValueError(f'unknown task {task!r}, known tasks: {sorted(TRIAL_WINDOWS)}')
+    return TRIAL_WINDOWS[task](trials, sample_ts)
+
+
+def assign_samples(sample_ts, starts, ends, closed=False):
+    """Return (sample_index, trial_index): every sample in the window [start, end) (closed: [start, end]) of a trial.
+
+    Samples or windows with nan times are never matched, like which() in R. The pairs are ordered by trial, then
+    by sample time.
+    """
+    sample_ts = np.asarray(sample_ts, dtype=float)
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+
+    # logged_time is increasing, sorting is only a copy in that case:
+    order = np.argsort(sample_ts, kind='stable')
+    sorted_ts = sample_ts[order]
+    sorted_ts = sorted_ts[:np.count_nonzero(~np.isnan(sorted_ts))]  # nan is sorted to the end
+
+    valid = ~(np.isnan(starts) | np.isnan(ends))
+    first = np.zeros(len(starts), dtype=np.int64)
+    stop = np.zeros(len(starts), dtype=np.int64)
+    first[valid] = np.searchsorted(sorted_ts, starts[valid], side='left')
+    stop[valid] = np.searchsorted(sorted_ts, ends[valid], side='right' if closed else 'left')
+    counts = np.maximum(stop - first, 0)
+
+    trial_index = np.repeat(np.arange(len(starts)), counts)
+    # Position within the window of every pair, added to the first sample of its window:
+    window_offsets = np.cumsum(counts) - counts
+    positions = np.arange(counts.sum()) - np.repeat(window_offsets, counts) + np.repeat(first, counts)
+    return order[positions], trial_index
+
+
+class MergedSamples:
+    """Samples assigned to trials: samples[sample_index[i]] belongs to trials row trial_index[i].
+
+    samples: structured array of the sample table (iohub_reader), trials: trial table (pandas DataFrame).
+    """
+
+    def __init__(self, samples, trials, sample_index, trial_index):
+        self.samples = samples
+        self.trials = trials
+        self.sample_index = sample_index
+        self.trial_index = trial_index
+
+    def __len__(self):
+        return len(self.sample_index)
+
+    def sample_column(self, name):
+        return self.samples[name][self.sample_index]
+
+    def trial_column(self, name):
+        """A trial attribute for every merged sample (gathered by trial index)."""
+        return self.trials[name].to_numpy()[self.trial_index]
+
+    def trial_counts(self):
+        """Number of merged samples per trial row."""
+        return np.bincount(self.trial_index, minlength=len(self.trials))
+
+    def to_frame(self, sample_fields=None, trial_columns=None):
+        """The merged samples as a DataFrame (trial columns first), like the merged data frame of the R scripts."""
+        sample_fields = self.samples.dtype.names if sample_fields is None else sample_fields
+        trial_columns = self.trials.columns if trial_columns is None else trial_columns
+        columns = {name: self.trial_column(name) for name in trial_columns}
+        columns.update({name: self.sample_column(name) for name in sample_fields})
+        return pandas.DataFrame(columns)
+
+
+def merge_samples(task, samples, trials, time_field='logged_time'):
+    """Assign the samples of one recording to the trials of the task, returns MergedSamples."""
+    sample_ts = samples[time_field]
+    if len(trials) == 0 or len(sample_ts) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return MergedSamples(samples, trials, empty, empty)
+    starts, ends, closed = trial_windows(task, trials, sample_ts)
+    sample_index, trial_index = assign_samples(sample_ts, starts, ends, closed)
+    return MergedSamples(samples, trials, sample_index, trial_index)
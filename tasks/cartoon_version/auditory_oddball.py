@@ -8,10 +8,16 @@ os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
 os.environ["LSL_LOG_LEVEL"] = "fatal" # removes messages in CMD
 
 '''LOAD MODULES'''
-from psychopy import visual, core, event, clock, data, gui, monitors
-import random, time, numpy
+# Startup timings (tasks/shared/startup_profiler.py), set up before the task modules are imported:
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from shared.startup_profiler import StartupProfiler, TASK_MODULES, AUDIO_MODULES
+startup = StartupProfiler()
+startup.import_modules(TASK_MODULES + AUDIO_MODULES)
+from psychopy import visual, core, event, clock, data, monitors
+import random, time
 # For controlling eye tracker and eye-tracking SDK:
-import tobii_research as tr
 from psychopy.iohub import launchHubServer
 # For getting keyboard input:
 from psychopy.hardware import keyboard
@@ -23,21 +29,32 @@ from psychopy.monitors import Monitor
 #prefs.hardware['audioLatencyMode'] = 3 # high sound priority, low latency mode
 from psychopy import sound
 import psychtoolbox as ptb #sound processing via ptb
-# For managing paths:
-from pathlib import Path
 # For logging data in a .log file:
 import logging
 from datetime import datetime
 import json
-import sys
-import csv
+# Shared task components (tasks/shared):
+from shared.task_logging import setup_task_logging
+from shared.session import task_window, marker_outlet, find_eyetrackers, task_ready, end_task
+from shared.lazy_import import lazy_module
+from shared.tracker_cache import gaze_output_frequencies
+from shared.gaze_redirect import get_gaze_redirect
+from shared.gaze_stream import GazeStream
+from shared.trial_store import write_trial_store
+from shared.trial_schemas import TRIAL_SCHEMAS
+from shared.trial_journal import TrialJournal
+from shared.gaze_contingent import GazeContingentEngine, FIXED
+from shared.background_animation import BackgroundAnimation
 
 #send trigger via LSL
 from pylsl import StreamInfo, StreamOutlet
+# Dialog toolkit only imported when the pause or quit dialog is opened:
+gui = lazy_module('psychopy.gui')
 
 # Load the config file
-with open("tasks/cartoon_version/config.json", "r") as file:
-    config = json.load(file)
+with startup.phase('config'):
+    with open("tasks/cartoon_version/config.json", "r") as file:
+        config = json.load(file)
 
 # Select the task (e.g., "rapid-sound-sequences")
 task_name = "auditory-oddball"
@@ -58,11 +75,11 @@ if not logging_path.exists():
 else:
     print(f"Directory {logging_path} already exists. Continuing to use it.")
 
-logging.basicConfig(
-    level = logging.DEBUG,
-    filename = filename_auditory_oddball,
-    filemode = 'w', # w = write, for each subject an separate log file.
-    format = '%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+# Non-blocking task logging via a queue and a listener thread (tasks/shared/task_logging.py),
+# console output is written to the log file in production mode:
+setup_task_logging(
+    filename_auditory_oddball,
+    production=config["constants"]["production_mode"])
 
 trials_data_folder = Path(task_config["data_paths"]["trials"]).resolve()
 eyetracking_data_folder = Path(task_config["data_paths"]["eyetracking"]).resolve()
@@ -95,7 +112,7 @@ info = StreamInfo(
     channel_format='string',  # Markers are usually strings
     source_id='stimulus_stream'  # Unique ID for your experiment/session
 )
-outlet = StreamOutlet(info)
+outlet = marker_outlet(lambda: StreamOutlet(info))  # battery outlet in in-process mode
 
 # Experimental settings:
 # Input dialogue boxes are presented on external screen 0.
@@ -148,36 +165,35 @@ exp = data.ExperimentHandler(
     extraInfo = settings,
     dataFileName = str(trials_data_folder / fileName),
     )
-# BACKUP CSV SET UP
-
-backup_path = str(trials_data_folder / (fileName + "_backup.csv"))
-
-# Create file with headers once at the beginning
-with open(backup_path, "w", newline="") as f:
-    writer = csv.writer(f)
-    writer.writerow([
-        "trial_num",
-        "phase",
-        "condition",
-        "baseline_trial_counter",
-        "oddball_trial_counter",
-        "standard_trial_counter",
-        "timestamp",
-        "timestamp_exp",
-        "timestamp_tracker",
-        "ISI_expected",
-        "ISI_duration",
-        "ISI_start_time",
-        "ISI_end_time",
-        "gaze_offset_duration",
-        "trial_pause_duration",
-        "trial_nodata_duration",
-        "stimulus_duration",
-        "stimulus_start_time",
-        "stimulus_end_time",
-        "oddball_frequency",
-        "standard_frequency"
-    ])
+# BACKUP JOURNAL SET UP
+
+backup_path = str(trials_data_folder / (fileName + "_backup.jsonl"))
+
+# Backup journal, rows are written by a background thread (tasks/shared/trial_journal.py).
+# Rebuild the backup CSV: python -m tasks.shared.trial_journal <journal.jsonl>
+backup_journal = TrialJournal(backup_path, [
+    "trial_num",
+    "phase",
+    "condition",
+    "baseline_trial_counter",
+    "oddball_trial_counter",
+    "standard_trial_counter",
+    "timestamp",
+    "timestamp_exp",
+    "timestamp_tracker",
+    "ISI_expected",
+    "ISI_duration",
+    "ISI_start_time",
+    "ISI_end_time",
+    "gaze_offset_duration",
+    "trial_pause_duration",
+    "trial_nodata_duration",
+    "stimulus_duration",
+    "stimulus_start_time",
+    "stimulus_end_time",
+    "oddball_frequency",
+    "standard_frequency"
+])
 
 def log_trial(
     trial_num,
@@ -203,34 +219,30 @@ def log_trial(
     standard_frequeny =None
 
 ):
-    """Write one trial row to backup CSV and flush immediately."""
-    with open(backup_path, "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            trial_num,
-            phase,
-            trial,
-            baseline_trial_counter,
-            oddball_trial_counter,
-            standard_trial_counter,
-            timestamp,
-            timestamp_exp,
-            timestamp_tracker,
-            ISI_expected,
-            ISI_duration,
-            ISI_start_time,
-            ISI_end_time,
-            gaze_offset_duration,
-            trial_pause_duration,
-            trial_nodata_duration,
-            stimulus_duration,
-            stimulus_start_time,
-            stimulus_end_time,
-            oddball_frequency,
-            standard_frequeny
-        ])
-        f.flush()
-        os.fsync(f.fileno())
+    """Queue one trial row for the backup journal."""
+    backup_journal.write([
+        trial_num,
+        phase,
+        trial,
+        baseline_trial_counter,
+        oddball_trial_counter,
+        standard_trial_counter,
+        timestamp,
+        timestamp_exp,
+        timestamp_tracker,
+        ISI_expected,
+        ISI_duration,
+        ISI_start_time,
+        ISI_end_time,
+        gaze_offset_duration,
+        trial_pause_duration,
+        trial_nodata_duration,
+        stimulus_duration,
+        stimulus_start_time,
+        stimulus_end_time,
+        oddball_frequency,
+        standard_frequeny
+    ])
 
 MONITOR_NAME = config["constants"]["monitor"]["name"]
 
@@ -239,37 +251,26 @@ mon.setWidth(config["constants"]["monitor"]["width_cm"])  # Physical width of th
 mon.setDistance(config["constants"]["monitor"]["distance_cm"])  # Distance from participant
 mon.setSizePix([config["constants"]["monitor"]["width"], config["constants"]["monitor"]["height"]])  # Screen resolution
 
-mywin = visual.Window(
-    size=(config["constants"]["monitor"]["width"], config["constants"]["monitor"]["height"]),
-    fullscr=config["constants"]["psychopy_window"]["fullscreen"],
-    screen=config["constants"]["presentation_screen"],
-    color=config["constants"]["psychopy_window"]["background_color"],
-    monitor=MONITOR_NAME,
-    units='pix'
-)
+with startup.phase('window'):
+    mywin = task_window(config)  # battery window in in-process mode (runner.py)
 
 # Check for video file
 #video_path = ['media/background/background_video.mp4']
-video_width, video_height = 1920, 1080  # Native resolution of your video
-target_width = size_fixation_cross_in_pixels * 6
-scale_factor = target_width / video_width
-scaled_width = target_width
-scaled_height = video_height * scale_factor
+target_width = size_fixation_cross_in_pixels * 6  # height follows the aspect ratio of the video
 
-cartoon_movie = visual.MovieStim(
+# Looping background cartoon from pre-decoded frame textures (media cache, see tasks/shared/clip_cache.py),
+# no video decoding while the sounds are played:
+cartoon_movie = BackgroundAnimation(
                 mywin,
                 filename='media/background/background_video.mp4',
-                size=(scaled_width, scaled_height),
+                width=target_width,
                 pos=(0, 0),
-                loop=True,  # Changed to True for continuous play
-                noAudio=True,
-                autoStart=True
+                cache_folder=Path(config["media_cache"])
 )
 
 
 def draw_background_cartoon():
-    if cartoon_movie.status != visual.FINISHED:
-        cartoon_movie.draw()
+    cartoon_movie.draw()
 
 refresh_rate = mywin.monitorFramePeriod #get monitor refresh rate in seconds
 print('monitor refresh rate: ' + str(round(refresh_rate, 3)) + ' seconds')
@@ -277,25 +278,26 @@ print('monitor refresh rate: ' + str(round(refresh_rate, 3)) + ' seconds')
 # Two different sound frequencies (conditions) are balanced across groups and
 # saved in the settings dictionary:
 random_number = random.random()
-if random_number < 0.5:
-    standard_sound = sound.Sound(sound_one_in_Hz, stereo=False)
-    oddball_sound = sound.Sound(sound_two_in_Hz, stereo=False)
-    sound_standard = sound_one_in_Hz
-    sound_oddball = sound_two_in_Hz
-    print('oddball sound is ', sound_two_in_Hz,' Hz')
-    logging.info(' ODDBALL SOUND IS : ' f'{sound_two_in_Hz}' ' Hz')
-    settings['standard_frequency'] = sound_one_in_Hz
-    settings['oddball_frequency'] = sound_two_in_Hz
-
-if random_number >= 0.5:
-    standard_sound = sound.Sound(sound_two_in_Hz, stereo=False)
-    oddball_sound = sound.Sound(sound_one_in_Hz, stereo=False)
-    sound_standard = sound_two_in_Hz
-    sound_oddball = sound_one_in_Hz
-    print('oddball sound is ', sound_one_in_Hz,' Hz')
-    logging.info(' ODDBALL SOUND IS : ' f'{sound_one_in_Hz}' ' Hz')
-    settings['standard_frequency'] = sound_two_in_Hz 
-    settings['oddball_frequency'] = sound_one_in_Hz 
+with startup.phase('sound'):
+    if random_number < 0.5:
+        standard_sound = sound.Sound(sound_one_in_Hz, stereo=False)
+        oddball_sound = sound.Sound(sound_two_in_Hz, stereo=False)
+        sound_standard = sound_one_in_Hz
+        sound_oddball = sound_two_in_Hz
+        print('oddball sound is ', sound_two_in_Hz,' Hz')
+        logging.info(' ODDBALL SOUND IS : ' f'{sound_two_in_Hz}' ' Hz')
+        settings['standard_frequency'] = sound_one_in_Hz
+        settings['oddball_frequency'] = sound_two_in_Hz
+
+    if random_number >= 0.5:
+        standard_sound = sound.Sound(sound_two_in_Hz, stereo=False)
+        oddball_sound = sound.Sound(sound_one_in_Hz, stereo=False)
+        sound_standard = sound_two_in_Hz
+        sound_oddball = sound_one_in_Hz
+        print('oddball sound is ', sound_one_in_Hz,' Hz')
+        logging.info(' ODDBALL SOUND IS : ' f'{sound_one_in_Hz}' ' Hz')
+        settings['standard_frequency'] = sound_two_in_Hz 
+        settings['oddball_frequency'] = sound_one_in_Hz 
 
 #Setup Eye Tracking:
 if testmode_et:
@@ -308,19 +310,22 @@ else:
     logging.info('TESTMODE = FALSE')
     
     # Search for eye trackers:
-    found_eyetrackers = tr.find_all_eyetrackers()
+    with startup.phase('tracker_discovery'):
+        found_eyetrackers = find_eyetrackers()
     if not found_eyetrackers:
         raise RuntimeError("No eye tracker found. Please check the connection.")
     
     # Select the first available eye tracker:
     my_eyetracker = found_eyetrackers[0]
-    sampling_rate = my_eyetracker.get_all_gaze_output_frequencies()[0]
+    # Frequencies from the tracker cache of the battery (asked once if the task runs on its own):
+    gaze_frequencies = gaze_output_frequencies(my_eyetracker)
+    sampling_rate = gaze_frequencies[0]
     
     # Log eye tracker details:
     print(f"Tracker connected:\n"
           f"Address: {my_eyetracker.address}\n"
           f"Model: {my_eyetracker.model}\n"
-          f"Sampling Rates: {my_eyetracker.get_all_gaze_output_frequencies()}")
+          f"Sampling Rates: {gaze_frequencies}")
     logging.info(f"ADDRESS: {my_eyetracker.address}")
     logging.info(f"MODEL: {my_eyetracker.model}")
     logging.info(f"SERIAL NUMBER: {my_eyetracker.serial_number}")
@@ -334,13 +339,14 @@ else:
     }
 
 # Launch ioHub server:
-io = launchHubServer(
-    **iohub_config,
-    experiment_code=str(eyetracking_data_folder),
-    session_code=fileName,
-    datastore_name=str(eyetracking_data_folder / fileName),
-    window=mywin
-)
+with startup.phase('iohub'):
+    io = launchHubServer(
+        **iohub_config,
+        experiment_code=str(eyetracking_data_folder),
+        session_code=fileName,
+        datastore_name=str(eyetracking_data_folder / fileName),
+        window=mywin
+    )
 
 # Initialize tracker
 tracker = io.devices.tracker
@@ -350,6 +356,8 @@ if not tracker:
 # Start eye tracker recording
 print("Tracker successfully initialized!")
 tracker.setRecordingState(True)
+task_ready()
+startup.save(Path(logging_path, fileName + '_startup.json'), task=task_name)
 
 # SETUP KEYBORD
 kb = keyboard.Keyboard()
@@ -379,90 +387,11 @@ def draw_fixcross(background_color=background_color_rgb, cross_color = 'black'):
     line1.draw()
     line2.draw()
 
+gaze_redirect = get_gaze_redirect(mywin, size_fixation_cross_in_pixels, background_color_rgb)
+
 # Draw figure when gaze is offset for gaze contigency:
 def draw_gazedirect(background_color=background_color_rgb):
-    # Adapt background according to provided "background_color"
-    if background_color is not background_color_rgb:
-        background_rect = visual.Rect(
-            win = mywin,
-            size = mywin.size,
-            fillColor = background_color)
-        background_rect.draw()
-    function_color = 'red'
-    arrow_size_pix = size_fixation_cross_in_pixels
-    arrow_pos_offset = 5
-    width = 3
-
-    rect1 = visual.Rect(
-        win = mywin,
-        units = 'pix',
-        lineColor = function_color,
-        fillColor = background_color,
-        lineWidth = width,
-        size = size_fixation_cross_in_pixels*6)
-
-    # Arrow left:
-    al_line1 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    al_line1.start = [-(arrow_size_pix*arrow_pos_offset), 0]
-    al_line1.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line2 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    al_line2.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    al_line2.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line3 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    al_line3.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    al_line3.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow right:
-    ar_line1 = visual.Line(win = mywin, units='pix', lineColor = function_color, lineWidth = width)
-    ar_line1.start = [+(arrow_size_pix*arrow_pos_offset), 0]
-    ar_line1.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line2 = visual.Line(win = mywin, units='pix', lineColor = function_color, lineWidth = width)
-    ar_line2.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    ar_line2.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line3 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line3.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    ar_line3.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow top:
-    at_line1 = visual.Line(win = mywin, units='pix', lineColor = function_color, lineWidth = width)
-    at_line1.start = [0, +(arrow_size_pix*arrow_pos_offset)]
-    at_line1.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line2 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line2.start = [-arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line2.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line3 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line3.start = [+arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line3.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Arrow bottom:
-    ab_line1 = visual.Line(win = mywin, units='pix', lineColor = function_color, lineWidth = width)
-    ab_line1.start = [0, -(arrow_size_pix*arrow_pos_offset)]
-    ab_line1.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line2 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line2.start = [+arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line2.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line3 = visual.Line(win = mywin, units='pix', lineColor = function_color, lineWidth = width)
-    ab_line3.start = [-arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line3.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    #draw all
-    al_line1.draw()
-    al_line2.draw()
-    al_line3.draw()
-
-    ar_line1.draw()
-    ar_line2.draw()
-    ar_line3.draw()
-
-    at_line1.draw()
-    at_line2.draw()
-    at_line3.draw()
-
-    ab_line1.draw()
-    ab_line2.draw()
-    ab_line3.draw()
-
-    rect1.draw()
+    gaze_redirect.draw(background_color)
 
 # Check for keypresses, used to pause and quit experiment:
 def check_keypress():
@@ -481,7 +410,7 @@ def check_keypress():
         dlg.show()  # show dialog and wait for OK or Cancel
         if dlg.OK:  # or if ok_data is not None
             print('EXPERIMENT ABORTED!')
-            core.quit()
+            end_task()
         else:
             print('Experiment continues...')
             current_screen = presentation_screen
@@ -500,69 +429,23 @@ def check_keypress():
     pause_time = round(pause_time,3)
     return pause_time
 
-def check_nodata(gaze_position):
-    if gaze_position == None:
-        nodata_boolean = True
-    else:
-        nodata_boolean = False
-    return nodata_boolean
-
-# Get gaze position and offset cutoff.
-# Then check for the offset of gaze from the center screen.
-def check_gaze_offset(gaze_position):
-    gaze_center_offset = numpy.sqrt((gaze_position[0])**2 + (gaze_position[1])**2) #pythagoras theorem
-    if gaze_center_offset >= gaze_offset_cutoff:
-        offset_boolean = True
-    else:
-        offset_boolean = False
-    return offset_boolean
+gaze_engine = GazeContingentEngine(
+    mywin,
+    GazeStream(tracker, gaze_offset_cutoff),
+    keypress_check=check_keypress,
+    draw_offset=draw_gazedirect)
 
 # Fixation cross: Check for data availability and screen center gaze.
 def fixcross_gazecontingent(duration_in_seconds, background_color = background_color_rgb, cross_color = 'black'):
-    # Translate duration to number of frames:
-    number_of_frames = round(duration_in_seconds/refresh_rate)
-    timestamp = core.getTime()
-    gaze_offset_duration = 0
-    pause_duration = 0
-    nodata_duration = 0
-    # Cross presentation for number of frames:
-    for frameN in range(number_of_frames):
-        # Check for keypress:
-        pause_duration += check_keypress()
-        # Check for eye tracking data, only call once per flip:
-        gaze_position = tracker.getPosition()
-        # Check for eye tracking data:
-        if check_nodata(gaze_position):
-            print('warning: no eyes detected')
-            logging.warning(' NO EYES DETECTED')
-            frameN = 1 # reset duration of for loop - resart ISI
-            nodata_current_duration = 0
-
-            while check_nodata(gaze_position):
-                mywin.flip() #wait for monitor refresh time
-                nodata_duration += refresh_rate
-                nodata_current_duration += refresh_rate
-                gaze_position = tracker.getPosition() #get new gaze data
-        # Check for gaze:
-        elif check_gaze_offset(gaze_position):
-            print('warning: gaze offset')
-            frameN = 1 #reset duration of for loop - resart ISI
-
-            while not check_nodata(gaze_position) and check_gaze_offset(gaze_position):
-                # Listen for keypress:
-                pause_duration += check_keypress()
-                draw_gazedirect(background_color) #redirect attention to fixation cross area
-                mywin.flip() #wait for monitor refresh time
-                gaze_offset_duration += refresh_rate
-                gaze_position = tracker.getPosition() #get new gaze data
-        # Draw fixation cross:
-        draw_fixcross(background_color, cross_color)
-        mywin.flip()
+    # Cross presentation, extended by no data and gaze offset time:
+    result = gaze_engine.run(
+        duration_in_seconds,
+        draw_normal=lambda: draw_fixcross(background_color, cross_color),
+        draw_offset=lambda: draw_gazedirect(background_color)) #redirect attention to fixation cross area
 
     # Generate output info:
-    actual_fixcross_duration = round(core.getTime()-timestamp,3)
-    gaze_offset_duration = round(gaze_offset_duration,3)
-    nodata_duration = round(nodata_duration,3)
+    number_of_frames = sum(result.frames.values())
+    [actual_fixcross_duration, gaze_offset_duration, pause_duration, nodata_duration] = result.as_list()
 
     print('numberof frames: ' + str(number_of_frames))
     logging.info(' NUMBER OF FRAMES: ' f'{number_of_frames}')
@@ -578,35 +461,22 @@ def fixcross_gazecontingent(duration_in_seconds, background_color = background_c
     return [actual_fixcross_duration, gaze_offset_duration, pause_duration, nodata_duration]
 
 
-def monitor_gaze_and_overlay():
-    gaze_position = tracker.getPosition()
-
-    if check_nodata(gaze_position):
-        draw_gazedirect()  # draw on top of cartoon
-        logging.warning('NO EYES DETECTED')
-
-    elif check_gaze_offset(gaze_position):
-        draw_gazedirect()  # draw on top of cartoon
-        logging.warning('GAZE OFFSET')
+def draw_cartoon_with_gazedirect():
+    draw_background_cartoon()
+    draw_gazedirect()  # draw on top of cartoon
 
 def run_ISI_with_cartoon(ISI_duration):
-    number_of_frames = round(ISI_duration / refresh_rate)
-    isi_start_time = core.getTime()
-    gaze_offset_duration = 0
-    nodata_duration = 0
-    pause_duration = 0
-
-    while (core.getTime() - isi_start_time) < ISI_duration:
-        pause_duration += check_keypress()
-
-        draw_background_cartoon()
-        monitor_gaze_and_overlay()
-
-        mywin.flip()
-
-    isi_end_time = core.getTime()  # Timestamp at ISI end
-
-    actual_duration = round(isi_end_time - isi_start_time, 3)
+    # Cartoon keeps playing for the fixed ISI, the gaze redirect is drawn on top while gaze is lost:
+    result = gaze_engine.run(
+        ISI_duration,
+        draw_normal=draw_background_cartoon,
+        draw_offset=draw_cartoon_with_gazedirect,
+        draw_nodata=draw_cartoon_with_gazedirect,
+        mode=FIXED)
+
+    isi_start_time = result.start_time
+    isi_end_time = result.end_time  # Timestamp at ISI end
+    actual_duration, gaze_offset_duration, pause_duration, nodata_duration = result.as_list()
 
     return actual_duration, isi_start_time, isi_end_time, gaze_offset_duration, pause_duration, nodata_duration
 
@@ -627,10 +497,13 @@ def present_stimulus(duration_in_seconds, trial):
         logging.info(f'STANDARD PLAYED: {sound_standard} Hz')
 
     # Display the stimulus for the desired duration
-    while (core.getTime() - stim_start_time) < duration_in_seconds:
-        draw_background_cartoon()
-        monitor_gaze_and_overlay()
-        mywin.flip()
+    gaze_engine.run(
+        duration_in_seconds,
+        draw_normal=draw_background_cartoon,
+        draw_offset=draw_cartoon_with_gazedirect,
+        draw_nodata=draw_cartoon_with_gazedirect,
+        mode=FIXED,
+        check_keys=False)
 
     # Stop sounds to ensure they don’t linger (optional, based on stimulus duration)
     oddball_sound.stop()
@@ -723,9 +596,10 @@ try:
                 trials.addData('ISI_duration', isi_duration)
                 trials.addData('ISI_start_time', isi_start)
                 trials.addData('ISI_end_time', isi_end)
-                trials.addData('gaze_offset_duration', offset_duration)
+                trials.addData('gaze_offset_duration', gaze_offset_duration)
                 trials.addData('trial_pause_duration', pause_duration)
                 trials.addData('trial_nodata_duration', nodata_duration)
+                gaze_engine.add_episodes(trials)
                 trials.addData('timestamp', timestamp) 
                 trials.addData('timestamp_exp', timestamp_exp) 
                 trials.addData('timestamp_tracker', timestamp_tracker)
@@ -792,9 +666,10 @@ try:
                 trials.addData('ISI_duration', isi_duration)
                 trials.addData('ISI_start_time', isi_start)
                 trials.addData('ISI_end_time', isi_end)
-                trials.addData('gaze_offset_duration', offset_duration)
+                trials.addData('gaze_offset_duration', gaze_offset_duration)
                 trials.addData('trial_pause_duration', pause_duration)
                 trials.addData('trial_nodata_duration', nodata_duration)
+                gaze_engine.add_episodes(trials)
                 trials.addData('stimulus_duration', stimulus_duration)
                 trials.addData('stimulus_start_time', stim_start)
                 trials.addData('stimulus_end_time', stim_end)
@@ -845,6 +720,7 @@ try:
             phase_handler.addData('gaze_offset_duration', offset_duration)
             phase_handler.addData('trial_pause_duration', pause_duration)
             phase_handler.addData('trial_nodata_duration', nodata_duration)
+            gaze_engine.add_episodes(phase_handler)
             phase_handler.addData('baseline_trial_counter',baseline_trial_counter)
             phase_handler.addData('trial', phase)
             phase_handler.addData('timestamp', timestamp)
@@ -870,6 +746,9 @@ finally:
     print("Saving data safely...")
     exp.saveAsWideText(str(trials_data_folder / (fileName + ".csv")), delim=",")
     exp.saveAsPickle(str(trials_data_folder / (fileName + ".psydat")))
+    # Write the queued backup rows (also on abort or error):
+    backup_journal.close()
+    write_trial_store(exp, trials_data_folder / (fileName + ".parquet"), TRIAL_SCHEMAS[Path(__file__).stem])
 
    # logging.info(f"Saving data to: {trials_data_folder / fileName}")
    # exp.saveAsWideText(str(trials_data_folder / fileName), delim=",")   
@@ -892,5 +771,4 @@ tracker.setRecordingState(False)
 # Close iohub instance:
 io.quit()
 # Close window:
-mywin.close()
-core.quit()
\ No newline at end of file
+end_task(mywin)
\ No newline at end of file
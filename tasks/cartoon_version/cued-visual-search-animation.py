@@ -1,27 +1,43 @@
 # Import necessary modules
+# Startup timings (tasks/shared/startup_profiler.py), set up before the task modules are imported:
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from shared.startup_profiler import StartupProfiler, TASK_MODULES, AUDIO_MODULES
+startup = StartupProfiler()
+startup.import_modules(TASK_MODULES + AUDIO_MODULES)
 from psychopy import prefs
 from psychopy.hardware import keyboard
-from psychopy import visual, core, sound, gui, data, clock
-import tobii_research as tr
+from psychopy import visual, core, sound, data, clock
 from psychopy.iohub import launchHubServer
 from psychopy.monitors import Monitor
-import random, numpy
-# Library for managing paths
-from pathlib import Path
+import random
 # For logging data in a .log file:
 import logging
 from datetime import datetime
-import os, csv
+import os
 from datetime import datetime
 import json
-import sys
+# Shared task components (tasks/shared):
+from shared.task_logging import setup_task_logging
+from shared.session import task_window, marker_outlet, find_eyetrackers, task_ready, end_task
+from shared.lazy_import import lazy_module
+from shared.gaze_redirect import get_gaze_redirect
+from shared.gaze_stream import GazeStream
+from shared.trial_store import write_trial_store
+from shared.trial_schemas import TRIAL_SCHEMAS
+from shared.trial_journal import TrialJournal
+from shared.gaze_contingent import GazeContingentEngine, FIXED
 
 #send trigger via LSL
 from pylsl import StreamInfo, StreamOutlet
+# Dialog toolkit only imported when the pause or quit dialog is opened:
+gui = lazy_module('psychopy.gui')
 
 # Load the config file
-with open("tasks/cartoon_version/config.json", "r") as file:
-    config = json.load(file)
+with startup.phase('config'):
+    with open("tasks/cartoon_version/config.json", "r") as file:
+        config = json.load(file)
 
 print("Available tasks:", config["tasks"].keys())  # Debugging step
 # Select the task 
@@ -42,11 +58,11 @@ if not logging_path.exists():
 else:
     print(f"Directory {logging_path} already exists. Continuing to use it.")
 
-logging.basicConfig(
-    level = logging.DEBUG,
-    filename = filename_visual_search,
-    filemode = 'w', # w = write, for each subject an separate log file.
-    format = '%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+# Non-blocking task logging via a queue and a listener thread (tasks/shared/task_logging.py),
+# console output is written to the log file in production mode:
+setup_task_logging(
+    filename_visual_search,
+    production=config["constants"]["production_mode"])
     
 trials_data_folder = Path(task_config["data_paths"]["trials"]).resolve()
 eyetracking_data_folder = Path(task_config["data_paths"]["eyetracking"]).resolve()
@@ -71,66 +87,62 @@ num_trials = 30
 #num_trials = 5 # Set to 5 for testing, change to 30 for full experiment
 # Initialize a trial counter 
 
-import csv, os
-
-# Define backup CSV path
-backup_path = trials_data_folder / (fileName + "_backup.csv")
-
-# Create backup CSV file with header if it doesn't exist
-if not os.path.exists(backup_path):
-    with open(backup_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            # General trial info
-            "trial_number",
-            "timestamp_exp",
-            "trial_start_timestamp",
-            "trial_end_timestamp",
-            
-            # Colors & target
-            "base_color",
-            "target_color",
-            "target_position_index",
-            "target_position",
-            
-            # ISI info
-            "ISI_start_timestamp",
-            "ISI_end_timestamp",
-            "ISI_expected",
-            "ISI_duration_timestamp",
-            "ISI_actual_duration",
-            "ISI_Gaze_Offset_Duration",
-            "ISI_nodata_Duration",
-            "ISI_Pause_Duration",
-            
-            # Beep info
-            "auditory_cue",
-            "beep_phase_start_timestamp",
-            "beep_phase_end_timestamp",
-            "beep_start_timestamp",
-            "beep_end_timestamp",
-            "actual_beep_duration",
-            "expected_beep_duration",
-            "nodata_beep_interval",
-            "actual_beep_phase_duration",
-            "delay_beep_phase",
-            
-            # Visual search
-            "actual_visual_search_duration",
-            "nodata_visual_search",
-            
-            # Trial duration
-            "trial_duration",
-            
-            # Baseline fixation
-            "baseline_fixation_start_timestamp",
-            "baseline_fixation_end_timestamp",
-            "baseline_fixation_duration",
-            "baseline_fixation_actual_isi_duration",
-            "baseline_fixation_gaze_offset_duration",
-            "baseline_fixation_pause_duration",
-            "baseline_fixation_nodata_duration"
-        ])
+# Define backup journal path
+backup_path = trials_data_folder / (fileName + "_backup.jsonl")
+
+# Backup journal, rows are written by a background thread (tasks/shared/trial_journal.py).
+# Rebuild the backup CSV: python -m tasks.shared.trial_journal <journal.jsonl>
+backup_journal = TrialJournal(backup_path, [
+    # General trial info
+    "trial_number",
+    "timestamp_exp",
+    "trial_start_timestamp",
+    "trial_end_timestamp",
+
+    # Colors & target
+    "base_color",
+    "target_color",
+    "target_position_index",
+    "target_position",
+
+    # ISI info
+    "ISI_start_timestamp",
+    "ISI_end_timestamp",
+    "ISI_expected",
+    "ISI_duration_timestamp",
+    "ISI_actual_duration",
+    "ISI_Gaze_Offset_Duration",
+    "ISI_nodata_Duration",
+    "ISI_Pause_Duration",
+
+    # Beep info
+    "auditory_cue",
+    "beep_phase_start_timestamp",
+    "beep_phase_end_timestamp",
+    "beep_start_timestamp",
+    "beep_end_timestamp",
+    "actual_beep_duration",
+    "expected_beep_duration",
+    "nodata_beep_interval",
+    "actual_beep_phase_duration",
+    "delay_beep_phase",
+
+    # Visual search
+    "actual_visual_search_duration",
+    "nodata_visual_search",
+
+    # Trial duration
+    "trial_duration",
+
+    # Baseline fixation
+    "baseline_fixation_start_timestamp",
+    "baseline_fixation_end_timestamp",
+    "baseline_fixation_duration",
+    "baseline_fixation_actual_isi_duration",
+    "baseline_fixation_gaze_offset_duration",
+    "baseline_fixation_pause_duration",
+    "baseline_fixation_nodata_duration"
+])
 
 # Function to append trial or baseline data
 def log_backup_trial(
@@ -210,11 +222,7 @@ def log_backup_trial(
         baseline_fixation_nodata_duration
     ]
 
-    with open(backup_path, "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(row)
-        f.flush()
-        os.fsync(f.fileno())
+    backup_journal.write(row)
 
 # Experiment handler saves experiment data automatically.
 exp = data.ExperimentHandler(
@@ -250,7 +258,7 @@ info = StreamInfo(
     channel_format='string',  # Markers are usually strings
     source_id='stimulus_stream'  # Unique ID for your experiment/session
 )
-outlet = StreamOutlet(info)
+outlet = marker_outlet(lambda: StreamOutlet(info))  # battery outlet in in-process mode
 
 # Access values
 audio_device = config["constants"]["audio"]["device"]
@@ -273,14 +281,8 @@ mon.setWidth(config["constants"]["monitor"]["width_cm"])  # Physical width of th
 mon.setDistance(config["constants"]["monitor"]["distance_cm"])  # Distance from participant
 mon.setSizePix([config["constants"]["monitor"]["width"], config["constants"]["monitor"]["height"]])  # Screen resolution
 
-win = visual.Window(
-    size=(config["constants"]["monitor"]["width"], config["constants"]["monitor"]["height"]),
-    fullscr=config["constants"]["psychopy_window"]["fullscreen"],
-    screen=config["constants"]["presentation_screen"],
-    color=config["constants"]["psychopy_window"]["background_color"],
-    monitor=MONITOR_NAME,
-    units='pix'
-)
+with startup.phase('window'):
+    win = task_window(config)  # battery window in in-process mode (runner.py)
 
 refresh_rate = win.monitorFramePeriod #get monitor refresh rate in seconds
 print('monitor refresh rate: ' + str(round(refresh_rate, 3)) + ' seconds')
@@ -294,7 +296,8 @@ if testmode_et:
 if not testmode_et:
     logging.info('TESTMODE = FALSE')
     # Search for eye tracker:
-    found_eyetrackers = tr.find_all_eyetrackers()
+    with startup.phase('tracker_discovery'):
+        found_eyetrackers = find_eyetrackers()
     my_eyetracker = found_eyetrackers[0]
     print("Address: " + my_eyetracker.address)
     logging.info(' ADDRESS: ' f'{my_eyetracker.address}')
@@ -309,15 +312,17 @@ if not testmode_et:
         {'name': 'tracker', 'runtime_settings': {'sampling_rate': sampling_rate, }}}
     
 # IOHUB creates a different instance that records eye tracking data in hdf5 file saved in datastore_name:
-io = launchHubServer(**iohub_config,
-                        experiment_code = str(eyetracking_data_folder),
-                        session_code = fileName,
-                        datastore_name = str(eyetracking_data_folder / fileName), #where data is stored
-                        window = win)
+with startup.phase('iohub'):
+    io = launchHubServer(**iohub_config,
+                            experiment_code = str(eyetracking_data_folder),
+                            session_code = fileName,
+                            datastore_name = str(eyetracking_data_folder / fileName), #where data is stored
+                            window = win)
 
 # Call the eyetracker device and start recording - different instance:
 tracker = io.devices.tracker
 tracker.setRecordingState(True)
+task_ready()
 print(tracker)
 
 #Send a trigger (marker) function
@@ -325,110 +330,14 @@ def send_trigger(marker):
     # marker must be a list of strings, length = channel_count
     outlet.push_sample(marker)
 
+gaze_redirect = get_gaze_redirect(win, size_fixation_cross_in_pixels, background_color_rgb)
+
 # Draw figure for gaze contincency, when gaze is offset:
 def draw_gazedirect(background_color = background_color_rgb):
-        # Adapt background according to provided "background color"
-    if background_color is not background_color_rgb:
-        background_rect = visual.Rect(
-            win = win,
-            size = win.size,
-            fillColor = background_color)
-        background_rect.draw()
-    # Parameters:
-    function_color = 'red'
-    arrow_size_pix = size_fixation_cross_in_pixels
-    arrow_pos_offset = 5
-    width = 3
-
-    rect1 = visual.Rect(
-        win = win,
-        units = 'pix',
-        lineColor = function_color,
-        fillColor = background_color,
-        lineWidth = width,
-        size = size_fixation_cross_in_pixels*6)
-
-    # Arrow left:
-    al_line1 = visual.Line(win = win, units = 'pix', lineColor=function_color, lineWidth=width)
-    al_line1.start = [-(arrow_size_pix*arrow_pos_offset), 0]
-    al_line1.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth=width)
-    al_line2.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    al_line2.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line3 = visual.Line(win = win, units = 'pix', lineColor=function_color, lineWidth=width)
-    al_line3.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    al_line3.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow right:
-    ar_line1 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line1.start = [+(arrow_size_pix*arrow_pos_offset), 0]
-    ar_line1.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line2 = visual.Line(win = win, units='pix', lineColor = function_color, lineWidth = width)
-    ar_line2.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    ar_line2.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line3.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    ar_line3.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow top:
-    at_line1 = visual.Line(win = win, units='pix', lineColor = function_color, lineWidth = width)
-    at_line1.start = [0, +(arrow_size_pix*arrow_pos_offset)]
-    at_line1.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line2.start = [-arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line2.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line3.start = [+arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line3.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Arrow bottom:
-    ab_line1 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth=width)
-    ab_line1.start = [0, -(arrow_size_pix*arrow_pos_offset)]
-    ab_line1.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line2.start = [+arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line2.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line3.start = [-arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line3.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Draw all:
-    al_line1.draw()
-    al_line2.draw()
-    al_line3.draw()
-
-    ar_line1.draw()
-    ar_line2.draw()
-    ar_line3.draw()
-
-    at_line1.draw()
-    at_line2.draw()
-    at_line3.draw()
-
-    ab_line1.draw()
-    ab_line2.draw()
-    ab_line3.draw()
-
-    rect1.draw()
-
-def check_nodata(gaze_position):
-    if gaze_position == None:
-        nodata_boolean = True
-    else:
-        nodata_boolean = False
-    return nodata_boolean
-
+    gaze_redirect.draw(background_color)
 
-# Get gaze position and offset cutoff.
+# Gaze offset cutoff from the screen center:
 gaze_offset_cutoff = 3*size_fixation_cross_in_pixels
-# Then check for the offset of gaze from the center screen.
-def check_gaze_offset(gaze_position):
-    gaze_center_offset = numpy.sqrt((gaze_position[0])**2 + (gaze_position[1])**2) #pythagoras theorem
-    if gaze_center_offset >= gaze_offset_cutoff:
-        offset_boolean = True
-    else:
-        offset_boolean = False
-    return offset_boolean
 
 # SETUP KEYBORD
 kb = keyboard.Keyboard()
@@ -447,7 +356,7 @@ def check_keypress():
         ok_data = dlg.show()  # show dialog and wait for OK or Cancel
         if dlg.OK:  # or if ok_data is not None
             print('EXPERIMENT ABORTED!')
-            core.quit()
+            end_task()
         else:
             print('Experiment continues...')
             current_screen = PRESENTATION_SCREEN
@@ -467,6 +376,12 @@ def check_keypress():
     return pause_time
 
 
+gaze_engine = GazeContingentEngine(
+    win,
+    GazeStream(tracker, gaze_offset_cutoff),
+    keypress_check=check_keypress,
+    draw_offset=draw_gazedirect)
+
 def oddball_gazecontingent(oddball_object, duration_in_seconds, background_color=background_color_rgb):
     """
     Displays an oddball stimulus gaze-contingently.
@@ -476,56 +391,17 @@ def oddball_gazecontingent(oddball_object, duration_in_seconds, background_color
         duration_in_seconds: Duration for which the oddball is displayed (in seconds).
         background_color: Background color of the screen.
     """
-    # Translate duration to number of frames:
-    number_of_frames = round(duration_in_seconds / refresh_rate)
-    timestamp = core.getTime()
-    gaze_offset_duration = 0
-    pause_duration = 0
-    nodata_duration = 0
-    
-    # Oddball presentation for the specified duration:
-    for frameN in range(number_of_frames):
-        # Check for keypress:
-        pause_duration += check_keypress()
-        # Check for eye tracking data, only call once per flip:
-        gaze_position = tracker.getPosition()
-        # Check for eye tracking data:
-        if check_nodata(gaze_position):
-            print('warning: no eyes detected')
-            logging.warning(' NO EYES DETECTED')
-            frameN = 1  # reset duration of for loop - restart stimulus
-            
-            nodata_current_duration = 0
-            while check_nodata(gaze_position):
-                nodata_current_duration
-                win.flip()  # Wait for monitor refresh time
-                nodata_duration += refresh_rate
-                nodata_current_duration += refresh_rate
-                gaze_position = tracker.getPosition()  # Get new gaze data
-        
-        # Check for gaze offset:
-        elif check_gaze_offset(gaze_position):
-            print('warning: gaze offset')
-            frameN = 1  # Reset duration of for loop - restart stimulus
-            
-            while not check_nodata(gaze_position) and check_gaze_offset(gaze_position):
-                # Listen for keypress:
-                pause_duration += check_keypress()
-                draw_gazedirect(background_color)  # Redirect attention to stimulus area
-                win.flip()  # Wait for monitor refresh time
-                gaze_offset_duration += refresh_rate
-                gaze_position = tracker.getPosition()  # Get new gaze data
-        
-        # Draw oddball stimulus:
-        oddball_object.draw()  # Render the oddball on the screen
-        win.flip()
-
-    # Generate output info:
-    actual_oddball_duration = round(core.getTime() - timestamp, 3)
-    gaze_offset_duration = round(gaze_offset_duration, 3)
-    nodata_duration = round(nodata_duration, 3)
-        
-    return [actual_oddball_duration, gaze_offset_duration, pause_duration, nodata_duration]
+    # One frame loop for all tasks, durations are taken from the flip timestamps:
+    result = gaze_engine.run(
+        duration_in_seconds,
+        draw_normal=oddball_object.draw,
+        draw_offset=lambda: draw_gazedirect(background_color))  # Redirect attention to stimulus area
+    return result.as_list()
+
+def blank_gazecontingent(duration_in_seconds):
+    """Blank screen for a fixed duration, returns the no data duration."""
+    result = gaze_engine.run(duration_in_seconds, draw_normal=None, mode=FIXED, check_keys=False, gaze_contingent=False)
+    return result.nodata_duration
 
 # Define circle positions 
 circle_positions = [
@@ -539,6 +415,10 @@ circle_positions = [
 # Create circle stimuli
 circles = [visual.Circle(win, radius=100, fillColor=None, lineColor=None, pos=pos) for pos in circle_positions]
 
+def draw_circles():
+    for circle in circles:
+        circle.draw()
+
 
 # ==== Fixation Cross for Baseline
 fixation = visual.ShapeStim(
@@ -556,7 +436,10 @@ fixation = visual.ShapeStim(
 FIXATION_TIME = 5 # 5 seconds
 INTER_TRIAL_INTERVAL = 1.5
 # Create a beep sound
-beep = sound.Sound(value="A", secs=0.2, volume=1)
+with startup.phase('sound'):
+    beep = sound.Sound(value="A", secs=0.2, volume=1)
+# Startup timings of the task (saved once the last init phase is done):
+startup.save(Path(logging_path, fileName + '_startup.json'), task=task_name)
 
 trial_counter = 0
 
@@ -587,6 +470,7 @@ def show_baseline_fixation():
     exp.addData('baseline_fixation_gaze_offset_duration', gaze_offset_fixation)
     exp.addData('baseline_fixation_pause_duration', pause_fixation)
     exp.addData('baseline_fixation_nodata_duration', nodata_fixation)
+    gaze_engine.add_episodes(exp)
 
     exp.nextEntry()
     
@@ -671,10 +555,7 @@ def run_experiment():
                 print(f"Trial {trial + 1}: Remaining frames = {remaining_frames}")
 
                 # Delay phase
-                for frame in range(delay_frames):
-                    if check_nodata(tracker.getPosition()):
-                        nodata_beep_interval += refresh_rate
-                    win.flip()
+                nodata_beep_interval += blank_gazecontingent(delay_frames * refresh_rate)
 
                 # Play beep
                 beep_start_time = core.getTime()
@@ -684,10 +565,7 @@ def run_experiment():
                 beep.play(when=next_flip) 
                         
                 print(f"Trial {trial + 1}: Beep STARTED at {beep_start_time}")
-                for frame in range(beep_frames):
-                    if check_nodata(tracker.getPosition()):
-                        nodata_beep_interval += refresh_rate
-                    win.flip()
+                nodata_beep_interval += blank_gazecontingent(beep_frames * refresh_rate)
                 beep.stop()
 
                 beep_end_time = core.getTime()
@@ -695,16 +573,10 @@ def run_experiment():
                 print(f"Trial {trial + 1}: Beep STOPPED, actual duration = {beep_duration} sec")
 
                 # Remaining time after beep
-                for frame in range(remaining_frames):
-                    if check_nodata(tracker.getPosition()):
-                        nodata_beep_interval += refresh_rate
-                    win.flip()
+                nodata_beep_interval += blank_gazecontingent(remaining_frames * refresh_rate)
             
             else:
-                for frame in range(int(0.4 / refresh_rate)):  # No beep - just wait 400ms
-                    if check_nodata(tracker.getPosition()):
-                        nodata_beep_interval += refresh_rate
-                    win.flip()
+                nodata_beep_interval += blank_gazecontingent(0.4)  # No beep - just wait 400ms
                 # No beep case - Set expected_beep_duration to 0 or None
                 expected_beep_duration = 0
                 delay_duration = 0
@@ -762,13 +634,9 @@ def run_experiment():
             visual_search_start_time = core.getTime()
             send_trigger([str(trial + 1), direction, str(visual_search_start_time)])  #send LSL trigger      
             
-            while core.getTime() - visual_search_start_time < 1.5:  # 1.5 seconds
-                for circle in circles:
-                    circle.draw()
-
-                if check_nodata(tracker.getPosition()):  # Check for no data
-                    nodata_visual_search += refresh_rate
-                win.flip()
+            # 1.5 seconds, circles are shown regardless of gaze:
+            result = gaze_engine.run(1.5, draw_normal=draw_circles, mode=FIXED, check_keys=False, gaze_contingent=False)
+            nodata_visual_search += result.nodata_duration  # Check for no data
 
             actual_stimulus_duration = round(core.getTime() - visual_search_start_time, 3)
             print(f"Trial {trial + 1}: No data during circles = {nodata_visual_search:.3f} seconds")
@@ -811,7 +679,8 @@ def run_experiment():
             trials.addData('actual_beep_phase_duration', beep_phase_duration)
             trials.addData('delay_beep_phase', delay_duration) # delay before beep, if beep is played
             trials.addData('actual_visual_search_duration', round(actual_stimulus_duration, 3)) # from timestamp
-            trials.addData('nodata_visual_search', round(nodata_visual_search, 3)) # from check_nodata function
+            trials.addData('nodata_visual_search', round(nodata_visual_search, 3)) # from the gaze samples
+            gaze_engine.add_episodes(trials)
             trials.addData('trial_duration', round(trial_duration,3)) # from timestamp
             
             exp.nextEntry()
@@ -860,6 +729,9 @@ def run_experiment():
         print("Saving data safely...")
         trials.saveAsWideText(str(trials_data_folder / (fileName + ".csv")), delim=",")
         trials.saveAsPickle(str(trials_data_folder / (fileName + ".psydat")))
+        # Write the queued backup rows (also on abort or error):
+        backup_journal.close()
+        write_trial_store(exp, trials_data_folder / (fileName + ".parquet"), TRIAL_SCHEMAS[Path(__file__).stem])
 
 
     # Close reading from eyetracker:
@@ -867,8 +739,7 @@ def run_experiment():
     # Close iohub instance:
     io.quit()
 
-    win.close()
-    core.quit()
+    end_task(win)
 
 if __name__ == "__main__":
     run_experiment()
\ No newline at end of file
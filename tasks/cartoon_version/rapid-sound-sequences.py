@@ -1,4 +1,11 @@
-from psychopy import visual, core, sound, event, prefs, monitors, gui, data, clock
+# Startup timings (tasks/shared/startup_profiler.py), set up before the task modules are imported:
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from shared.startup_profiler import StartupProfiler, TASK_MODULES
+startup = StartupProfiler()
+startup.import_modules(TASK_MODULES)
+from psychopy import visual, core, event, prefs, monitors, data, clock
 from psychopy.hardware import keyboard
 from psychopy.visual import MovieStim3 as MovieStim
 from psychopy.iohub import launchHubServer
@@ -8,28 +15,42 @@ import numpy
 import random
 import time
 import psychtoolbox as ptb
-import tobii_research as tr
-# Library for managing paths
-from pathlib import Path
 # For logging data in a .log file:
 import logging
 from datetime import datetime
 import os
 import traceback
 import json
-import sys
-import csv
+# Shared task components (tasks/shared):
+from shared.task_logging import setup_task_logging
+from shared.session import task_window, marker_outlet, find_eyetrackers, task_ready, end_task
+from shared.lazy_import import lazy_module
+from shared.gaze_redirect import get_gaze_redirect
+from shared.gaze_stream import GazeStream
+from shared.trial_store import write_trial_store
+from shared.trial_schemas import TRIAL_SCHEMAS
+from shared.tone_synthesis import ToneBank, format_onsets
+from shared.sequence_plan import compile_session
+from shared.movie_preloader import MoviePreloader
+from shared.trial_journal import TrialJournal
+from shared.gaze_contingent import GazeContingentEngine, FIXED, NORMAL
 #send trigger via LSL
 from pylsl import StreamInfo, StreamOutlet
+# Dialog toolkit only imported when the pause or quit dialog is opened:
+gui = lazy_module('psychopy.gui')
 
 # Load the config file
-with open("tasks/cartoon_version/config.json", "r") as file:
-    config = json.load(file)
+with startup.phase('config'):
+    with open("tasks/cartoon_version/config.json", "r") as file:
+        config = json.load(file)
 
 #audio configuration
 prefs.hardware['audioLib'] = [config["constants"]["audio"]["Lib"]]
 prefs.hardware['audioDevice'] = config["constants"]["audio"]["device"]
 prefs.hardware['audioSampleRate'] = 48000
+# Imported after the audio prefs: only the configured audio library is loaded
+with startup.phase('sound'):
+    from psychopy import sound
 
 # Select the task (e.g., "rapid-sound-sequences")
 task_name = "rapid-sound-sequences"
@@ -49,14 +70,15 @@ if not logging_path.exists():
 else:
     print(f"Directory {logging_path} already exists. Continuing to use it.")
 
-logging.basicConfig(
-    level = logging.DEBUG,
-    filename = filename_rapid_sound_sequences,
-    filemode = 'w', # w = write, for each subject an separate log file.
-    format = '%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+# Non-blocking task logging via a queue and a listener thread (tasks/shared/task_logging.py),
+# console output is written to the log file in production mode:
+setup_task_logging(
+    filename_rapid_sound_sequences,
+    production=config["constants"]["production_mode"])
 
 trials_data_folder = Path(task_config["data_paths"]["trials"]).resolve()
 eyetracking_data_folder = Path(task_config["data_paths"]["eyetracking"]).resolve()
+tone_cache_folder = Path(task_config["data_paths"]["tone_cache"]).resolve()
 
 if not trials_data_folder.exists():
     trials_data_folder.mkdir(parents=True, exist_ok = True)
@@ -84,47 +106,45 @@ exp = data.ExperimentHandler(
     )
 str(trials_data_folder / fileName)
 
-# === Setup backup CSV ===
-backup_path = str(trials_data_folder / (fileName + "_backup.csv"))
-
-# Write header once if file is new
-if not os.path.exists(backup_path):
-    with open(backup_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "Phase",
-            "Trial_Number",
-            "Condition",
-            "timestamp_exp",
-            "trial_start_time",
-            "trial_end_time",
-            "start_timestamp_0",
-            "transition_timestamp_1",
-            "end_timestamp_2",
-            "expected_stimulus_duration",
-            "Stimulus_Duration",
-            "nodata_stimulus",
-            "pause_stimulus",
-            "gaze_offset_stimuli",
-            "Gaze_Offset_Cartoon_Duration",
-            "nodata_cartoon_Duration",
-            "Pause_cartoon_Duration",
-            "Trial_Duration",
-            "cartoon_start",
-            "cartoon_actual_duration",
-            "num_repetitions",
-            "REG1_Frequency",
-            "rep_1","rep_2","rep_3","rep_4","rep_5","rep_6",
-            "rep_7","rep_8","rep_9","rep_10","rep_11","rep_12",
-            # --- Baseline fields ---
-            "baseline_fixation_start_timestamp",
-            "baseline_fixation_end_timestamp",
-            "baseline_fixation_duration",
-            "baseline_fixation_actual_isi_duration",
-            "baseline_fixation_gaze_offset_duration",
-            "baseline_fixation_pause_duration",
-            "baseline_fixation_nodata_duration"
-        ])
+# === Setup backup journal ===
+backup_path = str(trials_data_folder / (fileName + "_backup.jsonl"))
+
+# Backup journal, rows are written by a background thread (tasks/shared/trial_journal.py).
+# Rebuild the backup CSV: python -m tasks.shared.trial_journal <journal.jsonl>
+backup_journal = TrialJournal(backup_path, [
+    "Phase",
+    "Trial_Number",
+    "Condition",
+    "timestamp_exp",
+    "trial_start_time",
+    "trial_end_time",
+    "start_timestamp_0",
+    "transition_timestamp_1",
+    "end_timestamp_2",
+    "expected_stimulus_duration",
+    "Stimulus_Duration",
+    "nodata_stimulus",
+    "pause_stimulus",
+    "gaze_offset_stimuli",
+    "Gaze_Offset_Cartoon_Duration",
+    "nodata_cartoon_Duration",
+    "Pause_cartoon_Duration",
+    "Trial_Duration",
+    "cartoon_start",
+    "cartoon_actual_duration",
+    "num_repetitions",
+    "REG1_Frequency",
+    "rep_1","rep_2","rep_3","rep_4","rep_5","rep_6",
+    "rep_7","rep_8","rep_9","rep_10","rep_11","rep_12",
+    # --- Baseline fields ---
+    "baseline_fixation_start_timestamp",
+    "baseline_fixation_end_timestamp",
+    "baseline_fixation_duration",
+    "baseline_fixation_actual_isi_duration",
+    "baseline_fixation_gaze_offset_duration",
+    "baseline_fixation_pause_duration",
+    "baseline_fixation_nodata_duration"
+])
 
 
 # === Function to log trial to backup CSV ===
@@ -187,11 +207,7 @@ def log_trial_backup(
     # Baseline columns (empty for trials)
     row.extend(["NA"] * 7)
 
-    with open(backup_path, "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(row)
-        f.flush()
-        os.fsync(f.fileno())
+    backup_journal.write(row)
 
 def log_baseline_backup(
     timestamp_exp,
@@ -222,11 +238,7 @@ def log_baseline_backup(
         nodata_fixation
     ]
 
-    with open(backup_path, "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(row)
-        f.flush()
-        os.fsync(f.fileno())
+    backup_journal.write(row)
 
 # Define TrialHandler for managing trial-level data
 trials = data.TrialHandler(
@@ -255,7 +267,7 @@ info = StreamInfo(
     channel_format='string',  # Markers are usually strings
     source_id='stimulus_stream'  # Unique ID for your experiment/session
 )
-outlet = StreamOutlet(info)
+outlet = marker_outlet(lambda: StreamOutlet(info))  # battery outlet in in-process mode
 
 # Define screens
 PRESENTATION_SCREEN = config["constants"]["presentation_screen"]
@@ -269,14 +281,8 @@ mon.setWidth(config["constants"]["monitor"]["width_cm"])  # Physical width of th
 mon.setDistance(config["constants"]["monitor"]["distance_cm"])  # Distance from participant
 mon.setSizePix([config["constants"]["monitor"]["width"], config["constants"]["monitor"]["height"]])  # Screen resolution
 
-win = visual.Window(
-    size=(config["constants"]["monitor"]["width"], config["constants"]["monitor"]["height"]),
-    fullscr=config["constants"]["psychopy_window"]["fullscreen"],
-    screen=config["constants"]["presentation_screen"],
-    color=config["constants"]["psychopy_window"]["background_color"],
-    monitor=MONITOR_NAME,
-    units='pix'
-)
+with startup.phase('window'):
+    win = task_window(config)  # battery window in in-process mode (runner.py)
 
 refresh_rate = win.monitorFramePeriod #get monitor refresh rate in seconds
 print('monitor refresh rate: ' + str(round(refresh_rate, 3)) + ' seconds')
@@ -290,7 +296,8 @@ if testmode_et:
 if not testmode_et:
     logging.info('TESTMODE = FALSE')
     # Search for eye tracker:
-    found_eyetrackers = tr.find_all_eyetrackers()
+    with startup.phase('tracker_discovery'):
+        found_eyetrackers = find_eyetrackers()
     my_eyetracker = found_eyetrackers[0]
     print("Address: " + my_eyetracker.address)
     logging.info(' ADDRESS: ' f'{my_eyetracker.address}')
@@ -305,15 +312,17 @@ if not testmode_et:
         {'name': 'tracker', 'runtime_settings': {'sampling_rate': sampling_rate, }}}
     
 # IOHUB creates a different instance that records eye tracking data in hdf5 file saved in datastore_name:
-io = launchHubServer(**iohub_config,
-                        experiment_code = str(eyetracking_data_folder),
-                        session_code = str(fileName),
-                        datastore_name = str(eyetracking_data_folder / str(fileName)), #where data is stored
-                        window = win)
+with startup.phase('iohub'):
+    io = launchHubServer(**iohub_config,
+                            experiment_code = str(eyetracking_data_folder),
+                            session_code = str(fileName),
+                            datastore_name = str(eyetracking_data_folder / str(fileName)), #where data is stored
+                            window = win)
 
 # Call the eyetracker device and start recording - different instance:
 tracker = io.devices.tracker
 tracker.setRecordingState(True)
+task_ready()
 print(tracker)
 
 #Send a trigger (marker) function
@@ -321,112 +330,14 @@ def send_trigger(marker):
     # marker must be a list of strings, length = channel_count
     outlet.push_sample(marker)
 
+gaze_redirect = get_gaze_redirect(win, size_fixation_cross_in_pixels, background_color_rgb)
+
 # Draw figure for gaze contincency, when gaze is offset:
 def draw_gazedirect(background_color = background_color_rgb):
-        # Adapt background according to provided "background color"
-    if background_color is not background_color_rgb:
-        background_rect = visual.Rect(
-            win = win,
-            size = win.size,
-            fillColor = background_color)
-        background_rect.draw()
-    # Parameters:
-    function_color = 'red'
-    arrow_size_pix = size_fixation_cross_in_pixels
-    arrow_pos_offset = 5
-    width = 3
-
-    rect1 = visual.Rect(
-        win = win,
-        units = 'pix',
-        lineColor = function_color,
-        fillColor = background_color,
-        lineWidth = width,
-        size = size_fixation_cross_in_pixels*6)
-
-    # Arrow left:
-    al_line1 = visual.Line(win = win, units = 'pix', lineColor=function_color, lineWidth=width)
-    al_line1.start = [-(arrow_size_pix*arrow_pos_offset), 0]
-    al_line1.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth=width)
-    al_line2.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    al_line2.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line3 = visual.Line(win = win, units = 'pix', lineColor=function_color, lineWidth=width)
-    al_line3.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    al_line3.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow right:
-    ar_line1 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line1.start = [+(arrow_size_pix*arrow_pos_offset), 0]
-    ar_line1.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line2 = visual.Line(win = win, units='pix', lineColor = function_color, lineWidth = width)
-    ar_line2.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    ar_line2.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line3.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    ar_line3.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow top:
-    at_line1 = visual.Line(win = win, units='pix', lineColor = function_color, lineWidth = width)
-    at_line1.start = [0, +(arrow_size_pix*arrow_pos_offset)]
-    at_line1.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line2.start = [-arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line2.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line3.start = [+arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line3.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Arrow bottom:
-    ab_line1 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth=width)
-    ab_line1.start = [0, -(arrow_size_pix*arrow_pos_offset)]
-    ab_line1.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line2.start = [+arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line2.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line3.start = [-arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line3.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Draw all:
-    al_line1.draw()
-    al_line2.draw()
-    al_line3.draw()
-
-    ar_line1.draw()
-    ar_line2.draw()
-    ar_line3.draw()
-
-    at_line1.draw()
-    at_line2.draw()
-    at_line3.draw()
-
-    ab_line1.draw()
-    ab_line2.draw()
-    ab_line3.draw()
-
-    rect1.draw()
-
-def check_nodata(gaze_position):
-    if gaze_position == None:
-        nodata_boolean = True
-    else:
-        nodata_boolean = False
-    return nodata_boolean
-
+    gaze_redirect.draw(background_color)
 
-# Get gaze position and offset cutoff.
+# Gaze offset cutoff from the screen center:
 gaze_offset_cutoff = 3*size_fixation_cross_in_pixels
-# Then check for the offset of gaze from the center screen.
-def check_gaze_offset(gaze_position):
-    gaze_center_offset = numpy.sqrt((gaze_position[0])**2 + (gaze_position[1])**2) #pythagoras theorem
-    #print(f"DEBUG: gaze_position = {gaze_position}")
-    if gaze_center_offset >= gaze_offset_cutoff:
-        offset_boolean = True
-    else:
-        offset_boolean = False
-    return offset_boolean
-
 
 # SETUP KEYBORD
 kb = keyboard.Keyboard()
@@ -444,7 +355,7 @@ def check_keypress():
         ok_data = dlg.show()  # show dialog and wait for OK or Cancel
         if dlg.OK:  # or if ok_data is not None
             print('EXPERIMENT ABORTED!')
-            core.quit()
+            end_task()
         else:
             print('Experiment continues...')
             current_screen = PRESENTATION_SCREEN
@@ -463,6 +374,12 @@ def check_keypress():
     return pause_time
 
 
+gaze_engine = GazeContingentEngine(
+    win,
+    GazeStream(tracker, gaze_offset_cutoff),
+    keypress_check=check_keypress,
+    draw_offset=draw_gazedirect)
+
 def rapidsequences_gazecontingent(rss_object, duration_in_seconds, background_color=background_color_rgb):
     """
     Displays a rss stimulus gaze-contingently.
@@ -472,56 +389,12 @@ def rapidsequences_gazecontingent(rss_object, duration_in_seconds, background_co
         duration_in_seconds: Duration for which the rss is displayed (in seconds).
         background_color: Background color of the screen.
     """
-    # Translate duration to number of frames:
-    number_of_frames = round(duration_in_seconds / refresh_rate)
-    timestamp = core.getTime()
-    gaze_offset_duration = 0
-    pause_duration = 0
-    nodata_duration = 0
-    
-    # rss presentation for the specified duration:
-    for frameN in range(number_of_frames):
-        # Check for keypress:
-        pause_duration += check_keypress()
-        # Check for eye tracking data, only call once per flip:
-        gaze_position = tracker.getPosition()
-        # Check for eye tracking data:
-        if check_nodata(gaze_position):
-            print('warning: no eyes detected')
-            logging.warning(' NO EYES DETECTED')
-            frameN = 1  # reset duration of for loop - restart stimulus
-            
-            nodata_current_duration = 0
-            while check_nodata(gaze_position):
-                nodata_current_duration
-                win.flip()  # Wait for monitor refresh time
-                nodata_duration += refresh_rate
-                nodata_current_duration += refresh_rate
-                gaze_position = tracker.getPosition()  # Get new gaze data
-        
-        # Check for gaze offset:
-        elif check_gaze_offset(gaze_position):
-            print('warning: gaze offset')
-            frameN = 1  # Reset duration of for loop - restart stimulus
-            
-            while not check_nodata(gaze_position) and check_gaze_offset(gaze_position):
-                # Listen for keypress:
-                pause_duration += check_keypress()
-                draw_gazedirect(background_color)  # Redirect attention to stimulus area
-                win.flip()  # Wait for monitor refresh time
-                gaze_offset_duration += refresh_rate
-                gaze_position = tracker.getPosition()  # Get new gaze data
-        
-        # Draw rss stimulus:
-        rss_object.draw()  
-        win.flip()
-
-    # Generate output info:
-    actual_rss_duration = round(core.getTime() - timestamp, 3)
-    gaze_offset_duration = round(gaze_offset_duration, 3)
-    nodata_duration = round(nodata_duration, 3)
-       
-    return [actual_rss_duration, gaze_offset_duration, pause_duration, nodata_duration]
+    # One frame loop for all tasks, durations are taken from the flip timestamps:
+    result = gaze_engine.run(
+        duration_in_seconds,
+        draw_normal=rss_object.draw,
+        draw_offset=lambda: draw_gazedirect(background_color))  # Redirect attention to stimulus area
+    return result.as_list()
 
 
 def cartoon_gazecontingent(anim_object, duration_in_seconds, background_color=background_color_rgb):
@@ -533,100 +406,24 @@ def cartoon_gazecontingent(anim_object, duration_in_seconds, background_color=ba
         duration_in_seconds: Total intended playback duration (excluding pauses).
         background_color: Background color of the screen.
     """
-    # Get the animation frame rate (fps) from the MovieStim object
-    # If not available, estimate using the refresh rate
-    try:
-        animation_fps = anim_object.frameRate
-        if animation_fps is None or animation_fps <= 0:
-            animation_fps = 1.0 / refresh_rate
-    except AttributeError:
-        animation_fps = 1.0 / refresh_rate
-    
-    # Calculate target duration in terms of frames
-    target_frames = int(duration_in_seconds * animation_fps)
-    
-    # Start the animation
-    anim_object.play()
-    start_time = core.getTime()
-    
-    # Initialize tracking variables
-    frames_played = 0
-    gaze_offset_duration = 0
-    pause_duration = 0
-    nodata_duration = 0
-    
-    # Continue until we've played the requested number of frames
-    while frames_played < target_frames:
-        # Check for keypress (e.g., manual pause)
-        pause_duration += check_keypress()
-        
-        # Get gaze position
-        gaze_position = tracker.getPosition()
-        
-        # Case 1: No eyes detected (freeze animation)
-        if check_nodata(gaze_position):
-            print('warning: no eyes detected')
-            logging.warning('NO EYES DETECTED')
-            
-            # Pause the animation
-            anim_object.pause()
-            
-            # Handle the no-eyes-detected state
-            nodata_start = core.getTime()
-            while check_nodata(gaze_position):
-                # Show blank screen
-                win.flip()
-                gaze_position = tracker.getPosition()
-            
-            nodata_duration += core.getTime() - nodata_start
-            
-            # Resume animation from where it was paused
+    # Pause the animation while gaze is lost, resume it from where it was paused:
+    def pause_or_play(previous_state, state):
+        if state == NORMAL:
             anim_object.play()
-                
-        # Case 2: Gaze offset (freeze animation)
-        elif check_gaze_offset(gaze_position):
-            print('warning: gaze offset')
-            
-            # Pause the animation
+        elif previous_state == NORMAL:
             anim_object.pause()
-            
-            # Handle the gaze-offset state
-            gaze_offset_start = core.getTime()
-            while (not check_nodata(gaze_position)) and check_gaze_offset(gaze_position):
-                pause_duration += check_keypress()
-                
-                # Draw the gaze redirection cue (square)
-                draw_gazedirect(background_color)
-                win.flip()
-                
-                gaze_position = tracker.getPosition()
-            
-            gaze_offset_duration += core.getTime() - gaze_offset_start
-            
-            # Resume animation from where it was paused
-            anim_object.play()
-        
-        # Normal playback
-        else:
-            # Draw the current frame of animation
-            anim_object.draw()
-            win.flip()
-            
-            # Only increment frames_played during normal playback
-            frames_played += 1
-    
+
+    # Only normal playback counts towards the duration:
+    result = gaze_engine.run(
+        duration_in_seconds,
+        draw_normal=anim_object.draw,
+        draw_offset=lambda: draw_gazedirect(background_color),  # Draw the gaze redirection cue (square)
+        on_state_change=pause_or_play)
+
     # Stop animation
     anim_object.stop()
-    
-    # Calculate total duration
-    actual_duration = core.getTime() - start_time
-    
-    return [
-        round(actual_duration, 3),
-        round(gaze_offset_duration, 3),
-        round(pause_duration, 3),
-        round(nodata_duration, 3)
-    ]
+
+    return result.as_list()
 
 # EXPERIMENT SETTINGS
 # Constants
@@ -643,331 +440,81 @@ TOTAL_TRIALS = CONTROL_TRIALS * 2 + TRANSITION_TRIALS * 2 # Number of trials (no
 #TRANSITION_TRIALS = 1 #repetitions of REG10-RAND20, REG00-REG1, RAND20-REG10
 
 animation_files = [f"media/cartoons/{i}.mp4" for i in range(1, 40)]
+CARTOON_TIMEOUT = 2 # seconds of cartoon playback per trial
+
+# Cartoons of the next trials are decoded on a worker thread while the current trial runs,
+# or loaded from the media cache (python -m tasks.shared.clip_cache tasks/cartoon_version/config.json)
+cartoon_preloader = MoviePreloader(
+    animation_files,
+    duration=CARTOON_TIMEOUT,
+    width=size_fixation_cross_in_pixels * 6,
+    cache_folder=Path(config["media_cache"]))
 
 # Generate frequency pool
 frequency_pool = list(np.logspace(np.log10(MIN_FREQ), np.log10(MAX_FREQ), POOL_SIZE))
 
+# Windowed tones of the frequency pool, synthesized once or loaded from the cache of an earlier session
+with startup.phase('tones'):
+    tone_bank = ToneBank(frequency_pool, prefs.hardware['audioSampleRate'], DURATION_TONE, cache_folder=tone_cache_folder)
+# Startup timings of the task (saved once the last init phase is done):
+startup.save(Path(logging_path, fileName + '_startup.json'), task=task_name)
+
 def generate_tone(frequency):
     return sound.Sound(value=frequency, secs=DURATION_TONE, stereo=True)
 
-def play_tone_sequence(frequencies, num_repetitions, shuffle=False, name="", trial_num=0):
+def fixation_during_sound(duration_in_seconds):
+    """Show the fixation cross gaze-contingently while tones play, escape stops the presentation."""
+    return gaze_engine.run(
+        duration_in_seconds,
+        draw_normal=fixation.draw,  # Show fixation when gaze is centered
+        draw_offset=lambda: draw_gazedirect(background_color_rgb),  # Show gaze direction when offset
+        draw_nodata=fixation.draw,  # Show fixation during no data
+        mode=FIXED,
+        check_keys=False,
+        abort_check=lambda: bool(event.getKeys(['escape'])))
+
+def play_tone_sequence(planned_trial, tone_buffer, trial_num=0):
     """
-    Play a sequence of tones for a specific number of repetitions and return the played sequences.
+    Play the pre-rendered sound buffer of a planned trial, starting with the next flip.
+    Returns the gaze-contingent result of the fixation and the onset time of the buffer.
     """
-    played_sequences = []  # Store the exact sequences as played
-    sequence_duration = len(frequencies) * DURATION_TONE
-    total_duration = sequence_duration * num_repetitions
-    
-    print(f"\n{name}")
-    print(f"Sequence length: {len(frequencies)} tones")
-    print(f"Single sequence duration: {sequence_duration}s")
-    print(f"Number of repetitions: {num_repetitions}")
-    print(f"Total expected duration: {total_duration}s")
-    
-    nodata_stimulus = 0
-    gaze_offset_stimuli = 0
+    print(f"\nTrial Order Number {trial_num} - {planned_trial.condition}")
+    for part_name, sequences in planned_trial.parts:
+        print(f"{part_name}: {len(sequences)} x {len(sequences[0])} tones")
+    print(f"Total expected duration: {planned_trial.duration}s")
 
-    # Get initial timing
+    # Schedule the buffer on the next flip, the first frame of the fixation
     next_flip = win.getFutureFlipTime(clock='ptb')
-    start_time = next_flip
-    
-    # Pre-generate all tones for all repetitions
-    all_tones = []
-    for rep in range(num_repetitions):
-        current_frequencies = list(frequencies)  # Copy the sequence
-        
-        if shuffle:
-            random.shuffle(current_frequencies)  # Shuffle if required
-        
-        played_sequences.append(current_frequencies[:])  # Store played order
-        
-        #print(f"\nRepetition {rep + 1}:")
-        #print(f"Frequencies: {', '.join([f'{f:.1f}' for f in current_frequencies])}")
-        
-        for idx, freq in enumerate(current_frequencies):
-            tone = sound.Sound(value=freq, secs=DURATION_TONE, stereo=True)
-            play_time = start_time + (rep * sequence_duration) + (idx * DURATION_TONE)
-            all_tones.append((tone, play_time))
-    
-    # Schedule all tones at once
-    for tone, play_time in all_tones:
-        tone.play(when=play_time)
-    
-    # Draw fixation for the total duration
-    total_frames = int(total_duration / refresh_rate)
-    
-    for frame in range(total_frames):
-        if event.getKeys(['escape']):
-            # Stop all scheduled tones
-            for tone, _ in all_tones:
-                tone.stop()
-            return nodata_stimulus, gaze_offset_stimuli, played_sequences  # Return played sequences along with stimuli data
-        
-        # Check gaze position and update display accordingly
-        gaze_position = tracker.getPosition()  # Get the current gaze position
-        
-        # Check for missing data (gaze position is None)
-        if check_nodata(gaze_position):
-            nodata_stimulus += refresh_rate  # Accumulate missing data time
-            print("Warning: no eyes detected")
-            fixation.draw()  # Show fixation during no data
-        else:
-            if gaze_position is not None:  # Ensure gaze_position is valid before checking offset
-                if check_gaze_offset(gaze_position):
-                    gaze_offset_stimuli += refresh_rate  # Accumulate gaze offset time
-                    print("Warning: gaze offset")
-                    draw_gazedirect(background_color_rgb)  # Show gaze direction when offset
-                else:
-                    fixation.draw()  # Show fixation when gaze is centered
-            else:
-                # If gaze_position is None, skip gaze offset handling and just show fixation
-                print("Warning: Gaze position is None, skipping gaze offset check.")
-                fixation.draw()  # Show fixation by default when gaze position is None
-    
-        win.flip()  # Update display with the current fixation status
-
-    return nodata_stimulus, gaze_offset_stimuli, played_sequences  # Return exact played sequences
+    tone_buffer.play(when=next_flip)
+    logging.info(f'TONE BUFFER {planned_trial.condition}: {len(planned_trial.onsets)} tones, {planned_trial.duration}s, scheduled at ptb time {next_flip}')
+    logging.info('TONE ONSETS (ms from buffer start): ' + format_onsets(planned_trial.onsets))
 
-def generate_sequence(frequency_pool, tone_count, with_replacement=False):
-    if with_replacement:
-        return random.choices(frequency_pool, k=tone_count)
+    # Draw fixation for the total duration
+    result = fixation_during_sound(planned_trial.duration)
+    buffer_onset = result.first_flip if result.first_flip is not None else result.start_time
+    if result.aborted:
+        tone_buffer.stop()  # Stop the remaining tones
     else:
-        return random.sample(frequency_pool, k=tone_count)
-    
-def generate_reg1_repeated_tone(frequency, tone_duration=0.05, total_duration=3.0, sample_rate=prefs.hardware['audioSampleRate']):
-    samples_per_tone = int(tone_duration * sample_rate)
-    num_repeats = int(total_duration / tone_duration)
-
-    # Time vector for 50 ms
-    t = np.linspace(0, tone_duration, samples_per_tone, False)
-    tone_wave = 0.5 * np.sin(2 * np.pi * frequency * t)
+        # The fixation loop ends with the last flip, wait for the rest of the last frame
+        core.wait(max(0, buffer_onset + planned_trial.duration - core.getTime()))
 
-    # === Fade in/out to reduce clicks ===
-    fade_duration = 0.005  # 5ms fade in/out
-    fade_samples = int(fade_duration * sample_rate)
+    return result, buffer_onset
 
-    fade_in = np.linspace(0, 1, fade_samples)
-    fade_out = np.linspace(1, 0, fade_samples)
-    envelope = np.ones_like(tone_wave)
-    envelope[:fade_samples] *= fade_in
-    envelope[-fade_samples:] *= fade_out
+def present_trial(planned_trial, tone_buffer, trial_num):
+    """Present a trial compiled in the session plan, all tones of the trial are played as one sound buffer."""
+    start_timestamp_0 = core.getTime()
+    transition_timestamp_1 = None
 
-    tone_wave *= envelope
+    result, buffer_onset = play_tone_sequence(planned_trial, tone_buffer, trial_num=trial_num)
 
-    # Repeat tone burst
-    full_wave = np.tile(tone_wave, num_repeats)
+    # Capture timestamp at transition, from the onset of the second part within the buffer
+    if len(planned_trial.part_onsets) > 1:
+        transition_timestamp_1 = buffer_onset + planned_trial.part_onsets[1]
 
-    return full_wave
+    # Capture timestamp at end of the buffer
+    end_timestamp_2 = core.getTime()
 
-def present_trial(condition, frequency_pool, trial_num):
-    """Present a trial of the specified condition."""
-    start_timestamp_0 = None
-    transition_timestamp_1 = None
-    end_timestamp_2 = None
-    nodata_stimulus = 0
-    gaze_offset_stimuli = 0
-    reg1_tone_value = None
-    all_played_sequences = []  # Use a separate list to keep track of all sequences
-
-    # Ensure played_sequences is initialized properly for each condition
-    played_sequences = []
-
-    if condition == "REG10":
-        start_timestamp_0 = core.getTime()
-        # REG10: 10 tones sequence repeated 12 times (6 seconds)
-        sequence = generate_sequence(frequency_pool, 10, with_replacement=False)
-        for _ in range(12):  # REG10 repeats 12 times
-            played_sequences.extend(sequence)
-        result = play_tone_sequence(sequence, 12, shuffle=False, name="REG10", trial_num=trial_num)
-        
-        # Check if we received three values, and unpack them
-        if len(result) == 3:
-            nodata_stimulus, gaze_offset_stimuli, played_sequences = result
-        else:
-            # Handle error: not enough values returned, set default values or raise error
-            print(f"Error: play_tone_sequence did not return the expected 3 values. Received: {len(result)} values.")
-            return None  # Or handle error more appropriately
-        
-        end_timestamp_2 = core.getTime()
-
-    elif condition == "RAND20":
-        start_timestamp_0 = core.getTime()
-        # RAND20: 20 tones sequence repeated 6 times (6 seconds)
-        sequence = generate_sequence(frequency_pool, 20, with_replacement=True)
-        for _ in range(6):  # RAND20 repeats 6 times
-            played_sequences.extend(sequence)
-        result = play_tone_sequence(sequence, 6, shuffle=True, name="RAND20", trial_num=trial_num)
-        
-        # Check if we received three values, and unpack them
-        if len(result) == 3:
-            nodata_stimulus, gaze_offset_stimuli, played_sequences = result
-        else:
-            print(f"Error: play_tone_sequence did not return the expected 3 values. Received: {len(result)} values.")
-            return None  # Or handle error more appropriately
-        
-        end_timestamp_2 = core.getTime()
-
-    elif condition == "REG10-RAND20":
-        start_timestamp_0 = core.getTime()
-        # First 3 seconds: REG10 (6 repetitions)
-        sequence1 = generate_sequence(frequency_pool, 10, with_replacement=False)
-        part1_sequences = []  # Store REG10 sequences separately
-        for _ in range(6):  
-            part1_sequences.extend(sequence1)
-        result = play_tone_sequence(sequence1, 6, shuffle=False, name="REG10-RAND20 (REG10 part)", trial_num=trial_num)
-        
-        # Check if we received three values, and unpack them
-        if len(result) == 3:
-            nodata_stimulus, gaze_offset_stimuli, part1_sequences = result
-        else:
-            print(f"Error: play_tone_sequence did not return the expected 3 values. Received: {len(result)} values.")
-            return None  # Or handle error more appropriately
-        
-        # Capture timestamp at transition
-        transition_timestamp_1 = core.getTime()
-
-        # Second 3 seconds: RAND20 (3 repetitions)
-        sequence2 = generate_sequence(frequency_pool, 20, with_replacement=True)
-        part2_sequences = []  # Store RAND20 sequences separately
-        for _ in range(3):  
-            part2_sequences.extend(sequence2)
-        result = play_tone_sequence(sequence2, 3, shuffle=True, name="REG10-RAND20 (RAND20 part)", trial_num=trial_num)
-
-        # Check if we received three values, and unpack them
-        if len(result) == 3:
-            nodata_stimulus, gaze_offset_stimuli, part2_sequences = result
-        else:
-            print(f"Error: play_tone_sequence did not return the expected 3 values. Received: {len(result)} values.")
-            return None  # Or handle error more appropriately
-        
-        # Combine the two parts
-        played_sequences.extend(part1_sequences)
-        played_sequences.extend(part2_sequences)
-
-        # Capture timestamp at end of second sequence (RAND20 part)
-        end_timestamp_2 = core.getTime()
-
-    elif condition == "RAND20-REG10":
-        start_timestamp_0 = core.getTime()
-        # First 3 seconds: RAND20 (3 repetitions)
-        sequence1 = generate_sequence(frequency_pool, 20, with_replacement=True)
-        part1_sequences = []  # Store RAND20 sequences separately
-        for _ in range(3):  
-            part1_sequences.extend(sequence1)
-        result = play_tone_sequence(sequence1, 3, shuffle=True, name="RAND20-REG10 (RAND20 part)", trial_num=trial_num)
-        
-        # Check if we received three values, and unpack them
-        if len(result) == 3:
-            nodata_stimulus, gaze_offset_stimuli, part1_sequences = result
-        else:
-            print(f"Error: play_tone_sequence did not return the expected 3 values. Received: {len(result)} values.")
-            return None  # Or handle error more appropriately
-        
-        # Capture timestamp at transition
-        transition_timestamp_1 = core.getTime()
-
-        # Second 3 seconds: REG10 (6 repetitions)
-        sequence2 = generate_sequence(frequency_pool, 10, with_replacement=False)
-        part2_sequences = []  # Store REG10 sequences separately
-        for _ in range(6):  
-            part2_sequences.extend(sequence2)
-        result = play_tone_sequence(sequence2, 6, shuffle=False, name="RAND20-REG10 (REG10 part)", trial_num=trial_num)
-        
-        # Check if we received three values, and unpack them
-        if len(result) == 3:
-            nodata_stimulus, gaze_offset_stimuli, part2_sequences = result
-        else:
-            print(f"Error: play_tone_sequence did not return the expected 3 values. Received: {len(result)} values.")
-            return None  # Or handle error more appropriately
-        
-        # Combine the two parts
-        played_sequences.extend(part1_sequences)
-        played_sequences.extend(part2_sequences)
-        
-        # Capture timestamp at end of second sequence (REG10 part)
-        end_timestamp_2 = core.getTime()
-
-    elif condition == "RAND20-REG1":
-        start_timestamp_0 = core.getTime()  # Timestamp at the start
-        
-        # First 3 seconds: RAND20 (3 repetitions)
-        sequence1 = generate_sequence(frequency_pool, 20, with_replacement=True)
-        part1_sequences = []
-        for _ in range(3):  
-            part1_sequences.extend(sequence1)  # Extend the sequence with repetitions
-        
-        # Play RAND20 sequence (first part)
-        result = play_tone_sequence(sequence1, 3, shuffle=True, name="RAND20-REG1 (RAND20 part)", trial_num=trial_num)
-        
-        # Check if we received three values, and unpack them
-        if len(result) == 3:
-            nodata_stimulus, gaze_offset_stimuli, part1_sequences = result
-        else:
-            print(f"Error: play_tone_sequence did not return the expected 3 values. Received: {len(result)} values.")
-            return None  # Or handle error more appropriately
-        
-        # Capture timestamp at transition between RAND20 and REG1
-        transition_timestamp_1 = core.getTime()
-        
-        # Generate reg1_tone (single tone for the second part of the trial)
-        reg1_freq = random.choice(frequency_pool)  # Pick a tone from the pool
-        reg1_tone_value = reg1_freq
-        waveform = generate_reg1_repeated_tone(reg1_freq)
-        
-        # Instead of using play_tone_sequence, directly play the single tone for 3 seconds
-        print(f"Trial Order Number {trial_num} - RAND20-REG1 (REG1 part)")
-        print(f"Playing single tone: {reg1_tone_value} for 3.0s")
-
-        # Play the full waveform as one seamless sound
-        reg1_frames = int(3 / refresh_rate)
-        reg1_tone = sound.Sound(value=waveform, sampleRate=prefs.hardware['audioSampleRate'], stereo=True)
-        next_flip = win.getFutureFlipTime(clock='ptb')  # If syncing with screen
-        reg1_tone.play(when=next_flip)
-        
-        # Wait for the full duration (3 seconds)
-        for frame in range(reg1_frames):
-            if event.getKeys(['escape']):
-                reg1_tone.stop()
-                break
-            
-            # Check gaze position and update display accordingly
-            gaze_position = tracker.getPosition()
-            
-            if check_nodata(gaze_position):
-                nodata_stimulus += refresh_rate
-                print('warning: no eyes detected')
-                fixation.draw()
-            else:
-                if gaze_position is not None:
-                    if check_gaze_offset(gaze_position):
-                        gaze_offset_stimuli += refresh_rate
-                        print('warning: gaze offset')
-                        draw_gazedirect(background_color_rgb)
-                    else:
-                        fixation.draw()
-                else:
-                    fixation.draw()
-            
-            win.flip()
-        
-        reg1_tone.stop()  # Ensure tone is stopped
-        
-        # Create part2_sequences for consistency
-        part2_sequences = [reg1_tone_value] * int(3 / DURATION_TONE)
-        
-        # Combine the two parts
-        played_sequences = part1_sequences + part2_sequences
-        
-        # Capture timestamp at end of second sequence (REG1 part)
-        end_timestamp_2 = core.getTime()
-
-    # Now save all sequences at the end of the trial (to prevent overwriting)
-    all_played_sequences.append(played_sequences)
-    # Helping debugging
-    # print(f"reg1_tone: {reg1_tone_value}, type: {type(reg1_tone_value)}")
-    # print(f"played_sequences: {played_sequences}, type: {type(played_sequences)}")
-
-    return start_timestamp_0, transition_timestamp_1, end_timestamp_2, nodata_stimulus, gaze_offset_stimuli, played_sequences, reg1_tone_value or 0
+    return start_timestamp_0, transition_timestamp_1, end_timestamp_2, result.nodata_duration, result.offset_duration, planned_trial.played_sequences, planned_trial.reg1_frequency or 0
 
 # ==== Fixation Cross for Baseline
 fixation = visual.ShapeStim(
@@ -1014,6 +561,7 @@ def show_baseline_fixation():
     exp.addData('baseline_fixation_gaze_offset_duration', gaze_offset_fixation)
     exp.addData('baseline_fixation_pause_duration', pause_fixation)
     exp.addData('baseline_fixation_nodata_duration', nodata_fixation)
+    gaze_engine.add_episodes(exp)
 
     exp.nextEntry()  # Move to next row in data file
     # Also log to backup file
@@ -1057,6 +605,10 @@ def run_experiment():
 
     random.shuffle(trial_order)  # Shuffle all trials to ensure randomness
 
+    # Compile sequences and audio buffers of all trials before the baseline phase
+    session_plan = compile_session(trial_order, frequency_pool, tone_bank, DURATION_TONE)
+    session_plan.report()
+
     print("STARTING EXPERIMENT")
     start_time = core.getTime()
 
@@ -1086,36 +638,21 @@ def run_experiment():
 
             print(f"\n=== Trial {trial_number+1}: {condition} ===")
             try:
+                # Audio of the trial from the session plan, the sound is created before the trial starts
+                planned_trial = session_plan[trials.thisIndex]
+                tone_buffer = sound.Sound(value=planned_trial.waveform, sampleRate=prefs.hardware['audioSampleRate'], stereo=True)
+
                 # --- PHASE 1: Play Fixation Animation (Start of Trial) ---
                 print(f"Trial {trial_number + 1}: Loading cartoon")
-                cartoon_timeout = 2
+                cartoon_timeout = CARTOON_TIMEOUT
 
                 actual_cartoon_duration = 0
                 gaze_offset_cartoon_duration = 0
                 pause_cartoon_duration = 0
                 nodata_cartoon_duration = 0
                 try:
-                    fixation_animation = visual.MovieStim(
-                        win=win,
-                        filename=random.choice(animation_files),
-                        loop=False,
-                        noAudio=True
-                    )
-
-                    video_width, video_height = 1920, 1080
-
-                    target_width = size_fixation_cross_in_pixels * 6  # 360 pixels
-
-                    # Calculate the scaling factor to maintain the aspect ratio
-                    scale_factor = target_width / video_width
-
-                    # Adjust video size based on scale factor
-                    scaled_width = target_width
-                    scaled_height = video_height * scale_factor
-  
-                    # Set the position to center the video and ensure the original size
-                    fixation_animation.pos = (0, 0)
-                    fixation_animation.size = (scaled_width, scaled_height)
+                    # Decoded clip from the preloader, scaled to size_fixation_cross_in_pixels * 6 wide
+                    fixation_animation = cartoon_preloader.next_clip(win)
 
                     print(f"Trial {trial_number + 1}: Starting animation")
 
@@ -1139,6 +676,12 @@ def run_experiment():
                         print(f"Trial {trial_number + 1}: Gaze offset duration: {gaze_offset_cartoon_duration:.3f} sec")
                         print(f"Trial {trial_number + 1}: No eyes detected duration: {nodata_cartoon_duration:.3f} sec")
 
+                    # Time from the clip request (incl. waiting for the preloader) to the flip of its first frame,
+                    # None if it was never shown:
+                    if fixation_animation.first_frame_latency is not None:
+                        print(f"Trial {trial_number + 1}: Cartoon first frame latency: {fixation_animation.first_frame_latency:.3f} sec")
+                        logging.info(f"CARTOON FIRST FRAME LATENCY: {round(fixation_animation.first_frame_latency, 3)}")
+
                     # Ensure animation is stopped
                     fixation_animation.stop()
                     del fixation_animation
@@ -1160,50 +703,16 @@ def run_experiment():
                 send_trigger([str(trial_number + 1), condition, str(stimulus_start_time)])
 
                 # Present the trial based on the condition
-                start_timestamp_0, transition_timestamp_1, end_timestamp_2, nodata_stimulus, gaze_offset_stimuli, played_sequences, reg1_tone = present_trial(condition, frequency_pool, trial_num)
+                start_timestamp_0, transition_timestamp_1, end_timestamp_2, nodata_stimulus, gaze_offset_stimuli, played_sequences, reg1_tone = present_trial(planned_trial, tone_buffer, trial_num)
                                 
                 stimulus_end_time = core.getTime()  # Record end time of the stimulus
                 stimulus_duration = round(stimulus_end_time - stimulus_start_time, 3)
                 
                 pause_duration += check_keypress()
                 
-                # Convert played sequences to string format for saving
-                num_repetitions = len(played_sequences)
-
-                if condition == "RAND20-REG1":
-                    # For RAND20-REG1, separate RAND20 sequences and REG1 tone
-                    # The first 3 elements are the RAND20 sequences
-                    rand20_sequences = played_sequences[:3]
-                    
-                    # The last element is the REG1 tone
-                    reg1_tone = played_sequences[-1]
-                    
-                    # Convert RAND20 sequences to strings
-                    sequence_strings = []
-                    for seq in rand20_sequences:
-                        # Convert each sequence to a comma-separated string of frequencies
-                        seq_string = ", ".join(f"{freq:.1f}" for freq in seq)
-                        sequence_strings.append(seq_string)
-                    
-                    # Pad sequence_strings to maintain 12 columns
-                    while len(sequence_strings) < 12:
-                        sequence_strings.append("NA")
-                
-                else:
-                    # Existing handling for other conditions
-                    if played_sequences and len(played_sequences) > 0:
-                        sequence_strings = []
-                        for seq in played_sequences:
-                            # Convert each sequence to a comma-separated string of frequencies
-                            seq_string = ", ".join(f"{freq:.1f}" for freq in seq)
-                            sequence_strings.append(seq_string)
-                        
-                        # Pad sequence_strings to maintain 12 columns
-                        while len(sequence_strings) < 12:
-                            sequence_strings.append("NA")
-                    else:
-                        print(f"Warning: No sequences recorded for trial {trial_number+1}")
-                        sequence_strings = ["NA"] * 12
+                # Sequences as strings for saving, compiled in the session plan
+                num_repetitions = planned_trial.num_repetitions
+                sequence_strings = planned_trial.sequence_strings
 
             except Exception as e:
                 print(f"Error during trial {trial_number+1}: {e}")
@@ -1224,9 +733,9 @@ def run_experiment():
             trials.addData("Condition", condition) # from the trial
             trials.addData('expected_stimulus_duration', expected_duration) # from the constants
             trials.addData("Stimulus_Duration", stimulus_duration) # calculated within the trial
-            trials.addData("nodata_stimulus", round(nodata_stimulus, 3))   # from check_nodata function, within the experiment loop
+            trials.addData("nodata_stimulus", round(nodata_stimulus, 3))   # from the gaze samples, within the experiment loop
             trials.addData("pause_stimulus ", pause_duration) # pause during the trials
-            trials.addData("gaze_offset_stimuli", round(gaze_offset_stimuli,3)) # from check_gaze_offset function, within the experiment loop
+            trials.addData("gaze_offset_stimuli", round(gaze_offset_stimuli,3)) # from the gaze samples, within the experiment loop
             trials.addData("Gaze_Offset_Cartoon_Duration", gaze_offset_cartoon_duration)   # from gazecontingent function
             trials.addData("nodata_cartoon_Duration", nodata_cartoon_duration) #from gazecontingent function
             trials.addData("Pause_cartoon_Duration", pause_cartoon_duration) # from gazecontingent function
@@ -1234,6 +743,7 @@ def run_experiment():
             trials.addData('cartoon_start', cartoon_start_time)
             trials.addData("cartoon_actual_duration", actual_cartoon_duration) #   from gazecontingent function, containing fixcorss presentation, gaze_offset_duration, no_data_duration, pause_duration
             trials.addData("num_repetitions", num_repetitions) # the number of repetitions of the sequence in the trial
+            gaze_engine.add_episodes(trials)
             
             
              # Modify data logging for RAND20-REG1
@@ -1294,9 +804,10 @@ def run_experiment():
         #exp.saveAsPickle(str(fileName))
         exp.saveAsWideText(str(trials_data_folder / (fileName + ".csv")), delim=",")
         exp.saveAsPickle(str(trials_data_folder / (fileName + ".psydat")))
-
-        win.close()
-        core.quit()
+        cartoon_preloader.close()
+        backup_journal.close()
+        write_trial_store(exp, trials_data_folder / (fileName + ".parquet"), TRIAL_SCHEMAS[Path(__file__).stem])
+        end_task(win)
 
 if __name__ == "__main__":
     run_experiment()
\ No newline at end of file
@@ -4,8 +4,8 @@ os.environ['PYTHONUNBUFFERED'] = '1'  # Helps with audio stability
 
 # Set preferences early
 from psychopy import prefs
-# Default to sounddevice for the runner itself
-prefs.hardware['audioLib'] = ['PTB','sounddevice', 'pyo', 'pygame']
+# PTB audio for the tasks, saved once per battery: the task processes read the saved user prefs
+prefs.hardware['audioLib'] = ['ptb', 'sounddevice', 'pyo']
 prefs.hardware['audioLatencyMode'] = 3  # Aggressive timing
 prefs.saveUserPrefs()
 
@@ -13,11 +13,13 @@ prefs.saveUserPrefs()
 import subprocess
 import logging
 import platform
-from psychopy import gui, core, visual, event, monitors, sound
+from psychopy import gui, core, visual, event, monitors
 from datetime import datetime
 from pathlib import Path
 import json
+import functools
 import random
+import runpy
 import sys
 import time
 import gc
@@ -34,6 +36,16 @@ except FileNotFoundError:
     sys.exit(1)
 
 venv_python = Path(config["python_env"]["venv_path"]).resolve()
+
+# Shared task components (tasks/shared):
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from shared.startup_profiler import STARTUP_PROFILE_VARIABLE
+from shared.tracker_cache import TRACKER_CACHE_VARIABLE, connect_eyetrackers
+from shared.video_player import PrefetchedVideo, video_duration
+
+# Startup timings of the tasks (<task log folder>/<fileName>_startup.json), inherited by the task processes:
+if config.get("runner", {}).get("startup_profile", False):
+    os.environ[STARTUP_PROFILE_VARIABLE] = "1"
 task_paths = config["task_paths"]
 
 # Logging setup
@@ -45,12 +57,31 @@ filename_runner = os.path.join(logging_path, f"battery_log_{formatted_datetime}.
 if not logging_path.exists():
     logging_path.mkdir(parents=True, exist_ok=True)
 
-logging.basicConfig(
-    level=logging.INFO,
-    filename=filename_runner,
-    filemode="w",
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+# Own logger: in in-process mode every task configures the root logger for its own log file.
+log = logging.getLogger("runner")
+log.setLevel(logging.INFO)
+log.propagate = False
+runner_handler = logging.FileHandler(filename_runner, mode="w")
+runner_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+log.addHandler(runner_handler)
+
+# Battery mode (config.json "runner" -> "mode"):
+# "subprocess": every task runs in its own Python interpreter (run_task)
+# "in_process": the tasks run in this process and share one window, LSL outlet and eye tracker (run_task_in_process)
+# "standby": every task runs in its own Python interpreter, started and initialized ahead of its turn
+#            (run_task_standby, tasks/shared/standby.py)
+battery_mode = config.get("runner", {}).get("mode", "subprocess")
+# Standby mode: start the next task's interpreter when the current task starts (True) or when it has ended,
+# during the between-task video (False: no extra CPU and disk load while a task is running)
+standby_during_task = config.get("runner", {}).get("standby_during_task", False)
+# Between-task videos (config.json "runner" -> "between_task_video"):
+# "external": FFplay, VLC or the system player in full screen
+# "in_window": in the shared window of the in-process mode, decoded while the task before the video is running
+#              (tasks/shared/video_player.py), falls back to the external players in the other modes
+between_task_video = config.get("runner", {}).get("between_task_video", "external")
+if between_task_video == "in_window" and battery_mode != "in_process":
+    log.warning("In-window videos need the in-process mode, using external players.")
+    between_task_video = "external"
 
 system_info = {
     "OS": platform.system(),
@@ -58,7 +89,7 @@ system_info = {
     "Python Version": platform.python_version(),
     "Virtual Environment Path": str(venv_python)
 }
-logging.info(f"System Info: {system_info}")
+log.info(f"System Info: {system_info}")
 
 # Participant dialog
 exp_info = {
@@ -68,12 +99,12 @@ exp_info = {
 
 dlg = gui.DlgFromDict(dictionary=exp_info, title="Experiment Session")
 if not dlg.OK:
-    logging.warning("Experiment cancelled.")
+    log.warning("Experiment cancelled.")
     core.quit()
 
 participant_id = exp_info["Participant ID"]
 timepoint = exp_info["Timepoint"]
-logging.info(f"Participant: {participant_id}, Timepoint: {timepoint}")
+log.info(f"Participant: {participant_id}, Timepoint: {timepoint}")
 
 # Define tasks
 tasks = [
@@ -120,15 +151,21 @@ def reset_audio():
             audio.PsychPortAudio('Close', -1)  # Close all devices
         except Exception as e:
             if 'pamaster' not in str(e).lower():
-                logging.debug(f"PTB audio close error: {e}")
+                log.debug(f"PTB audio close error: {e}")
     except ImportError:
         pass
+    # In-process mode: streams cached by PsychoPy's PTB backend are closed now, the next task opens new ones
+    backend_ptb = sys.modules.get("psychopy.sound.backend_ptb")
+    if backend_ptb is not None and isinstance(getattr(backend_ptb, "streams", None), dict):
+        backend_ptb.streams.clear()
     
-    # Shutdown PsychoPy sound
-    try:
-        sound.backend.shutdown()
-    except Exception as e:
-        logging.debug(f"Sound backend shutdown: {e}")
+    # Shutdown PsychoPy sound (only loaded in this process by the tasks of an in-process battery)
+    sound = sys.modules.get("psychopy.sound")
+    if sound is not None:
+        try:
+            sound.backend.shutdown()
+        except Exception as e:
+            log.debug(f"Sound backend shutdown: {e}")
     
     # Wait a moment to ensure audio systems reset
     time.sleep(0.5)
@@ -141,24 +178,20 @@ def force_cleanup():
             gc.collect()
             time.sleep(0.1)
     except Exception as e:
-        logging.debug(f"GC error: {e}")
+        log.debug(f"GC error: {e}")
 
 def set_task_audio():
-    """Configure audio for tasks"""
+    """Configure audio for tasks (PTB prefs are saved once at the start of the battery)"""
     reset_audio()
     
-    from psychopy import prefs
-    prefs.hardware['audioLib'] = ['ptb', 'sounddevice', 'pyo']
-    prefs.saveUserPrefs()
-    
     # Wait for audio to initialize
     time.sleep(0.5)
     
-    logging.info("Set audio backend for tasks (PTB)")
+    log.info("Reset audio for task (PTB)")
 
 def play_video_external(video_path):
     """Play a video using an external player (VLC or system default)"""
-    logging.info(f"Playing video with external player: {Path(video_path).name}")
+    log.info(f"Playing video with external player: {Path(video_path).name}")
     print(f"Starting video playback: {Path(video_path).name}")
     
     # First try VLC if available (better control)
@@ -190,10 +223,10 @@ def play_video_external(video_path):
                     str(video_path)
                 ], check=True)
                 success = True
-                logging.info("Video played successfully with VLC")
+                log.info("Video played successfully with VLC")
                 print("Video played successfully with VLC")
             except Exception as e:
-                logging.error(f"Error playing with VLC: {e}")
+                log.error(f"Error playing with VLC: {e}")
                 print(f"Error playing video with VLC: {e}")
                 success = False
     
@@ -207,13 +240,14 @@ def play_video_external(video_path):
             else:  # Linux
                 subprocess.run(["xdg-open", str(video_path)], check=True)
             
-            # Give the video time to play - approx length of videos
-            time.sleep(30)  # Adjust based on your video length
+            # Give the video time to play: its duration (approx. length of the videos if it cannot be read)
+            duration = video_duration(video_path)
+            time.sleep(duration if duration is not None else 30)
             success = True
-            logging.info("Video played with system default player")
+            log.info("Video played with system default player")
             print("Video played with system default player")
         except Exception as e:
-            logging.error(f"Error playing with system player: {e}")
+            log.error(f"Error playing with system player: {e}")
             print(f"Error playing video with system player: {e}")
     
     # Log completion
@@ -225,30 +259,31 @@ def play_video_external(video_path):
     # Force cleanup and reset
     force_cleanup()
 
-# Alternative video playback using Python's subprocess to run ffplay
-def play_video_ffplay(video_path):
-    """Play video using FFplay (from FFmpeg)"""
-    logging.info(f"Playing video with FFplay: {Path(video_path).name}")
-    print(f"Attempting to play video with FFplay: {Path(video_path).name}")
-    
-    # Check if FFplay/FFmpeg is installed
-    ffplay_cmd = None
+@functools.lru_cache(maxsize=None)
+def find_ffplay():
+    """FFplay command, or None if FFplay/FFmpeg is not installed (probed once per battery)"""
     try:
         # Check for ffplay in path
         subprocess.run(["ffplay", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        ffplay_cmd = "ffplay"
-    except:
+        return "ffplay"
+    except Exception:
         # Look for common FFmpeg installation locations on Windows
         ffmpeg_paths = [
             r"C:\Program Files\ffmpeg\bin\ffplay.exe",
             r"C:\ffmpeg\bin\ffplay.exe",
         ]
-        
         for path in ffmpeg_paths:
             if os.path.exists(path):
-                ffplay_cmd = path
-                break
+                return path
+    return None
+
+# Alternative video playback using Python's subprocess to run ffplay
+def play_video_ffplay(video_path):
+    """Play video using FFplay (from FFmpeg)"""
+    log.info(f"Playing video with FFplay: {Path(video_path).name}")
+    print(f"Attempting to play video with FFplay: {Path(video_path).name}")
     
+    ffplay_cmd = find_ffplay()
     if ffplay_cmd:
         try:
             # Use ffplay for reliable playback
@@ -263,15 +298,15 @@ def play_video_ffplay(video_path):
                 str(video_path)       # Video path
             ], check=True)
             
-            logging.info("Video played successfully with FFplay")
+            log.info("Video played successfully with FFplay")
             print("Video played successfully with FFplay")
             return True
         except Exception as e:
-            logging.error(f"Error playing with FFplay: {e}")
+            log.error(f"Error playing with FFplay: {e}")
             print(f"Error playing video with FFplay: {e}")
             return False
     else:
-        logging.warning("FFplay not found, falling back to system player")
+        log.warning("FFplay not found, falling back to system player")
         print("FFplay not found, falling back to system player")
         return False
 
@@ -279,28 +314,14 @@ def play_video_ffplay(video_path):
 media_folder = Path("media/between_tasks_videos").resolve()
 video_files = list(media_folder.glob("*.mp4"))
 if not video_files:
-    logging.warning("No videos found in between_tasks_videos folder.")
+    log.warning("No videos found in between_tasks_videos folder.")
 else:
-    logging.info(f"Found {len(video_files)} between-task videos.")
-
-# Create a file with PTB audio settings
-def create_temp_ptb_settings():
-    """Create a temporary python file with PTB audio settings"""
-    tmp_file = Path("temp_ptb_settings.py")
-    with open(tmp_file, "w") as f:
-        f.write("""
-# Temporary PTB audio settings
-from psychopy import prefs
-prefs.hardware['audioLib'] = ['ptb', 'sounddevice', 'pyo']
-prefs.saveUserPrefs()
-print("PTB audio settings applied.")
-""")
-    return tmp_file
+    log.info(f"Found {len(video_files)} between-task videos.")
 
 # Run a single task
 def run_task(task_name, task_path):
     task_start_time = core.getTime()
-    logging.info(f"Starting task: {task_name}")
+    log.info(f"Starting task: {task_name}")
     print(f"Running {task_name}...")
 
     # Force cleanup before task
@@ -309,9 +330,6 @@ def run_task(task_name, task_path):
     # Set audio for task
     set_task_audio()
     
-    # Create temp PTB settings file
-    temp_settings = create_temp_ptb_settings()
-    
     # Environment variables
     env = os.environ.copy()
     env["PSYCHOPY_AUDIO_PTB_DEBUG"] = "1"  # Enable PTB audio debugging
@@ -320,28 +338,157 @@ def run_task(task_name, task_path):
     
     # Run the task
     try:
-        # Apply PTB settings first
-        pre_cmd = f"{str(venv_python)} {str(temp_settings)}"
-        subprocess.run(pre_cmd, shell=True, env=env, check=True)
-        
         # Run task
         cmd = f"{str(venv_python)} {str(task_script)} {participant_id} {timepoint}"
         subprocess.run(cmd, shell=True, env=env, check=True)
     except subprocess.CalledProcessError as e:
-        logging.error(f"Task {task_name} failed with code {e.returncode}")
+        log.error(f"Task {task_name} failed with code {e.returncode}")
     except Exception as e:
-        logging.error(f"Task {task_name} error: {e}")
+        log.error(f"Task {task_name} error: {e}")
     
-    # Cleanup
-    if temp_settings.exists():
-        temp_settings.unlink()
     # Reset audio after task
     reset_audio()
     force_cleanup()
 
     task_end_time = core.getTime()
     duration = task_end_time - task_start_time
-    logging.info(f"Finished {task_name}: {duration:.2f} sec ({duration / 60:.2f} min)")
+    log.info(f"Finished {task_name}: {duration:.2f} sec ({duration / 60:.2f} min)")
+
+class StandbyTask:
+    """Task interpreter started ahead of its turn, waiting for the go message (standby mode)."""
+
+    def __init__(self, task_name, task_path):
+        self.task_name = task_name
+        self.task_path = task_path
+        task_script = Path(config["task_base_path"]) / task_path
+        standby_script = Path(config["task_base_path"]) / "tasks/shared/standby.py"
+        env = os.environ.copy()
+        env["PSYCHOPY_AUDIO_PTB_DEBUG"] = "1"  # Enable PTB audio debugging
+        self.process = subprocess.Popen(
+            [str(venv_python), str(standby_script), str(task_script), "tasks/cartoon_version/config.json"],
+            stdin=subprocess.PIPE, env=env, text=True)
+        self.spawn_time = core.getTime()
+        log.info(f"Started standby process for {task_name}")
+
+    def go(self):
+        """Send participant ID and timepoint, the task starts. False if the standby process has already ended."""
+        if self.process.poll() is not None:
+            return False
+        try:
+            self.process.stdin.write(json.dumps({"participant_id": participant_id, "timepoint": timepoint}) + "\n")
+            self.process.stdin.close()
+        except OSError:
+            return False
+        log.info(f"Go for {self.task_name}, standby process started {core.getTime() - self.spawn_time:.2f} sec before")
+        return True
+
+    def cancel(self):
+        """End a standby process that will not run its task (end of input, then kill)."""
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+
+# Run a single task in a standby process, returns the standby process of the next task
+def run_task_standby(task_name, standby_task, next_task=None):
+    task_start_time = core.getTime()
+    log.info(f"Starting task (standby process): {task_name}")
+    print(f"Running {task_name}...")
+
+    force_cleanup()
+    set_task_audio()
+
+    if not standby_task.go():
+        log.error(f"Standby process of {task_name} ended with code {standby_task.process.returncode} before the task, "
+                  f"running the task in a new process")
+        standby_task.cancel()
+        run_task(task_name, standby_task.task_path)
+        standby_task = None
+
+    next_standby = None
+    if next_task is not None and standby_during_task:
+        next_standby = StandbyTask(next_task, task_paths[next_task])
+
+    if standby_task is not None:
+        returncode = standby_task.process.wait()
+        if returncode != 0:
+            log.error(f"Task {task_name} failed with code {returncode}")
+        reset_audio()
+        force_cleanup()
+
+    # Next task initializes during the between-task video:
+    if next_task is not None and next_standby is None:
+        next_standby = StandbyTask(next_task, task_paths[next_task])
+
+    duration = core.getTime() - task_start_time
+    log.info(f"Finished {task_name}: {duration:.2f} sec ({duration / 60:.2f} min)")
+    return next_standby
+
+def cache_eyetracker():
+    """Search for the eye tracker once per battery, the tasks connect by the cached address (tracker_cache.py)."""
+    if config["constants"]["eyetracker"]["testmode"]:
+        return None
+    tracker_cache_path = logging_path / f"tracker_{formatted_datetime}.json"
+    found_eyetrackers = connect_eyetrackers(tracker_cache_path)
+    if not found_eyetrackers:
+        log.warning("No eye tracker found, every task searches again.")
+        return None
+    os.environ[TRACKER_CACHE_VARIABLE] = str(tracker_cache_path)  # inherited by the task processes
+    eyetracker = found_eyetrackers[0]
+    log.info(f"Eye tracker cached in {tracker_cache_path.name}: {eyetracker.address}, {eyetracker.model}, "
+             f"serial number {eyetracker.serial_number}")
+    return found_eyetrackers
+
+def start_battery_session(eyetrackers=None):
+    """In-process mode: open the window and the LSL outlet once for all tasks (eye trackers: cache_eyetracker)."""
+    from shared.session import BatterySession, start_session, open_window
+    from pylsl import StreamInfo, StreamOutlet
+
+    setup_start = time.perf_counter()
+    win = open_window(config)
+    info = StreamInfo(
+        name='Markers',
+        type='Markers',
+        channel_count=3,
+        nominal_srate=0,
+        channel_format='string',
+        source_id='stimulus_stream'
+    )
+    outlet = StreamOutlet(info)
+    log.info(f"Battery session set up in {time.perf_counter() - setup_start:.2f} sec")
+    return start_session(BatterySession(participant_id, timepoint, win, outlet, eyetrackers))
+
+# Run a single task in this process (in-process mode)
+def run_task_in_process(task_name, task_path, session):
+    task_start_time = core.getTime()
+    log.info(f"Starting task (in-process): {task_name}")
+    print(f"Running {task_name}...")
+
+    task_script = Path(config["task_base_path"]) / task_path
+    runner_argv = sys.argv
+    # The task scripts read participant ID and timepoint from the command line:
+    sys.argv = [str(task_script), participant_id, timepoint]
+    session.start_task(task_name)
+    try:
+        runpy.run_path(str(task_script), run_name="__main__")
+    except SystemExit:
+        pass  # end of the task (shared.session.end_task) or abort
+    except Exception as e:
+        log.error(f"Task {task_name} error: {e}", exc_info=True)
+    finally:
+        sys.argv = runner_argv
+        session.previous_task_ended = time.perf_counter()
+    # Close the PTB audio streams of the task, as after a task process:
+    reset_audio()
+    force_cleanup()
+
+    duration = core.getTime() - task_start_time
+    latency = session.latencies.get(task_name)
+    if latency is not None:
+        log.info(f"Between-task latency before {task_name}: {latency:.3f} sec")
+    log.info(f"Finished {task_name}: {duration:.2f} sec ({duration / 60:.2f} min)")
 
 # Pre-select 3 unique videos without replacement
 video_selection = random.sample(video_files, min(3, len(video_files)))
@@ -349,28 +496,59 @@ video_idx = 0  # To track which video to show next
 
 # --- MAIN LOOP ---
 if __name__ == "__main__":
+    standby_task = None  # standby mode: process of the next task
+    prefetched_video = None  # in-window videos: the video after the current task
     try:
         # Initial audio setup
         set_task_audio()
-        
+
+        eyetrackers = cache_eyetracker()
+        battery_session = start_battery_session(eyetrackers) if battery_mode == "in_process" else None
+        log.info(f"Battery mode: {battery_mode}")
+
         # Process tasks
         for idx, task_name in enumerate(tasks):
             if task_name in task_paths:
                 task_script = task_paths[task_name]
                 
+                # In-window videos: the video after this task is decoded while the task is running
+                if (between_task_video == "in_window" and idx < len(tasks) - 1
+                        and video_idx < len(video_selection)):
+                    prefetched_video = PrefetchedVideo(
+                        video_selection[video_idx],
+                        width=config["runner"].get("video_width", 1280),
+                        buffer_seconds=config["runner"].get("video_buffer_seconds", 2.0))
+
                 # Run the task
-                run_task(task_name, task_script)
+                if battery_session is not None:
+                    run_task_in_process(task_name, task_script, battery_session)
+                elif battery_mode == "standby":
+                    next_task = next((name for name in tasks[idx + 1:] if name in task_paths), None)
+                    if standby_task is None:
+                        standby_task = StandbyTask(task_name, task_script)
+                    standby_task = run_task_standby(task_name, standby_task, next_task)
+                else:
+                    run_task(task_name, task_script)
 
                 # Show video between tasks (not after last task)
                 if idx < len(tasks) - 1 and video_idx < len(video_selection):
                     selected_video = video_selection[video_idx]
                     video_idx += 1  # Move to next video for next inter-task slot
                     
+                    if prefetched_video is not None:
+                        log.info(f"Playing video in the window: {selected_video.name}")
+                        played = prefetched_video.play(battery_session.win)
+                        prefetched_video = None
+                        if played is not None:
+                            log.info(f"Video played in the window: {played:.2f} sec")
+                            continue
+                        log.error(f"In-window video failed, using external players: {selected_video.name}")
+
                     # Try FFplay first, then fall back to external player
                     if not play_video_ffplay(str(selected_video)):
                         play_video_external(str(selected_video))
             else:
-                logging.warning(f"Task {task_name} not found in config.")
+                log.warning(f"Task {task_name} not found in config.")
 
         # Print completion message to console instead of showing to participant
         print("\nAll tasks complete! Thank you for participating.")
@@ -378,13 +556,19 @@ if __name__ == "__main__":
         # Battery complete
         battery_end_time = core.getTime()
         total_duration = battery_end_time - battery_start_time
-        logging.info(f"Total battery duration: {total_duration:.3f} sec")
+        log.info(f"Total battery duration: {total_duration:.3f} sec")
+        if battery_session is not None and battery_session.latencies:
+            log.info(f"Between-task latencies: {battery_session.latencies}")
         print(f"\nAll tasks complete! Total duration: {total_duration/60:.2f} minutes")
         
     except Exception as e:
-        logging.error(f"Battery execution error: {e}", exc_info=True)
+        log.error(f"Battery execution error: {e}", exc_info=True)
     finally:
-        
+        if standby_task is not None:
+            standby_task.cancel()
+        if prefetched_video is not None:
+            prefetched_video.close()
+
          # Final cleanup
         reset_audio()
         force_cleanup()
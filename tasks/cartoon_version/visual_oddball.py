@@ -1,30 +1,46 @@
-from psychopy import visual, core, data, event, gui, logging, monitors, clock
-import random, numpy, time
+# Startup timings (tasks/shared/startup_profiler.py), set up before the task modules are imported:
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from shared.startup_profiler import StartupProfiler, TASK_MODULES
+startup = StartupProfiler()
+startup.import_modules(TASK_MODULES)
+from psychopy import visual, core, data, event, logging, monitors, clock
+import random, time
 import logging
 import numpy as np
 from pathlib import Path
 from datetime import datetime
 from psychopy.hardware import keyboard
-import tobii_research as tr
 from psychopy.iohub import launchHubServer
 from psychopy.monitors import Monitor
-# Library for managing paths
-from pathlib import Path
 # For logging data in a .log file:
 import logging
 from datetime import datetime
-import os, csv
+import os
 import traceback
 import json
-import sys
+# Shared task components (tasks/shared):
+from shared.task_logging import setup_task_logging
+from shared.session import task_window, marker_outlet, find_eyetrackers, task_ready, end_task
+from shared.lazy_import import lazy_module
+from shared.gaze_redirect import get_gaze_redirect
+from shared.gaze_stream import GazeStream
+from shared.trial_store import write_trial_store
+from shared.trial_schemas import TRIAL_SCHEMAS
+from shared.trial_journal import TrialJournal
+from shared.gaze_contingent import GazeContingentEngine, FIXED
 import pandas as pd
 #send trigger via LSL
 from pylsl import StreamInfo, StreamOutlet
+# Dialog toolkit only imported when the pause or quit dialog is opened:
+gui = lazy_module('psychopy.gui')
 
 
 # Load the config file
-with open("tasks/cartoon_version/config.json", "r") as file:
-    config = json.load(file)
+with startup.phase('config'):
+    with open("tasks/cartoon_version/config.json", "r") as file:
+        config = json.load(file)
 
 # Select the task
 task_name = "visual-oddball"
@@ -44,11 +60,11 @@ if not logging_path.exists():
 else:
     print(f"Directory {logging_path} already exists. Continuing to use it.")
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    filename=filename_visual_oddball,
-    filemode='w',  # w = write, for each subject a separate log file
-    format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+# Non-blocking task logging via a queue and a listener thread (tasks/shared/task_logging.py),
+# console output is written to the log file in production mode:
+setup_task_logging(
+    filename_visual_oddball,
+    production=config["constants"]["production_mode"])
 
 
 trials_data_folder = Path(task_config["data_paths"]["trials"]).resolve()
@@ -74,46 +90,42 @@ selected_timepoint = timepoint  # Get the first item from the list
 # Name for output data
 fileName =  f'{task_name}_{participant_id}_{selected_timepoint}_{data.getDateStr(format="%Y-%m-%d-%H%M")}'
 
-import csv, os
-
-# Define backup CSV path
-backup_path = trials_data_folder / (fileName + "_backup.csv")
-
-# Create backup CSV file with header if it doesn't exist
-if not os.path.exists(backup_path):
-    with open(backup_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            # Baseline fixation
-            "baseline_trial_number",
-            "condition",
-            "timestamp_exp",
-            "expected_baseline_fixation_duration",
-            "baseline_fixation_duration",
-            "baseline_fixation_actual_duration",
-            "baseline_fixation_gaze_offset_duration",
-            "baseline_fixation_pause_duration",
-            "baseline_fixation_nodata_duration",
-            
-            # Stimulus trial info
-            "trial_number",
-            "trial_type",
-            "stimulus_start_timestamp",
-            "stimulus_end_timestamp",
-            "stimulus_duration",
-            "nodata_stimulus",
-            "trial_duration",
-            
-            # ISI
-            "ISI_start_timestamp",
-            "ISI_end_timestamp",
-            "expected_isi_duration",
-            "ISI_duration_timestamp",
-            "actual_isi_duration",
-            "gaze_offset_isi_duration",
-            "pause_isi_duration",
-            "nodata_isi_duration"
-        ])
+# Define backup journal path
+backup_path = trials_data_folder / (fileName + "_backup.jsonl")
+
+# Backup journal, rows are written by a background thread (tasks/shared/trial_journal.py).
+# Rebuild the backup CSV: python -m tasks.shared.trial_journal <journal.jsonl>
+backup_journal = TrialJournal(backup_path, [
+    # Baseline fixation
+    "baseline_trial_number",
+    "condition",
+    "timestamp_exp",
+    "expected_baseline_fixation_duration",
+    "baseline_fixation_duration",
+    "baseline_fixation_actual_duration",
+    "baseline_fixation_gaze_offset_duration",
+    "baseline_fixation_pause_duration",
+    "baseline_fixation_nodata_duration",
+
+    # Stimulus trial info
+    "trial_number",
+    "trial_type",
+    "stimulus_start_timestamp",
+    "stimulus_end_timestamp",
+    "stimulus_duration",
+    "nodata_stimulus",
+    "trial_duration",
+
+    # ISI
+    "ISI_start_timestamp",
+    "ISI_end_timestamp",
+    "expected_isi_duration",
+    "ISI_duration_timestamp",
+    "actual_isi_duration",
+    "gaze_offset_isi_duration",
+    "pause_isi_duration",
+    "nodata_isi_duration"
+])
 
 # Function to append trial or baseline data
 def log_backup_trial_odd(
@@ -174,11 +186,7 @@ def log_backup_trial_odd(
         nodata_isi_duration
     ]
 
-    with open(backup_path, "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(row)
-        f.flush()
-        os.fsync(f.fileno())
+    backup_journal.write(row)
 
 
 # Experiment handler
@@ -205,7 +213,7 @@ info = StreamInfo(
     channel_format='string',  # Markers are usually strings
     source_id='stimulus_stream'  # Unique ID for your experiment/session
 )
-outlet = StreamOutlet(info)
+outlet = marker_outlet(lambda: StreamOutlet(info))  # battery outlet in in-process mode
 
 # Access values
 audio_device = config["constants"]["audio"]["device"]
@@ -222,14 +230,8 @@ mon.setWidth(config["constants"]["monitor"]["width_cm"])  # Physical width of th
 mon.setDistance(config["constants"]["monitor"]["distance_cm"])  # Distance from participant
 mon.setSizePix([config["constants"]["monitor"]["width"], config["constants"]["monitor"]["height"]])  # Screen resolution
 
-win = visual.Window(
-    size=(config["constants"]["monitor"]["width"], config["constants"]["monitor"]["height"]),
-    fullscr=config["constants"]["psychopy_window"]["fullscreen"],
-    screen=config["constants"]["presentation_screen"],
-    color=config["constants"]["psychopy_window"]["background_color"],
-    monitor=MONITOR_NAME,
-    units='pix'
-)
+with startup.phase('window'):
+    win = task_window(config)  # battery window in in-process mode (runner.py)
 
 refresh_rate = win.monitorFramePeriod #get monitor refresh rate in seconds
 print('monitor refresh rate: ' + str(round(refresh_rate, 3)) + ' seconds')
@@ -242,7 +244,8 @@ if testmode_et:  # Use mouse in test mode
 else:  # Otherwise, initialize actual eye tracker
     logging.info('TESTMODE = FALSE')
     # Search for the eye tracker
-    found_eyetrackers = tr.find_all_eyetrackers()
+    with startup.phase('tracker_discovery'):
+        found_eyetrackers = find_eyetrackers()
     if found_eyetrackers:
         my_eyetracker = found_eyetrackers[0]
         print("Address: " + my_eyetracker.address)
@@ -261,15 +264,18 @@ else:  # Otherwise, initialize actual eye tracker
         print('No eye tracker found!')
     
 # IOHUB creates a different instance that records eye tracking data in hdf5 file saved in datastore_name:
-io = launchHubServer(**iohub_config,
-                        experiment_code = str(eyetracking_data_folder),
-                        session_code = str(fileName),
-                        datastore_name = str(eyetracking_data_folder / str(fileName)), #where data is stored
-                        window = win)
+with startup.phase('iohub'):
+    io = launchHubServer(**iohub_config,
+                            experiment_code = str(eyetracking_data_folder),
+                            session_code = str(fileName),
+                            datastore_name = str(eyetracking_data_folder / str(fileName)), #where data is stored
+                            window = win)
 
 # Call the eyetracker device and start recording - different instance:
 tracker = io.devices.tracker
 tracker.setRecordingState(True)
+task_ready()
+startup.save(Path(logging_path, fileName + '_startup.json'), task=task_name)
 print(tracker)
 
 #Send a trigger (marker) function
@@ -277,107 +283,14 @@ def send_trigger(marker):
     # marker must be a list of strings, length = channel_count
     outlet.push_sample(marker)
 
+gaze_redirect = get_gaze_redirect(win, size_fixation_cross_in_pixels, background_color_rgb)
+
 # Draw figure for gaze contincency, when gaze is offset:
 def draw_gazedirect(background_color = background_color_rgb):
-        # Adapt background according to provided "background color"
-    if background_color is not background_color_rgb:
-        background_rect = visual.Rect(
-            win = win,
-            size = win.size,
-            fillColor = background_color)
-        background_rect.draw()
-    # Parameters:
-    function_color = 'red'
-    arrow_size_pix = size_fixation_cross_in_pixels
-    arrow_pos_offset = 5
-    width = 3
-
-    rect1 = visual.Rect(
-        win = win,
-        units = 'pix',
-        lineColor = function_color,
-        fillColor = background_color,
-        lineWidth = width,
-        size = size_fixation_cross_in_pixels*6)
-
-    # Arrow left:
-    al_line1 = visual.Line(win = win, units = 'pix', lineColor=function_color, lineWidth=width)
-    al_line1.start = [-(arrow_size_pix*arrow_pos_offset), 0]
-    al_line1.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth=width)
-    al_line2.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    al_line2.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line3 = visual.Line(win = win, units = 'pix', lineColor=function_color, lineWidth=width)
-    al_line3.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    al_line3.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow right:
-    ar_line1 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line1.start = [+(arrow_size_pix*arrow_pos_offset), 0]
-    ar_line1.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line2 = visual.Line(win = win, units='pix', lineColor = function_color, lineWidth = width)
-    ar_line2.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    ar_line2.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line3.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    ar_line3.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow top:
-    at_line1 = visual.Line(win = win, units='pix', lineColor = function_color, lineWidth = width)
-    at_line1.start = [0, +(arrow_size_pix*arrow_pos_offset)]
-    at_line1.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line2.start = [-arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line2.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line3.start = [+arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line3.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Arrow bottom:
-    ab_line1 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth=width)
-    ab_line1.start = [0, -(arrow_size_pix*arrow_pos_offset)]
-    ab_line1.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line2.start = [+arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line2.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line3.start = [-arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line3.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Draw all:
-    al_line1.draw()
-    al_line2.draw()
-    al_line3.draw()
-
-    ar_line1.draw()
-    ar_line2.draw()
-    ar_line3.draw()
-
-    at_line1.draw()
-    at_line2.draw()
-    at_line3.draw()
-
-    ab_line1.draw()
-    ab_line2.draw()
-    ab_line3.draw()
-
-    rect1.draw()
-
-def check_nodata(gaze_position):
-    """Return True if no gaze data is available."""
-    return gaze_position is None
-
-
-# Get gaze position and offset cutoff.
-gaze_offset_cutoff = 3 * size_fixation_cross_in_pixels
+    gaze_redirect.draw(background_color)
 
-def check_gaze_offset(gaze_position):
-    """
-    Check if gaze is outside the cutoff distance from center.
-    Assumes gaze_position is not None.
-    """
-    gaze_center_offset = numpy.sqrt((gaze_position[0])**2 + (gaze_position[1])**2)  # Pythagoras theorem
-    return gaze_center_offset >= gaze_offset_cutoff
+# Gaze offset cutoff from the screen center:
+gaze_offset_cutoff = 3 * size_fixation_cross_in_pixels
 
 # SETUP KEYBORD
 kb = keyboard.Keyboard()
@@ -398,7 +311,7 @@ def check_keypress():
 
         if dlg.OK:  # or if ok_data is not None
             print('EXPERIMENT ABORTED!')
-            core.quit()
+            end_task()
         else:
             print('Experiment continues...')
             current_screen = PRESENTATION_SCREEN
@@ -419,6 +332,12 @@ def check_keypress():
         pause_time = round(pause_time,3) if pause_time else 0
     return pause_time 
 
+gaze_engine = GazeContingentEngine(
+    win,
+    GazeStream(tracker, gaze_offset_cutoff),
+    keypress_check=check_keypress,
+    draw_offset=draw_gazedirect)
+
 def oddball_gazecontingent(oddball_object, duration_in_seconds, background_color=background_color_rgb):
     """
     Displays an oddball stimulus gaze-contingently.
@@ -428,56 +347,12 @@ def oddball_gazecontingent(oddball_object, duration_in_seconds, background_color
         duration_in_seconds: Duration for which the oddball is displayed (in seconds).
         background_color: Background color of the screen.
     """
-    # Translate duration to number of frames:
-    number_of_frames = round(duration_in_seconds / refresh_rate)
-    timestamp = core.getTime()
-    gaze_offset_isi_duration = 0
-    pause_isi_duration = 0
-    nodata_isi_duration = 0
-    
-    # Oddball presentation for the specified duration:
-    for frameN in range(number_of_frames):
-        # Check for keypress:
-        pause_isi_duration += check_keypress()
-        # Check for eye tracking data, only call once per flip:
-        gaze_position = tracker.getPosition()
-        # Check for eye tracking data:
-        if check_nodata(gaze_position):
-            print('warning: no eyes detected')
-            logging.warning(' NO EYES DETECTED')
-            frameN = 1  # reset duration of for loop - restart stimulus
-            
-            nodata_current_duration = 0
-            while check_nodata(gaze_position):
-                nodata_current_duration
-                win.flip()  # Wait for monitor refresh time
-                nodata_isi_duration += refresh_rate
-                nodata_current_duration += refresh_rate
-                gaze_position = tracker.getPosition()  # Get new gaze data
-        
-        # Check for gaze offset:
-        elif check_gaze_offset(gaze_position):
-            print('warning: gaze offset')
-            frameN = 1  # Reset duration of for loop - restart stimulus
-            
-            while not check_nodata(gaze_position) and check_gaze_offset(gaze_position):
-                # Listen for keypress:
-                pause_isi_duration += check_keypress()
-                draw_gazedirect(background_color)  # Redirect attention to stimulus area
-                win.flip()  # Wait for monitor refresh time
-                gaze_offset_isi_duration += refresh_rate
-                gaze_position = tracker.getPosition()  # Get new gaze data
-        
-        # Draw oddball stimulus:
-        oddball_object.draw()  # Render the fixation cross on the screen
-        win.flip()
-
-    # Generate output info:
-    actual_isi_duration = round(core.getTime() - timestamp, 3)
-    gaze_offset_isi_duration = round(gaze_offset_isi_duration, 3)
-    nodata_isi_duration = round(nodata_isi_duration, 3)
-       
-    return [actual_isi_duration, gaze_offset_isi_duration, pause_isi_duration, nodata_isi_duration]
+    # One frame loop for all tasks, durations are taken from the flip timestamps:
+    result = gaze_engine.run(
+        duration_in_seconds,
+        draw_normal=oddball_object.draw,
+        draw_offset=lambda: draw_gazedirect(background_color))  # Redirect attention to stimulus area
+    return result.as_list()
 
 
 # ==== Stimulus Properties ====
@@ -566,19 +441,16 @@ def run_trial(trial_type):
     # === 1. Show the stimulus first ===
     stimulus = standard if trial_type == 'standard' else oddball
 
-    stimulus_frames = int(STIMULUS_DURATION / refresh_rate)
     stimulus_start = core.getTime()
 
-    for _ in range(stimulus_frames):
-        stimulus.draw()
-
-        if check_nodata(tracker.getPosition()):
-            nodata_stimulus += refresh_rate
-            print ('warning: no eyes detected')
-        elif check_gaze_offset(tracker.getPosition()):
-            print('warning: gaze offset')
-
-        win.flip()
+    # Stimulus is shown regardless of gaze, no data is counted from the gaze samples:
+    result = gaze_engine.run(
+        STIMULUS_DURATION,
+        draw_normal=stimulus.draw,
+        mode=FIXED,
+        check_keys=False,
+        gaze_contingent=False)
+    nodata_stimulus = result.nodata_duration
 
     stimulus_end = core.getTime()
     stimulus_duration = round(stimulus_end - stimulus_start, 3)
@@ -654,6 +526,7 @@ def run_experiment():
                 trials.addData('baseline_fixation_gaze_offset_duration', gaze_offset_fixation)
                 trials.addData('baseline_fixation_pause_duration', pause_fixation)
                 trials.addData('baseline_fixation_nodata_duration', nodata_fixation)
+                gaze_engine.add_episodes(trials)
 
                 # Print relevant information for baseline fixation
                 print(f"\nBaseline Fixation Phase ")
@@ -704,6 +577,7 @@ def run_experiment():
             trials.addData('gaze_offset_isi_duration', gaze_offset_isi_duration)
             trials.addData('pause_isi_duration', pause_isi_duration)
             trials.addData('nodata_isi_duration', nodata_isi_duration)
+            gaze_engine.add_episodes(trials)
             trials.addData('actual_isi_duration', actual_isi_duration) # from gazecontingency function
 
             # Print relevant information for the current stimulus trial
@@ -765,6 +639,7 @@ def run_experiment():
         trials.addData('baseline_fixation_gaze_offset_duration', gaze_offset_fixation)
         trials.addData('baseline_fixation_pause_duration', pause_fixation)
         trials.addData('baseline_fixation_nodata_duration', nodata_fixation)
+        gaze_engine.add_episodes(trials)
         
          # Print relevant information for final fixation
         print(f"\nFinal Baseline Fixation")
@@ -801,6 +676,9 @@ def run_experiment():
         # print("Column names before saving:", trials.data.keys())      
         exp.saveAsWideText(str(trials_data_folder / fileName))
         exp.saveAsPickle(str(trials_data_folder / fileName))
+        # Write the queued backup rows (also on abort or error):
+        backup_journal.close()
+        write_trial_store(exp, trials_data_folder / (fileName + ".parquet"), TRIAL_SCHEMAS[Path(__file__).stem])
         # except Exception as e:
        # print(f"Error while saving:{e}")
 
@@ -809,8 +687,7 @@ def run_experiment():
     # Close iohub instance:
     io.quit()
 
-    win.close()
-    core.quit()
+    end_task(win)
 
 
 # Start the experiment
@@ -4,7 +4,7 @@
 
 '''LOAD MODULES'''
 from psychopy import visual, core, event, clock, data, gui, monitors
-import random, time, numpy
+import random, time
 # For controlling eye tracker and eye-tracking SDK:
 import tobii_research as tr
 from psychopy.iohub import launchHubServer
@@ -26,6 +26,14 @@ from datetime import datetime
 import os # 
 import json
 import sys
+# Shared task components (tasks/shared):
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from shared.task_logging import setup_task_logging
+from shared.gaze_redirect import get_gaze_redirect
+from shared.gaze_stream import GazeStream
+from shared.trial_store import write_trial_store
+from shared.trial_schemas import TRIAL_SCHEMAS
+from shared.gaze_contingent import GazeContingentEngine
 # Miscellaneous: Hide messages in console from pygame:
 from os import environ
 environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
@@ -53,11 +61,11 @@ if not logging_path.exists():
 else:
     print(f"Directory {logging_path} already exists. Continuing to use it.")
 
-logging.basicConfig(
-    level = logging.DEBUG,
-    filename = filename_auditory_oddball,
-    filemode = 'w', # w = write, for each subject an separate log file.
-    format = '%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+# Non-blocking task logging via a queue and a listener thread (tasks/shared/task_logging.py),
+# console output is written to the log file in production mode:
+setup_task_logging(
+    filename_auditory_oddball,
+    production=config["constants"]["production_mode"])
 
 trials_data_folder = Path(task_config["data_paths"]["trials"]).resolve()
 eyetracking_data_folder = Path(task_config["data_paths"]["eyetracking"]).resolve()
@@ -247,90 +255,11 @@ def draw_fixcross(background_color=background_color_rgb, cross_color = 'black'):
     line1.draw()
     line2.draw()
 
+gaze_redirect = get_gaze_redirect(mywin, size_fixation_cross_in_pixels, background_color_rgb)
+
 # Draw figure when gaze is offset for gaze contigency:
 def draw_gazedirect(background_color=background_color_rgb):
-    # Adapt background according to provided "background_color"
-    if background_color is not background_color_rgb:
-        background_rect = visual.Rect(
-            win = mywin,
-            size = mywin.size,
-            fillColor = background_color)
-        background_rect.draw()
-    function_color = 'red'
-    arrow_size_pix = size_fixation_cross_in_pixels
-    arrow_pos_offset = 5
-    width = 3
-
-    rect1 = visual.Rect(
-        win = mywin,
-        units = 'pix',
-        lineColor = function_color,
-        fillColor = background_color,
-        lineWidth = width,
-        size = size_fixation_cross_in_pixels*6)
-
-    # Arrow left:
-    al_line1 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    al_line1.start = [-(arrow_size_pix*arrow_pos_offset), 0]
-    al_line1.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line2 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    al_line2.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    al_line2.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line3 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    al_line3.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    al_line3.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow right:
-    ar_line1 = visual.Line(win = mywin, units='pix', lineColor = function_color, lineWidth = width)
-    ar_line1.start = [+(arrow_size_pix*arrow_pos_offset), 0]
-    ar_line1.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line2 = visual.Line(win = mywin, units='pix', lineColor = function_color, lineWidth = width)
-    ar_line2.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    ar_line2.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line3 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line3.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    ar_line3.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow top:
-    at_line1 = visual.Line(win = mywin, units='pix', lineColor = function_color, lineWidth = width)
-    at_line1.start = [0, +(arrow_size_pix*arrow_pos_offset)]
-    at_line1.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line2 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line2.start = [-arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line2.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line3 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line3.start = [+arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line3.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Arrow bottom:
-    ab_line1 = visual.Line(win = mywin, units='pix', lineColor = function_color, lineWidth = width)
-    ab_line1.start = [0, -(arrow_size_pix*arrow_pos_offset)]
-    ab_line1.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line2 = visual.Line(win = mywin, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line2.start = [+arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line2.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line3 = visual.Line(win = mywin, units='pix', lineColor = function_color, lineWidth = width)
-    ab_line3.start = [-arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line3.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    #draw all
-    al_line1.draw()
-    al_line2.draw()
-    al_line3.draw()
-
-    ar_line1.draw()
-    ar_line2.draw()
-    ar_line3.draw()
-
-    at_line1.draw()
-    at_line2.draw()
-    at_line3.draw()
-
-    ab_line1.draw()
-    ab_line2.draw()
-    ab_line3.draw()
-
-    rect1.draw()
+    gaze_redirect.draw(background_color)
 
 # Check for keypresses, used to pause and quit experiment:
 def check_keypress():
@@ -368,69 +297,23 @@ def check_keypress():
     pause_time = round(pause_time,3)
     return pause_time
 
-def check_nodata(gaze_position):
-    if gaze_position == None:
-        nodata_boolean = True
-    else:
-        nodata_boolean = False
-    return nodata_boolean
-
-# Get gaze position and offset cutoff.
-# Then check for the offset of gaze from the center screen.
-def check_gaze_offset(gaze_position):
-    gaze_center_offset = numpy.sqrt((gaze_position[0])**2 + (gaze_position[1])**2) #pythagoras theorem
-    if gaze_center_offset >= gaze_offset_cutoff:
-        offset_boolean = True
-    else:
-        offset_boolean = False
-    return offset_boolean
+gaze_engine = GazeContingentEngine(
+    mywin,
+    GazeStream(tracker, gaze_offset_cutoff),
+    keypress_check=check_keypress,
+    draw_offset=draw_gazedirect)
 
 # Fixation cross: Check for data availability and screen center gaze.
 def fixcross_gazecontingent(duration_in_seconds, background_color = background_color_rgb, cross_color = 'black'):
-    # Translate duration to number of frames:
-    number_of_frames = round(duration_in_seconds/refresh_rate)
-    timestamp = core.getTime()
-    gaze_offset_duration = 0
-    pause_duration = 0
-    nodata_duration = 0
-    # Cross presentation for number of frames:
-    for frameN in range(number_of_frames):
-        # Check for keypress:
-        pause_duration += check_keypress()
-        # Check for eye tracking data, only call once per flip:
-        gaze_position = tracker.getPosition()
-        # Check for eye tracking data:
-        if check_nodata(gaze_position):
-            print('warning: no eyes detected')
-            logging.warning(' NO EYES DETECTED')
-            frameN = 1 # reset duration of for loop - resart ISI
-            nodata_current_duration = 0
-
-            while check_nodata(gaze_position):
-                mywin.flip() #wait for monitor refresh time
-                nodata_duration += refresh_rate
-                nodata_current_duration += refresh_rate
-                gaze_position = tracker.getPosition() #get new gaze data
-        # Check for gaze:
-        elif check_gaze_offset(gaze_position):
-            print('warning: gaze offset')
-            frameN = 1 #reset duration of for loop - resart ISI
-
-            while not check_nodata(gaze_position) and check_gaze_offset(gaze_position):
-                # Listen for keypress:
-                pause_duration += check_keypress()
-                draw_gazedirect(background_color) #redirect attention to fixation cross area
-                mywin.flip() #wait for monitor refresh time
-                gaze_offset_duration += refresh_rate
-                gaze_position = tracker.getPosition() #get new gaze data
-        # Draw fixation cross:
-        draw_fixcross(background_color, cross_color)
-        mywin.flip()
+    # Cross presentation, extended by no data and gaze offset time:
+    result = gaze_engine.run(
+        duration_in_seconds,
+        draw_normal=lambda: draw_fixcross(background_color, cross_color),
+        draw_offset=lambda: draw_gazedirect(background_color)) #redirect attention to fixation cross area
 
     # Generate output info:
-    actual_fixcross_duration = round(core.getTime()-timestamp,3)
-    gaze_offset_duration = round(gaze_offset_duration,3)
-    nodata_duration = round(nodata_duration,3)
+    number_of_frames = sum(result.frames.values())
+    [actual_fixcross_duration, gaze_offset_duration, pause_duration, nodata_duration] = result.as_list()
 
     print('numberof frames: ' + str(number_of_frames))
     logging.info(' NUMBER OF FRAMES: ' f'{number_of_frames}')
@@ -549,6 +432,7 @@ for phase in phase_handler:
             trials.addData('gaze_offset_duration', offset_duration)
             trials.addData('trial_pause_duration', pause_duration)
             trials.addData('trial_nodata_duration', nodata_duration)
+            gaze_engine.add_episodes(trials)
             trials.addData('timestamp', timestamp) 
             trials.addData('timestamp_exp', timestamp_exp) 
             trials.addData('timestamp_tracker', timestamp_tracker)
@@ -591,6 +475,7 @@ for phase in phase_handler:
             trials.addData('gaze_offset_duration', offset_duration)
             trials.addData('trial_pause_duration', pause_duration)
             trials.addData('trial_nodata_duration', nodata_duration)
+            gaze_engine.add_episodes(trials)
 
             trial_counter += 1
             oddball_trial_counter += 1
@@ -612,6 +497,7 @@ for phase in phase_handler:
         phase_handler.addData('gaze_offset_duration', offset_duration)
         phase_handler.addData('trial_pause_duration', pause_duration)
         phase_handler.addData('trial_nodata_duration', nodata_duration)
+        gaze_engine.add_episodes(phase_handler)
         phase_handler.addData('baseline_trial_counter',baseline_trial_counter)
         phase_handler.addData('trial', phase)
         phase_handler.addData('timestamp', timestamp)
@@ -637,6 +523,8 @@ logging.info(' EXPERIMENT ENDED.')
 tracker.setRecordingState(False)
 # Close iohub instance:
 io.quit()
+# Typed copy of the trial data:
+write_trial_store(exp, trials_data_folder / (fileName + ".parquet"), TRIAL_SCHEMAS[Path(__file__).stem])
 # Close window:
 mywin.close()
 core.quit()
\ No newline at end of file
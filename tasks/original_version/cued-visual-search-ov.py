@@ -5,7 +5,7 @@ from psychopy import visual, core, event, sound, gui, data, clock
 import tobii_research as tr
 from psychopy.iohub import launchHubServer
 from psychopy.monitors import Monitor
-import random, numpy, time
+import random, time
 # Library for managing paths
 from pathlib import Path
 # For logging data in a .log file:
@@ -16,6 +16,14 @@ import traceback
 from datetime import datetime
 import json
 import sys
+# Shared task components (tasks/shared):
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from shared.task_logging import setup_task_logging
+from shared.gaze_redirect import get_gaze_redirect
+from shared.gaze_stream import GazeStream
+from shared.trial_store import write_trial_store
+from shared.trial_schemas import TRIAL_SCHEMAS
+from shared.gaze_contingent import GazeContingentEngine, FIXED
 import cv2
 import numpy as np
 import sounddevice as sd
@@ -44,11 +52,11 @@ if not logging_path.exists():
 else:
     print(f"Directory {logging_path} already exists. Continuing to use it.")
 
-logging.basicConfig(
-    level = logging.DEBUG,
-    filename = filename_visual_search,
-    filemode = 'w', # w = write, for each subject an separate log file.
-    format = '%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+# Non-blocking task logging via a queue and a listener thread (tasks/shared/task_logging.py),
+# console output is written to the log file in production mode:
+setup_task_logging(
+    filename_visual_search,
+    production=config["constants"]["production_mode"])
     
 trials_data_folder = Path(task_config["data_paths"]["trials"]).resolve()
 eyetracking_data_folder = Path(task_config["data_paths"]["eyetracking"]).resolve()
@@ -163,110 +171,14 @@ tracker = io.devices.tracker
 tracker.setRecordingState(True)
 print(tracker)
 
+gaze_redirect = get_gaze_redirect(win, size_fixation_cross_in_pixels, background_color_rgb)
+
 # Draw figure for gaze contincency, when gaze is offset:
 def draw_gazedirect(background_color = background_color_rgb):
-        # Adapt background according to provided "background color"
-    if background_color is not background_color_rgb:
-        background_rect = visual.Rect(
-            win = win,
-            size = win.size,
-            fillColor = background_color)
-        background_rect.draw()
-    # Parameters:
-    function_color = 'red'
-    arrow_size_pix = size_fixation_cross_in_pixels
-    arrow_pos_offset = 5
-    width = 3
-
-    rect1 = visual.Rect(
-        win = win,
-        units = 'pix',
-        lineColor = function_color,
-        fillColor = background_color,
-        lineWidth = width,
-        size = size_fixation_cross_in_pixels*6)
-
-    # Arrow left:
-    al_line1 = visual.Line(win = win, units = 'pix', lineColor=function_color, lineWidth=width)
-    al_line1.start = [-(arrow_size_pix*arrow_pos_offset), 0]
-    al_line1.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth=width)
-    al_line2.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    al_line2.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line3 = visual.Line(win = win, units = 'pix', lineColor=function_color, lineWidth=width)
-    al_line3.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    al_line3.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow right:
-    ar_line1 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line1.start = [+(arrow_size_pix*arrow_pos_offset), 0]
-    ar_line1.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line2 = visual.Line(win = win, units='pix', lineColor = function_color, lineWidth = width)
-    ar_line2.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    ar_line2.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line3.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    ar_line3.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow top:
-    at_line1 = visual.Line(win = win, units='pix', lineColor = function_color, lineWidth = width)
-    at_line1.start = [0, +(arrow_size_pix*arrow_pos_offset)]
-    at_line1.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line2.start = [-arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line2.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line3.start = [+arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line3.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Arrow bottom:
-    ab_line1 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth=width)
-    ab_line1.start = [0, -(arrow_size_pix*arrow_pos_offset)]
-    ab_line1.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line2.start = [+arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line2.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line3.start = [-arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line3.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Draw all:
-    al_line1.draw()
-    al_line2.draw()
-    al_line3.draw()
-
-    ar_line1.draw()
-    ar_line2.draw()
-    ar_line3.draw()
-
-    at_line1.draw()
-    at_line2.draw()
-    at_line3.draw()
-
-    ab_line1.draw()
-    ab_line2.draw()
-    ab_line3.draw()
-
-    rect1.draw()
-
-def check_nodata(gaze_position):
-    if gaze_position == None:
-        nodata_boolean = True
-    else:
-        nodata_boolean = False
-    return nodata_boolean
+    gaze_redirect.draw(background_color)
 
-
-# Get gaze position and offset cutoff.
+# Gaze offset cutoff from the screen center:
 gaze_offset_cutoff = 3*size_fixation_cross_in_pixels
-# Then check for the offset of gaze from the center screen.
-def check_gaze_offset(gaze_position):
-    gaze_center_offset = numpy.sqrt((gaze_position[0])**2 + (gaze_position[1])**2) #pythagoras theorem
-    if gaze_center_offset >= gaze_offset_cutoff:
-        offset_boolean = True
-    else:
-        offset_boolean = False
-    return offset_boolean
 
 # SETUP KEYBORD
 kb = keyboard.Keyboard()
@@ -305,6 +217,12 @@ def check_keypress():
     return pause_time
 
 
+gaze_engine = GazeContingentEngine(
+    win,
+    GazeStream(tracker, gaze_offset_cutoff),
+    keypress_check=check_keypress,
+    draw_offset=draw_gazedirect)
+
 def oddball_gazecontingent(oddball_object, duration_in_seconds, background_color=background_color_rgb):
     """
     Displays an oddball stimulus gaze-contingently.
@@ -314,56 +232,17 @@ def oddball_gazecontingent(oddball_object, duration_in_seconds, background_color
         duration_in_seconds: Duration for which the oddball is displayed (in seconds).
         background_color: Background color of the screen.
     """
-    # Translate duration to number of frames:
-    number_of_frames = round(duration_in_seconds / refresh_rate)
-    timestamp = core.getTime()
-    gaze_offset_duration = 0
-    pause_duration = 0
-    nodata_duration = 0
-    
-    # Oddball presentation for the specified duration:
-    for frameN in range(number_of_frames):
-        # Check for keypress:
-        pause_duration += check_keypress()
-        # Check for eye tracking data, only call once per flip:
-        gaze_position = tracker.getPosition()
-        # Check for eye tracking data:
-        if check_nodata(gaze_position):
-            print('warning: no eyes detected')
-            logging.warning(' NO EYES DETECTED')
-            frameN = 1  # reset duration of for loop - restart stimulus
-            
-            nodata_current_duration = 0
-            while check_nodata(gaze_position):
-                nodata_current_duration
-                win.flip()  # Wait for monitor refresh time
-                nodata_duration += refresh_rate
-                nodata_current_duration += refresh_rate
-                gaze_position = tracker.getPosition()  # Get new gaze data
-        
-        # Check for gaze offset:
-        elif check_gaze_offset(gaze_position):
-            print('warning: gaze offset')
-            frameN = 1  # Reset duration of for loop - restart stimulus
-            
-            while not check_nodata(gaze_position) and check_gaze_offset(gaze_position):
-                # Listen for keypress:
-                pause_duration += check_keypress()
-                draw_gazedirect(background_color)  # Redirect attention to stimulus area
-                win.flip()  # Wait for monitor refresh time
-                gaze_offset_duration += refresh_rate
-                gaze_position = tracker.getPosition()  # Get new gaze data
-        
-        # Draw oddball stimulus:
-        oddball_object.draw()  # Render the oddball on the screen
-        win.flip()
-
-    # Generate output info:
-    actual_oddball_duration = round(core.getTime() - timestamp, 3)
-    gaze_offset_duration = round(gaze_offset_duration, 3)
-    nodata_duration = round(nodata_duration, 3)
-        
-    return [actual_oddball_duration, gaze_offset_duration, pause_duration, nodata_duration]
+    # One frame loop for all tasks, durations are taken from the flip timestamps:
+    result = gaze_engine.run(
+        duration_in_seconds,
+        draw_normal=oddball_object.draw,
+        draw_offset=lambda: draw_gazedirect(background_color))  # Redirect attention to stimulus area
+    return result.as_list()
+
+def blank_gazecontingent(duration_in_seconds):
+    """Blank screen for a fixed duration, returns the no data duration."""
+    result = gaze_engine.run(duration_in_seconds, draw_normal=None, mode=FIXED, check_keys=False, gaze_contingent=False)
+    return result.nodata_duration
 
 # Define circle positions 
 circle_positions = [
@@ -377,6 +256,10 @@ circle_positions = [
 # Create circle stimuli
 circles = [visual.Circle(win, radius=100, fillColor=None, lineColor=None, pos=pos) for pos in circle_positions]
 
+def draw_circles():
+    for circle in circles:
+        circle.draw()
+
 
 # ==== Fixation Cross for Baseline
 fixation = visual.ShapeStim(
@@ -429,6 +312,7 @@ def show_baseline_fixation():
     exp.addData('baseline_fixation_gaze_offset_duration', gaze_offset_fixation)
     exp.addData('baseline_fixation_pause_duration', pause_fixation)
     exp.addData('baseline_fixation_nodata_duration', nodata_fixation)
+    gaze_engine.add_episodes(exp)
 
     exp.nextEntry()  # Move to next row in data file
 
@@ -497,10 +381,7 @@ def run_experiment():
             print(f"Trial {trial + 1}: Remaining frames = {remaining_frames}")
 
             # Delay phase
-            for frame in range(delay_frames):
-                if check_nodata(tracker.getPosition()):
-                    nodata_beep_interval += refresh_rate
-                win.flip()
+            nodata_beep_interval += blank_gazecontingent(delay_frames * refresh_rate)
 
             # Play beep
             beep_start_time = core.getTime()
@@ -510,10 +391,7 @@ def run_experiment():
             beep.play(when=next_flip) 
                       
             print(f"Trial {trial + 1}: Beep STARTED at {beep_start_time}")
-            for frame in range(beep_frames):
-                if check_nodata(tracker.getPosition()):
-                    nodata_beep_interval += refresh_rate
-                win.flip()
+            nodata_beep_interval += blank_gazecontingent(beep_frames * refresh_rate)
             beep.stop()
 
             beep_end_time = core.getTime()
@@ -521,16 +399,10 @@ def run_experiment():
             print(f"Trial {trial + 1}: Beep STOPPED, actual duration = {beep_duration} sec")
 
             # Remaining time after beep
-            for frame in range(remaining_frames):
-                if check_nodata(tracker.getPosition()):
-                    nodata_beep_interval += refresh_rate
-                win.flip()
+            nodata_beep_interval += blank_gazecontingent(remaining_frames * refresh_rate)
         
         else:
-            for frame in range(int(0.4 / refresh_rate)):  # No beep - just wait 400ms
-                if check_nodata(tracker.getPosition()):
-                    nodata_beep_interval += refresh_rate
-                win.flip()
+            nodata_beep_interval += blank_gazecontingent(0.4)  # No beep - just wait 400ms
             # No beep case - Set expected_beep_duration to 0 or None
             expected_beep_duration = 0
             delay_duration = 0
@@ -586,13 +458,9 @@ def run_experiment():
         print(f"Trial {trial + 1}: Displaying circles")
 
         visual_search_start_time = core.getTime()
-        while core.getTime() - visual_search_start_time < 1.5:  # 1.5 seconds
-            for circle in circles:
-                circle.draw()
-
-            if check_nodata(tracker.getPosition()):  # Check for no data
-                nodata_visual_search += refresh_rate
-            win.flip()
+        # 1.5 seconds, circles are shown regardless of gaze:
+        result = gaze_engine.run(1.5, draw_normal=draw_circles, mode=FIXED, check_keys=False, gaze_contingent=False)
+        nodata_visual_search += result.nodata_duration  # Check for no data
 
         actual_stimulus_duration = round(core.getTime() - visual_search_start_time, 3)
         print(f"Trial {trial + 1}: No data during circles = {nodata_visual_search:.3f} seconds")
@@ -635,7 +503,8 @@ def run_experiment():
         trials.addData('actual_beep_phase_duration', beep_phase_duration)
         trials.addData('delay_beep_phase', delay_duration) # delay before beep, if beep is played
         trials.addData('actual_visual_search_duration', round(actual_stimulus_duration, 3)) # from timestamp
-        trials.addData('nodata_visual_search', round(nodata_visual_search, 3)) # from check_nodata function
+        trials.addData('nodata_visual_search', round(nodata_visual_search, 3)) # from the gaze samples
+        gaze_engine.add_episodes(trials)
         trials.addData('trial_duration', round(trial_duration,3)) # from timestamp
         
         exp.nextEntry()
@@ -646,6 +515,7 @@ def run_experiment():
     # --- SAVE FINAL DATA & CLOSE ---
     #trials.saveAsWideText(fileName, sheetName='trials', appendFile=True)
     #exp.saveAsPickle(fileName)
+    write_trial_store(exp, trials_data_folder / (fileName + ".parquet"), TRIAL_SCHEMAS[Path(__file__).stem])
 
 
     # Close reading from eyetracker:
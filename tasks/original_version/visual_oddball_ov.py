@@ -1,5 +1,5 @@
 from psychopy import visual, core, data, event, gui, logging, monitors, clock
-import random, numpy, time
+import random, time
 import logging
 import numpy as np
 from pathlib import Path
@@ -17,6 +17,14 @@ import os
 import traceback
 import json
 import sys
+# Shared task components (tasks/shared):
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from shared.task_logging import setup_task_logging
+from shared.gaze_redirect import get_gaze_redirect
+from shared.gaze_stream import GazeStream
+from shared.trial_store import write_trial_store
+from shared.trial_schemas import TRIAL_SCHEMAS
+from shared.gaze_contingent import GazeContingentEngine, FIXED
 import pandas as pd
 
 
@@ -42,11 +50,11 @@ if not logging_path.exists():
 else:
     print(f"Directory {logging_path} already exists. Continuing to use it.")
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    filename=filename_visual_oddball,
-    filemode='w',  # w = write, for each subject a separate log file
-    format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+# Non-blocking task logging via a queue and a listener thread (tasks/shared/task_logging.py),
+# console output is written to the log file in production mode:
+setup_task_logging(
+    filename_visual_oddball,
+    production=config["constants"]["production_mode"])
 
 
 trials_data_folder = Path(task_config["data_paths"]["trials"]).resolve()
@@ -152,109 +160,14 @@ tracker = io.devices.tracker
 tracker.setRecordingState(True)
 print(tracker)
 
+gaze_redirect = get_gaze_redirect(win, size_fixation_cross_in_pixels, background_color_rgb)
+
 # Draw figure for gaze contincency, when gaze is offset:
 def draw_gazedirect(background_color = background_color_rgb):
-        # Adapt background according to provided "background color"
-    if background_color is not background_color_rgb:
-        background_rect = visual.Rect(
-            win = win,
-            size = win.size,
-            fillColor = background_color)
-        background_rect.draw()
-    # Parameters:
-    function_color = 'red'
-    arrow_size_pix = size_fixation_cross_in_pixels
-    arrow_pos_offset = 5
-    width = 3
-
-    rect1 = visual.Rect(
-        win = win,
-        units = 'pix',
-        lineColor = function_color,
-        fillColor = background_color,
-        lineWidth = width,
-        size = size_fixation_cross_in_pixels*6)
-
-    # Arrow left:
-    al_line1 = visual.Line(win = win, units = 'pix', lineColor=function_color, lineWidth=width)
-    al_line1.start = [-(arrow_size_pix*arrow_pos_offset), 0]
-    al_line1.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth=width)
-    al_line2.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    al_line2.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    al_line3 = visual.Line(win = win, units = 'pix', lineColor=function_color, lineWidth=width)
-    al_line3.start = [-(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    al_line3.end = [-(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow right:
-    ar_line1 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line1.start = [+(arrow_size_pix*arrow_pos_offset), 0]
-    ar_line1.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line2 = visual.Line(win = win, units='pix', lineColor = function_color, lineWidth = width)
-    ar_line2.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), -arrow_size_pix/2]
-    ar_line2.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-    ar_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ar_line3.start = [+(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2)), +arrow_size_pix/2]
-    ar_line3.end = [+(arrow_size_pix*arrow_pos_offset-arrow_size_pix), 0]
-
-    # Arrow top:
-    at_line1 = visual.Line(win = win, units='pix', lineColor = function_color, lineWidth = width)
-    at_line1.start = [0, +(arrow_size_pix*arrow_pos_offset)]
-    at_line1.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line2.start = [-arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line2.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    at_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    at_line3.start = [+arrow_size_pix/2, +(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    at_line3.end = [0, +(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Arrow bottom:
-    ab_line1 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth=width)
-    ab_line1.start = [0, -(arrow_size_pix*arrow_pos_offset)]
-    ab_line1.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line2 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line2.start = [+arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line2.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-    ab_line3 = visual.Line(win = win, units = 'pix', lineColor = function_color, lineWidth = width)
-    ab_line3.start = [-arrow_size_pix/2, -(arrow_size_pix*arrow_pos_offset-(arrow_size_pix/2))]
-    ab_line3.end = [0, -(arrow_size_pix*arrow_pos_offset-arrow_size_pix)]
-
-    # Draw all:
-    al_line1.draw()
-    al_line2.draw()
-    al_line3.draw()
-
-    ar_line1.draw()
-    ar_line2.draw()
-    ar_line3.draw()
-
-    at_line1.draw()
-    at_line2.draw()
-    at_line3.draw()
-
-    ab_line1.draw()
-    ab_line2.draw()
-    ab_line3.draw()
-
-    rect1.draw()
-
-def check_nodata(gaze_position):
-    if gaze_position == None:
-        nodata_boolean = True
-    else:
-        nodata_boolean = False
-    return nodata_boolean
+    gaze_redirect.draw(background_color)
 
-# Get gaze position and offset cutoff.
+# Gaze offset cutoff from the screen center:
 gaze_offset_cutoff = 3*size_fixation_cross_in_pixels
-# Then check for the offset of gaze from the center screen.
-def check_gaze_offset(gaze_position):
-    gaze_center_offset = numpy.sqrt((gaze_position[0])**2 + (gaze_position[1])**2) #pythagoras theorem
-    if gaze_center_offset >= gaze_offset_cutoff:
-        offset_boolean = True
-    else:
-        offset_boolean = False
-    return offset_boolean
 
 # SETUP KEYBORD
 kb = keyboard.Keyboard()
@@ -296,6 +209,12 @@ def check_keypress():
         pause_time = round(pause_time,3) if pause_time else 0
     return pause_time 
 
+gaze_engine = GazeContingentEngine(
+    win,
+    GazeStream(tracker, gaze_offset_cutoff),
+    keypress_check=check_keypress,
+    draw_offset=draw_gazedirect)
+
 def oddball_gazecontingent(oddball_object, duration_in_seconds, background_color=background_color_rgb):
     """
     Displays an oddball stimulus gaze-contingently.
@@ -305,56 +224,12 @@ def oddball_gazecontingent(oddball_object, duration_in_seconds, background_color
         duration_in_seconds: Duration for which the oddball is displayed (in seconds).
         background_color: Background color of the screen.
     """
-    # Translate duration to number of frames:
-    number_of_frames = round(duration_in_seconds / refresh_rate)
-    timestamp = core.getTime()
-    gaze_offset_isi_duration = 0
-    pause_isi_duration = 0
-    nodata_isi_duration = 0
-    
-    # Oddball presentation for the specified duration:
-    for frameN in range(number_of_frames):
-        # Check for keypress:
-        pause_isi_duration += check_keypress()
-        # Check for eye tracking data, only call once per flip:
-        gaze_position = tracker.getPosition()
-        # Check for eye tracking data:
-        if check_nodata(gaze_position):
-            print('warning: no eyes detected')
-            logging.warning(' NO EYES DETECTED')
-            frameN = 1  # reset duration of for loop - restart stimulus
-            
-            nodata_current_duration = 0
-            while check_nodata(gaze_position):
-                nodata_current_duration
-                win.flip()  # Wait for monitor refresh time
-                nodata_isi_duration += refresh_rate
-                nodata_current_duration += refresh_rate
-                gaze_position = tracker.getPosition()  # Get new gaze data
-        
-        # Check for gaze offset:
-        elif check_gaze_offset(gaze_position):
-            print('warning: gaze offset')
-            frameN = 1  # Reset duration of for loop - restart stimulus
-            
-            while not check_nodata(gaze_position) and check_gaze_offset(gaze_position):
-                # Listen for keypress:
-                pause_isi_duration += check_keypress()
-                draw_gazedirect(background_color)  # Redirect attention to stimulus area
-                win.flip()  # Wait for monitor refresh time
-                gaze_offset_isi_duration += refresh_rate
-                gaze_position = tracker.getPosition()  # Get new gaze data
-        
-        # Draw oddball stimulus:
-        oddball_object.draw()  # Render the fixation cross on the screen
-        win.flip()
-
-    # Generate output info:
-    actual_isi_duration = round(core.getTime() - timestamp, 3)
-    gaze_offset_isi_duration = round(gaze_offset_isi_duration, 3)
-    nodata_isi_duration = round(nodata_isi_duration, 3)
-       
-    return [actual_isi_duration, gaze_offset_isi_duration, pause_isi_duration, nodata_isi_duration]
+    # One frame loop for all tasks, durations are taken from the flip timestamps:
+    result = gaze_engine.run(
+        duration_in_seconds,
+        draw_normal=oddball_object.draw,
+        draw_offset=lambda: draw_gazedirect(background_color))  # Redirect attention to stimulus area
+    return result.as_list()
 
 
 # ==== Stimulus Properties ====
@@ -442,19 +317,16 @@ def run_trial(trial_type):
     # === 1. Show the stimulus first ===
     stimulus = standard if trial_type == 'standard' else oddball
 
-    stimulus_frames = int(STIMULUS_DURATION / refresh_rate)
     stimulus_start = core.getTime()
 
-    for _ in range(stimulus_frames):
-        stimulus.draw()
-
-        if check_nodata(tracker.getPosition()):
-            nodata_stimulus += refresh_rate
-            print ('warning: no eyes detected')
-        elif check_gaze_offset(tracker.getPosition()):
-            print('warning: gaze offset')
-
-        win.flip()
+    # Stimulus is shown regardless of gaze, no data is counted from the gaze samples:
+    result = gaze_engine.run(
+        STIMULUS_DURATION,
+        draw_normal=stimulus.draw,
+        mode=FIXED,
+        check_keys=False,
+        gaze_contingent=False)
+    nodata_stimulus = result.nodata_duration
 
     stimulus_end = core.getTime()
     stimulus_duration = round(stimulus_end - stimulus_start, 3)
@@ -523,6 +395,7 @@ def run_experiment():
                 trials.addData('baseline_fixation_gaze_offset_duration', gaze_offset_fixation)
                 trials.addData('baseline_fixation_pause_duration', pause_fixation)
                 trials.addData('baseline_fixation_nodata_duration', nodata_fixation)
+                gaze_engine.add_episodes(trials)
 
                 # Print relevant information for baseline fixation
                 print(f"\nBaseline Fixation Phase ")
@@ -558,6 +431,7 @@ def run_experiment():
             trials.addData('gaze_offset_isi_duration', gaze_offset_isi_duration)
             trials.addData('pause_isi_duration', pause_isi_duration)
             trials.addData('nodata_isi_duration', nodata_isi_duration)
+            gaze_engine.add_episodes(trials)
             trials.addData('actual_isi_duration', actual_isi_duration) # from gazecontingency function
 
             # Print relevant information for the current stimulus trial
@@ -595,6 +469,7 @@ def run_experiment():
         trials.addData('baseline_fixation_gaze_offset_duration', gaze_offset_fixation)
         trials.addData('baseline_fixation_pause_duration', pause_fixation)
         trials.addData('baseline_fixation_nodata_duration', nodata_fixation)
+        gaze_engine.add_episodes(trials)
         
          # Print relevant information for final fixation
         print(f"\nFinal Baseline Fixation")
@@ -618,6 +493,7 @@ def run_experiment():
             #exp.saveAsPickle(str(fileName))
         # except Exception as e:
        # print(f"Error while saving:{e}")
+        write_trial_store(exp, trials_data_folder / (fileName + ".parquet"), TRIAL_SCHEMAS[Path(__file__).stem])
 
     # Close reading from eyetracker:
     tracker.setRecordingState(False)
@@ -0,0 +1 @@
+# Components shared by the task scripts in cartoon_version and original_version.
@@ -0,0 +1,63 @@
+from psychopy import core, visual
+from PIL import Image
+import logging
+
+from .clip_cache import decode_clip, load_cached_clip
+
+# Looping background animation from pre-decoded frames: the whole movie (one loop period) is decoded once at display
+# resolution and uploaded as one texture per frame (texture ring). Drawing only selects the texture of the current
+# frame, there is no decoding while the task runs. The ring holds at most max_frames textures (RAM and video memory
+# grow with the number of frames): longer movies keep every n-th frame and play at a lower frame rate, the loop
+# period stays the duration of the movie.
+
+DEFAULT_MAX_FRAMES = 750  # e.g. 30 s at 25 frames per second
+
+
+class BackgroundAnimation:
+    """Looping movie from a ring of frame textures, drop-in for a looping MovieStim (draw()).
+
+    width: on-screen width in pixels, frames are decoded (or loaded from the media cache) at this width.
+    max_frames: number of textures kept at most, None keeps every frame.
+    """
+
+    def __init__(self, win, filename, width, pos=(0, 0), cache_folder=None, max_frames=DEFAULT_MAX_FRAMES):
+        start = core.getTime()
+        decoded = None
+        if cache_folder is not None:
+            decoded = load_cached_clip(cache_folder, filename, width, None)
+        if decoded is None:
+            decoded = decode_clip(filename, None, width)
+
+        self.win = win
+        self.filename = filename
+        frames = decoded.frames
+        # Every step-th frame if the movie has more than max_frames frames:
+        step = 1
+        if max_frames is not None and len(frames) > max_frames:
+            step = -(-len(frames) // max_frames)
+            frames = frames[::step]
+        self.frameRate = decoded.frame_rate / step
+        height, width = frames.shape[1:3]
+        self.size = (width, height)
+        # One texture per frame, uploaded once:
+        self.textures = [
+            visual.ImageStim(win, image=Image.fromarray(frame), size=self.size, pos=pos, units='pix')
+            for frame in frames]
+        self.loop_duration = len(self.textures) / self.frameRate
+        self._start_time = None
+
+        # RGBA textures in video memory:
+        texture_megabytes = len(self.textures) * width * height * 4 / 1024 ** 2
+        message = (f'BACKGROUND ANIMATION: {filename}, {len(self.textures)} frames at {round(self.frameRate, 2)} fps '
+                   f'(every {step}. frame), loop {round(self.loop_duration, 2)} s, {self.size}, '
+                   f'~{texture_megabytes:.0f} MB textures, built in {round(core.getTime() - start, 3)}')
+        print(message)
+        logging.info(message)
+
+    def draw(self):
+        """Draw the frame due at the next flip, the loop starts with the first draw."""
+        now = self.win.getFutureFlipTime()
+        if self._start_time is None:
+            self._start_time = now
+        index = int((now - self._start_time) * self.frameRate) % len(self.textures)
+        self.textures[index].draw()
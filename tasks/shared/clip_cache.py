@@ -0,0 +1,133 @@
+from pathlib import Path
+import argparse
+import json
+import logging
+import numpy
+import time
+
+# Offline cache of decoded clips: the first seconds of a movie file, downscaled to the on-screen size, are saved
+# as a .npy frame array (n_frames, height, width, 3) with a .json metadata file. Tasks load the frames memory-mapped,
+# so playback needs no decoder at all.
+#
+# Build the cache once per machine (from the repository root):
+#   python -m tasks.shared.clip_cache tasks/cartoon_version/config.json
+
+
+def video_file_clip():
+    """moviepy's VideoFileClip class, with an installation hint if moviepy is missing."""
+    try:
+        from moviepy.video.io.VideoFileClip import VideoFileClip
+    except ImportError as e:
+        raise ImportError('moviepy is required to decode videos: pip install moviepy==1.0.3 (see README.md)') from e
+    return VideoFileClip
+
+
+class DecodedClip:
+    """First seconds of a movie file as decoded RGB frames (n_frames, height, width, 3)."""
+
+    def __init__(self, filename, frames, frame_rate, decode_duration):
+        self.filename = filename
+        self.frames = frames
+        self.frame_rate = frame_rate
+        self.decode_duration = decode_duration  # seconds from opening the file to the last decoded frame
+
+
+def decode_clip(filename, duration, width):
+    """Decode the first duration seconds (None: all) of a movie file, scaled to width pixels (aspect ratio kept)."""
+    VideoFileClip = video_file_clip()
+
+    start = time.perf_counter()
+    clip = VideoFileClip(str(filename), audio=False, target_resolution=(None, width))
+    try:
+        frame_rate = clip.fps
+        if duration is None or duration > clip.duration:
+            duration = clip.duration
+        times = numpy.arange(0, duration, 1.0 / frame_rate)
+        frames = numpy.stack([clip.get_frame(t) for t in times]).astype(numpy.uint8)
+    finally:
+        clip.close()
+    return DecodedClip(filename, frames, frame_rate, time.perf_counter() - start)
+
+
+def cache_paths(cache_folder, filename, width):
+    """Return the frame array and metadata paths of a movie file in the cache."""
+    stem = f'{Path(filename).stem}_{width}px'
+    folder = Path(cache_folder) / Path(filename).parent.name
+    return folder / (stem + '.npy'), folder / (stem + '.json')
+
+
+def _source_stamp(filename):
+    stat = Path(filename).stat()
+    return {'source': str(filename), 'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+
+
+def write_cached_clip(cache_folder, decoded, width, duration):
+    """Save a DecodedClip to the cache."""
+    frames_path, metadata_path = cache_paths(cache_folder, decoded.filename, width)
+    frames_path.parent.mkdir(parents=True, exist_ok=True)
+    numpy.save(frames_path, decoded.frames)
+    metadata = _source_stamp(decoded.filename)
+    metadata.update({
+        'width': width,
+        'duration': duration,
+        'frame_rate': decoded.frame_rate,
+        'shape': list(decoded.frames.shape),
+    })
+    # Metadata is written last, a clip without metadata is never loaded:
+    with open(metadata_path, 'w') as file:
+        json.dump(metadata, file, indent=2)
+
+
+def load_cached_clip(cache_folder, filename, width, duration):
+    """Return a DecodedClip with memory-mapped frames, or None if the clip is not cached or out of date.
+
+    duration None requires the whole clip to be cached.
+    """
+    frames_path, metadata_path = cache_paths(cache_folder, filename, width)
+    if not metadata_path.exists() or not frames_path.exists():
+        return None
+    try:
+        with open(metadata_path) as file:
+            metadata = json.load(file)
+        stamp = _source_stamp(filename)
+    except (OSError, ValueError):
+        return None
+    if (metadata['source_size'], metadata['source_mtime']) != (stamp['source_size'], stamp['source_mtime']):
+        return None  # source file has changed
+    if metadata['width'] != width:
+        return None
+    if metadata['duration'] is not None and (duration is None or duration > metadata['duration']):
+        return None  # not enough frames cached
+    frames = numpy.load(frames_path, mmap_mode='r')
+    return DecodedClip(filename, frames, metadata['frame_rate'], 0.0)
+
+
+def build_clip_cache(files, cache_folder, width, duration, force=False):
+    """Decode all files into the cache, skips clips that are already cached."""
+    for filename in files:
+        if not force and load_cached_clip(cache_folder, filename, width, duration) is not None:
+            print(f'cached: {filename}')
+            continue
+        decoded = decode_clip(filename, duration, width)
+        write_cached_clip(cache_folder, decoded, width, duration)
+        print(f'decoded: {filename}, {decoded.frames.shape}, {decoded.decode_duration:.1f} sec')
+        logging.info(f'CLIP CACHED: {filename}, {decoded.frames.shape}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Decode the task cartoons into the media cache.')
+    parser.add_argument('config', help='task config.json, e.g. tasks/cartoon_version/config.json')
+    parser.add_argument('--cartoon-duration', type=float, default=3.0,
+                        help='seconds decoded per cartoon (fixation cartoons are shown for 2 seconds)')
+    parser.add_argument('--force', action='store_true', help='decode all clips again')
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        config = json.load(file)
+    cache_folder = Path(config['media_cache'])
+    width = config['constants']['psychopy_window']['size_fixation_cross_in_pixels'] * 6
+
+    # Fixation cartoons, first seconds only:
+    build_clip_cache(sorted(Path('media/cartoons').glob('*.mp4')), cache_folder, width, args.cartoon_duration, args.force)
+    # Looping background of the auditory oddball, one full loop:
+    build_clip_cache([Path('media/background/background_video.mp4')], cache_folder, width, None, args.force)
@@ -0,0 +1,43 @@
+import json
+import numpy
+
+# Vectorized gaze classification over sample windows, replaces the per-sample check_nodata/check_gaze_offset.
+
+
+def classify_gaze(positions, valid, gaze_offset_cutoff):
+    """Return per-sample offset and no data masks.
+
+    positions: (N, 2) array of gaze positions relative to the screen center (pixels).
+    valid: (N,) boolean array, False for samples without gaze data.
+    """
+    positions = numpy.asarray(positions, dtype=float)
+    valid = numpy.asarray(valid, dtype=bool)
+    # Squared distance against squared cutoff, no square root needed:
+    squared_offset = numpy.einsum('ij,ij->i', positions, positions)
+    offset = valid & (squared_offset >= gaze_offset_cutoff ** 2)
+    nodata = ~valid
+    return offset, nodata
+
+
+def run_length_episodes(mask, time, end_time=None):
+    """Return (start, end, duration) of every run of True samples in mask.
+
+    An episode ends with the first sample after the run, or at end_time for a run at the end of the window.
+    """
+    mask = numpy.asarray(mask, dtype=bool)
+    time = numpy.asarray(time, dtype=float)
+    if not mask.any():
+        return numpy.empty((0, 3))
+    if end_time is None:
+        end_time = time[-1]
+    edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([0], mask.view(numpy.int8), [0]))))
+    starts, stops = edges[0::2], edges[1::2]
+    following_time = numpy.append(time, end_time)
+    start_times = time[starts]
+    end_times = following_time[stops]
+    return numpy.column_stack((start_times, end_times, end_times - start_times))
+
+
+def episodes_to_json(episodes):
+    """Episodes as a JSON string for one trial data column: [[start, end, duration], ...]."""
+    return json.dumps(numpy.round(episodes, 4).tolist())
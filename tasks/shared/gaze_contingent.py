@@ -0,0 +1,200 @@
+from psychopy import core
+import logging
+import numpy
+
+from .gaze_classification import episodes_to_json
+
+# Gaze-contingent presentation engine used by the frame loops of all tasks.
+# Per frame: check keys, classify gaze, draw according to state, flip.
+# Presentation time is taken from the timestamps returned by win.flip(): the time between two flips is booked
+# to the state of the frame that was on screen during that time.
+# Reported no data and offset durations are sample based (see gaze_stream.py).
+
+# Frame states:
+NORMAL = 'normal'
+NODATA = 'nodata'
+OFFSET = 'offset'
+PAUSED = 'paused'
+
+# Modes:
+EXTEND = 'extend'  # only normal (gaze on center) time counts towards the duration - presentation is extended
+FIXED = 'fixed'  # presentation ends after the duration, regardless of gaze
+
+_state_messages = {
+    NODATA: ('warning: no eyes detected', ' NO EYES DETECTED'),
+    OFFSET: ('warning: gaze offset', ' GAZE OFFSET'),
+    PAUSED: ('experiment paused', ' PAUSED'),
+}
+
+
+class GazeContingentResult:
+    """Output of one gaze-contingent presentation."""
+
+    def __init__(self, expected_duration, mode):
+        self.expected_duration = expected_duration
+        self.mode = mode
+        self.start_time = None
+        self.end_time = None
+        self.first_flip = None
+        self.last_flip = None
+        self.aborted = False
+        self.durations = {NORMAL: 0, NODATA: 0, OFFSET: 0, PAUSED: 0}
+        self.frames = {NORMAL: 0, NODATA: 0, OFFSET: 0}
+        # Sample based durations from the gaze stream, reported instead of the frame based ones:
+        self.sample_durations = {NODATA: 0, OFFSET: 0}
+        self.episodes = None
+
+    @property
+    def actual_duration(self):
+        return round(self.end_time - self.start_time, 3)
+
+    @property
+    def normal_duration(self):
+        return round(self.durations[NORMAL], 3)
+
+    @property
+    def offset_duration(self):
+        return round(self.sample_durations[OFFSET], 3)
+
+    @property
+    def nodata_duration(self):
+        return round(self.sample_durations[NODATA], 3)
+
+    @property
+    def pause_duration(self):
+        return round(self.durations[PAUSED], 3)
+
+    def as_list(self):
+        # Order used by all *_gazecontingent functions of the tasks:
+        return [self.actual_duration, self.offset_duration, self.pause_duration, self.nodata_duration]
+
+
+class GazeContingentEngine:
+    """One frame loop for all gaze-contingent presentations of a task.
+
+    gaze_source: GazeStream, frame_state() returns NORMAL, NODATA or OFFSET for the upcoming frame.
+    keypress_check: function returning the pause duration in seconds (0 if no key was pressed).
+    draw_offset: default drawing while gaze is offset, e.g. the gaze redirect figure.
+    """
+
+    def __init__(self, win, gaze_source, keypress_check=None, draw_offset=None):
+        self.win = win
+        self.gaze_source = gaze_source
+        self.keypress_check = keypress_check
+        self.draw_offset = draw_offset
+        # No data and offset episodes since the last pop_episodes(), saved with the trial data:
+        self.episodes = {NODATA: [], OFFSET: []}
+
+    def run(self, duration_in_seconds, draw_normal, draw_offset=None, draw_nodata=None, mode=EXTEND,
+            on_state_change=None, abort_check=None, check_keys=True, gaze_contingent=True):
+        """Present draw_normal for duration_in_seconds and return a GazeContingentResult.
+
+        draw_offset defaults to the engine's draw_offset, draw_nodata defaults to a blank screen.
+        on_state_change(previous_state, state) is called whenever the frame state changes, e.g. to pause a movie.
+        abort_check() is called every frame, the presentation stops when it returns True.
+        gaze_contingent=False draws draw_normal in every state, gaze is only monitored.
+        """
+        if draw_offset is None:
+            draw_offset = self.draw_offset
+        draws = {NORMAL: draw_normal, OFFSET: draw_offset, NODATA: draw_nodata}
+        if not gaze_contingent:
+            draws = {NORMAL: draw_normal, OFFSET: draw_normal, NODATA: draw_normal}
+        frame_period = self.win.monitorFramePeriod
+        # Stop half a frame early, so that the number of frames matches round(duration/frame period):
+        target_duration = duration_in_seconds - frame_period/2
+
+        result = GazeContingentResult(duration_in_seconds, mode)
+        result.start_time = core.getTime()
+        # Samples before the presentation are not counted:
+        self.gaze_source.skip()
+        totals_at_start = dict(self.gaze_source.sample_totals)
+        state = None
+        episode_start = None
+
+        while target_duration > 0:
+            # Check for keypress, dialogs block the loop:
+            if check_keys and self.keypress_check is not None:
+                pause_time = self.keypress_check()
+                if pause_time:
+                    result.durations[PAUSED] += pause_time
+                    self._log_transition(PAUSED, pause_time)
+                    if result.last_flip is not None:
+                        result.last_flip += pause_time  # the paused time is not booked to the frame state
+                    self.gaze_source.skip()
+            if abort_check is not None and abort_check():
+                result.aborted = True
+                break
+
+            # Classify gaze, only once per flip:
+            previous_state = state
+            state = self.gaze_source.frame_state()
+            if state != previous_state:
+                if state in (NODATA, OFFSET):
+                    self._log_transition(state)
+                if on_state_change is not None:
+                    on_state_change(previous_state, state)
+
+            draw = draws[state]
+            if draw is not None:
+                draw()
+            flip_time = self.win.flip()
+
+            if result.last_flip is None:
+                result.first_flip = flip_time
+            else:
+                result.durations[previous_state] += flip_time - result.last_flip
+            if state != previous_state:
+                if previous_state in (NODATA, OFFSET):
+                    self._log_transition(previous_state, flip_time - episode_start, ended=True)
+                episode_start = flip_time
+            result.last_flip = flip_time
+            result.frames[state] += 1
+
+            # Expected time until the next flip is one frame period, pauses are never counted:
+            if mode == EXTEND:
+                elapsed = result.durations[NORMAL] + (frame_period if state == NORMAL else 0)
+            else:
+                elapsed = result.durations[NORMAL] + result.durations[NODATA] + result.durations[OFFSET] + frame_period
+            if elapsed >= target_duration:
+                break
+
+        # The last frame stays on screen for one frame period:
+        if state is not None and result.last_flip is not None:
+            result.durations[state] += frame_period
+            if state in (NODATA, OFFSET):
+                self._log_transition(state, result.last_flip + frame_period - episode_start, ended=True)
+        result.end_time = core.getTime()
+        for key in result.sample_durations:
+            result.sample_durations[key] = self.gaze_source.sample_totals[key] - totals_at_start[key]
+        if result.first_flip is not None:
+            result.episodes = self.gaze_source.episodes(result.first_flip, result.last_flip + frame_period)
+            for key in self.episodes:
+                self.episodes[key].append(result.episodes[key])
+        return result
+
+    def pop_episodes(self):
+        """Return the no data and offset episodes since the last call as JSON strings (trial data columns)."""
+        columns = {}
+        for key in self.episodes:
+            episodes = numpy.concatenate(self.episodes[key]) if self.episodes[key] else numpy.empty((0, 3))
+            columns[key] = episodes_to_json(episodes)
+            self.episodes[key] = []
+        return columns
+
+    def add_episodes(self, handler):
+        """Add the no data and gaze offset episodes [[start, end, duration], ...] since the last call to the trial data."""
+        episodes = self.pop_episodes()
+        handler.addData('nodata_episodes', episodes[NODATA])
+        handler.addData('gaze_offset_episodes', episodes[OFFSET])
+
+    def _log_transition(self, state, duration=None, ended=False):
+        # Repeated transitions (e.g. blinks) are coalesced into episodes by the task logging (task_logging.py):
+        console_message, log_message = _state_messages[state]
+        if ended:
+            logging.info(log_message + ' ENDED AFTER: ' f'{round(duration, 3)}', extra={'coalesce': log_message + ' ENDED'})
+        elif duration is not None:
+            print(f'{console_message}: {round(duration, 3)} seconds')
+            logging.warning(log_message + ': ' f'{round(duration, 3)}')
+        else:
+            print(console_message)
+            logging.warning(log_message, extra={'coalesce': log_message})
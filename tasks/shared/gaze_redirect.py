@@ -0,0 +1,85 @@
+from psychopy import visual
+import weakref
+
+# Gaze redirect figure (red square + four arrows pointing to the screen center), shown when gaze is offset.
+# The figure is drawn once into a BufferImageStim on the window background color, so every frame costs one draw
+# call instead of building 12 Line objects and one Rect object.
+
+FUNCTION_COLOR = 'red'
+ARROW_POS_OFFSET = 5
+LINE_WIDTH = 3
+
+# One instance per window, shared by all tasks that draw into it:
+_instances = weakref.WeakKeyDictionary()
+
+
+def _color_key(color):
+    # lists from config.json compare equal to tuples:
+    if isinstance(color, (list, tuple)):
+        return tuple(color)
+    return color
+
+
+class GazeRedirect:
+    """Prebuilt gaze redirect overlay on the window background color."""
+
+    def __init__(self, win, size_fixation_cross_in_pixels, background_color):
+        self.win = win
+        self.size_fixation_cross_in_pixels = size_fixation_cross_in_pixels
+        self.background_color = background_color
+
+        # Captured before the first frame is drawn, capturing uses the back buffer:
+        self._overlay = self._build(background_color)
+        self.win.clearBuffer()
+
+    def _figure(self, background_color):
+        # Same geometry as the former draw_gazedirect():
+        win = self.win
+        arrow_size_pix = self.size_fixation_cross_in_pixels
+        arrow_tip = arrow_size_pix*ARROW_POS_OFFSET
+        arrow_head = arrow_size_pix*ARROW_POS_OFFSET-arrow_size_pix
+        arrow_wing = arrow_size_pix*ARROW_POS_OFFSET-(arrow_size_pix/2)
+
+        segments = []
+        for sign in (-1, +1):
+            # Arrows left/right:
+            segments.append(([sign*arrow_tip, 0], [sign*arrow_head, 0]))
+            segments.append(([sign*arrow_wing, -arrow_size_pix/2], [sign*arrow_head, 0]))
+            segments.append(([sign*arrow_wing, +arrow_size_pix/2], [sign*arrow_head, 0]))
+            # Arrows top/bottom:
+            segments.append(([0, sign*arrow_tip], [0, sign*arrow_head]))
+            segments.append(([-arrow_size_pix/2, sign*arrow_wing], [0, sign*arrow_head]))
+            segments.append(([+arrow_size_pix/2, sign*arrow_wing], [0, sign*arrow_head]))
+
+        stims = [visual.Line(win=win, units='pix', start=start, end=end, lineColor=FUNCTION_COLOR, lineWidth=LINE_WIDTH)
+                 for start, end in segments]
+        stims.append(visual.Rect(
+            win=win,
+            units='pix',
+            lineColor=FUNCTION_COLOR,
+            fillColor=background_color,
+            lineWidth=LINE_WIDTH,
+            size=self.size_fixation_cross_in_pixels*6))
+        return stims
+
+    def _build(self, background_color):
+        # Only capture the bounding box of the figure, the window color is the background:
+        half_extent = self.size_fixation_cross_in_pixels*ARROW_POS_OFFSET + LINE_WIDTH
+        half_width = min(1, half_extent/(self.win.size[0]/2))
+        half_height = min(1, half_extent/(self.win.size[1]/2))
+        rect = (-half_width, half_height, half_width, -half_height)
+        return visual.BufferImageStim(self.win, buffer='back', rect=rect, stim=self._figure(background_color))
+
+    def draw(self, background_color=None):
+        if background_color is not None and _color_key(background_color) != _color_key(self.background_color):
+            raise ValueError(f'gaze redirect is prebuilt on {self.background_color}, not {background_color}')
+        self._overlay.draw()
+
+
+def get_gaze_redirect(win, size_fixation_cross_in_pixels, background_color):
+    """Return the gaze redirect overlay of this window, build it on first use."""
+    gaze_redirect = _instances.get(win)
+    if gaze_redirect is None:
+        gaze_redirect = GazeRedirect(win, size_fixation_cross_in_pixels, background_color)
+        _instances[win] = gaze_redirect
+    return gaze_redirect
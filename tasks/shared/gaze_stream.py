@@ -0,0 +1,139 @@
+from psychopy import core
+from psychopy.iohub.constants import EventConstants
+import numpy
+
+from .gaze_contingent import NORMAL, NODATA, OFFSET
+from .gaze_classification import classify_gaze, run_length_episodes
+
+# Reads all gaze samples from the ioHub server once per frame (one tracker.getEvents() call) into a
+# preallocated ring buffer. Gaze-contingent decisions are made on all samples since the last frame,
+# instead of the latest sample returned by tracker.getPosition().
+
+
+def _samples_from_events(events):
+    """Return time, x, y and valid arrays of all eye sample events (mean of the valid eyes)."""
+    binocular = [event for event in events if event.type == EventConstants.BINOCULAR_EYE_SAMPLE]
+    monocular = [event for event in events if event.type == EventConstants.MONOCULAR_EYE_SAMPLE]
+    parts = []
+
+    if binocular:
+        values = numpy.array([
+            (event.time, event.left_gaze_x, event.left_gaze_y, event.right_gaze_x, event.right_gaze_y, event.status)
+            for event in binocular], dtype=float)
+        time, left_x, left_y, right_x, right_y, status = values.T
+        # ioHub status: 20 = left eye missing, 2 = right eye missing, 22 = both missing
+        left_valid = (status // 10 % 10 != 2) & numpy.isfinite(left_x) & numpy.isfinite(left_y)
+        right_valid = (status % 10 != 2) & numpy.isfinite(right_x) & numpy.isfinite(right_y)
+        n_valid = left_valid.astype(int) + right_valid
+        divisor = numpy.maximum(n_valid, 1)
+        x = (numpy.where(left_valid, left_x, 0) + numpy.where(right_valid, right_x, 0)) / divisor
+        y = (numpy.where(left_valid, left_y, 0) + numpy.where(right_valid, right_y, 0)) / divisor
+        parts.append((time, x, y, n_valid > 0))
+
+    if monocular:
+        values = numpy.array([(event.time, event.gaze_x, event.gaze_y, event.status) for event in monocular], dtype=float)
+        time, x, y, status = values.T
+        valid = (status % 10 != 2) & numpy.isfinite(x) & numpy.isfinite(y)
+        parts.append((time, numpy.nan_to_num(x), numpy.nan_to_num(y), valid))
+
+    if not parts:
+        return None
+    time, x, y, valid = (numpy.concatenate(column) for column in zip(*parts))
+    order = numpy.argsort(time, kind='stable')
+    return time[order], x[order], y[order], valid[order]
+
+
+class GazeStream:
+    """Gaze source for the GazeContingentEngine, fed by tracker.getEvents().
+
+    stale_after: seconds without any new sample after which a frame counts as no data.
+    sample_totals: sample based no data / offset durations in seconds, accumulated over all frames.
+    """
+
+    def __init__(self, tracker, gaze_offset_cutoff, capacity=32768, stale_after=0.1):
+        self.tracker = tracker
+        self.gaze_offset_cutoff = gaze_offset_cutoff
+        self.capacity = capacity
+        self.stale_after = stale_after
+
+        # Ring buffer, preallocated once:
+        self.time = numpy.zeros(capacity)
+        self.position = numpy.zeros((capacity, 2))
+        self.valid = numpy.zeros(capacity, dtype=bool)
+        self.count = 0  # number of samples written since start
+
+        self.last_sample_time = None
+        self.state = NODATA
+        self.sample_totals = {NODATA: 0.0, OFFSET: 0.0}
+
+    def _append(self, time, x, y, valid):
+        n = len(time)
+        if n > self.capacity:
+            time, x, y, valid = time[-self.capacity:], x[-self.capacity:], y[-self.capacity:], valid[-self.capacity:]
+            self.count += n - self.capacity
+            n = self.capacity
+        index = (self.count + numpy.arange(n)) % self.capacity
+        self.time[index] = time
+        self.position[index, 0] = x
+        self.position[index, 1] = y
+        self.valid[index] = valid
+        self.count += n
+        return index
+
+    def _drain(self, accumulate):
+        samples = _samples_from_events(self.tracker.getEvents())
+        if samples is None:
+            return False
+        time, x, y, valid = samples
+        index = self._append(time, x, y, valid)
+        # A batch larger than the ring buffer is cut to its last capacity samples by _append:
+        time, valid = time[-len(index):], valid[-len(index):]
+        offset, nodata = classify_gaze(self.position[index], valid, self.gaze_offset_cutoff)
+
+        if accumulate and self.last_sample_time is not None:
+            # Each sample holds until the next one, gaps without samples count as no data:
+            sample_durations = numpy.diff(numpy.concatenate(([self.last_sample_time], time)))
+            gap = sample_durations > self.stale_after
+            self.sample_totals[NODATA] += sample_durations[nodata | gap].sum()
+            self.sample_totals[OFFSET] += sample_durations[offset & ~gap].sum()
+
+        # Classify on the recent samples only:
+        recent = time >= time[-1] - self.stale_after
+        if not valid[recent].any():
+            self.state = NODATA
+        elif offset[recent & valid].all():
+            self.state = OFFSET
+        else:
+            self.state = NORMAL
+        self.last_sample_time = time[-1]
+        return True
+
+    def frame_state(self):
+        """Drain all new samples and return the state (NORMAL, NODATA, OFFSET) for the upcoming frame."""
+        if not self._drain(accumulate=True):
+            # No new sample since the last frame, e.g. tracker rate below refresh rate:
+            if self.last_sample_time is None or core.getTime() - self.last_sample_time > self.stale_after:
+                self.state = NODATA
+        return self.state
+
+    def skip(self):
+        """Drain samples without adding them to the totals, e.g. after a pause dialog."""
+        self._drain(accumulate=False)
+
+    def recent_samples(self, since):
+        """Return time, position and valid arrays of the buffered samples since a timestamp."""
+        n = min(self.count, self.capacity)
+        index = (self.count - n + numpy.arange(n)) % self.capacity
+        index = index[self.time[index] >= since]
+        return self.time[index], self.position[index], self.valid[index]
+
+    def episodes(self, start, end):
+        """Return no data and offset episodes (start, end, duration) of the buffered samples between two timestamps."""
+        time, position, valid = self.recent_samples(start)
+        inside = time < end
+        time, position, valid = time[inside], position[inside], valid[inside]
+        offset, nodata = classify_gaze(position, valid, self.gaze_offset_cutoff)
+        return {
+            NODATA: run_length_episodes(nodata, time, end),
+            OFFSET: run_length_episodes(offset, time, end),
+        }
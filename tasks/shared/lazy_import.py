@@ -0,0 +1,31 @@
+import importlib
+import sys
+
+# Modules imported on first use instead of at the start of a task, e.g. psychopy.gui: the dialog toolkit is only
+# needed if the experimenter opens the pause or quit dialog, not on the way to the first trial.
+#   gui = lazy_module('psychopy.gui')
+#   dlg = gui.Dlg(...)  # psychopy.gui is imported here
+
+
+class LazyModule:
+    """Stand-in for a module, the module is imported on the first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        state = 'imported' if self._module is not None else 'not imported'
+        return f'<lazy module {self._name} ({state})>'
+
+
+def lazy_module(name):
+    """The module if it is already imported, otherwise a LazyModule."""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
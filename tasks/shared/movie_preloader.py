@@ -0,0 +1,124 @@
+from psychopy import core, visual
+from PIL import Image
+import logging
+import queue
+import random
+import threading
+
+from .clip_cache import decode_clip, load_cached_clip
+
+# Preloading of short cartoon clips: a worker thread opens and decodes the first seconds of the next clips,
+# downscaled to the on-screen size, while the current trial runs. The trial loop gets a ready stimulus.
+# Clips from the offline cache (clip_cache.py) are memory-mapped instead of decoded.
+
+
+class PreloadedClip:
+    """Playback of a DecodedClip, same play/pause/stop/draw interface as MovieStim.
+
+    Frames are selected by the playback time (paused time is not counted), so the clip runs at its frame rate
+    on any refresh rate. The last frame is held when the playback time exceeds the decoded frames.
+    request_time: core.getTime() when the clip was requested (MoviePreloader.next_clip()), first_frame_latency is
+    the time from the request to the flip that shows the first frame.
+    """
+
+    def __init__(self, win, decoded, pos=(0, 0), request_time=None):
+        self.win = win
+        self.filename = decoded.filename
+        self.frames = decoded.frames
+        self.frameRate = decoded.frame_rate
+        height, width = self.frames.shape[1:3]
+        self.size = (width, height)
+        self.image = visual.ImageStim(win, image=Image.fromarray(self.frames[0]), size=self.size, pos=pos, units='pix')
+        self.request_time = core.getTime() if request_time is None else request_time
+        self.first_frame_latency = None
+        self._shown_index = 0
+        self._first_flip_pending = False
+        self._played = 0.0
+        self._play_start = None
+
+    @property
+    def playback_time(self):
+        if self._play_start is None:
+            return self._played
+        return self._played + core.getTime() - self._play_start
+
+    def play(self):
+        if self._play_start is None:
+            self._play_start = core.getTime()
+
+    def pause(self):
+        if self._play_start is not None:
+            self._played += core.getTime() - self._play_start
+            self._play_start = None
+
+    def stop(self):
+        self.pause()
+        self._played = 0.0
+
+    def draw(self):
+        index = min(int(self.playback_time * self.frameRate), len(self.frames) - 1)
+        if index != self._shown_index:
+            self.image.image = Image.fromarray(self.frames[index])  # texture upload of one small frame
+            self._shown_index = index
+        self.image.draw()
+        if self.first_frame_latency is None and not self._first_flip_pending:
+            self._first_flip_pending = True
+            self.win.callOnFlip(self._on_first_flip)
+
+    def _on_first_flip(self):
+        # Called by win.flip() right after the first frame of the clip is shown:
+        self.first_frame_latency = core.getTime() - self.request_time
+
+
+class MoviePreloader:
+    """Keeps the next pool_size randomly chosen clips decoded on a worker thread.
+
+    duration: seconds decoded per clip, width: on-screen width in pixels.
+    cache_folder: media cache of clip_cache.py, clips that are not cached are decoded.
+    """
+
+    def __init__(self, files, duration, width, pool_size=2, cache_folder=None):
+        self.files = list(files)
+        self.duration = duration
+        self.width = width
+        self.cache_folder = cache_folder
+        self._ready = queue.Queue(maxsize=pool_size)
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name='movie-preloader', daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            filename = random.choice(self.files)
+            try:
+                item = None
+                if self.cache_folder is not None:
+                    item = load_cached_clip(self.cache_folder, filename, self.width, self.duration)
+                if item is None:
+                    item = decode_clip(filename, self.duration, self.width)
+            except Exception as e:
+                item = e
+                logging.error(f'CARTOON PRELOAD FAILED: {filename}: {e}')
+            # Blocks while the pool is full:
+            while not self._stop.is_set():
+                try:
+                    self._ready.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    pass
+
+    def next_clip(self, win, timeout=10):
+        """Return a PreloadedClip of the next decoded clip, waits if the worker is not done yet."""
+        wait_start = core.getTime()
+        item = self._ready.get(timeout=timeout)
+        if isinstance(item, Exception):
+            raise item
+        clip = PreloadedClip(win, item, request_time=wait_start)
+        wait = core.getTime() - wait_start
+        print(f'Cartoon {item.filename}: decoded in {item.decode_duration:.3f} sec, waited {wait:.3f} sec')
+        logging.info(f'CARTOON PRELOADED: {item.filename}, decode {round(item.decode_duration, 3)}, '
+                     f'wait {round(wait, 3)}, {len(item.frames)} frames')
+        return clip
+
+    def close(self):
+        self._stop.set()
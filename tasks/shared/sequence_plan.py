@@ -0,0 +1,139 @@
+import logging
+import numpy
+import random
+
+# Session plan for rapid-sound-sequences: the sequences, audio buffer and tone onset table of every trial are
+# compiled before the baseline phase. The trial loop only reads from the plan.
+
+REPETITION_COLUMNS = 12  # rep_1 ... rep_12 columns of the trial data
+
+
+def generate_sequence(frequency_pool, tone_count, with_replacement=False):
+    if with_replacement:
+        return random.choices(frequency_pool, k=tone_count)
+    else:
+        return random.sample(frequency_pool, k=tone_count)
+
+
+def repeat_sequence(frequencies, num_repetitions, shuffle=False):
+    """Return the played order of every repetition of a sequence, shuffled per repetition if required."""
+    played_sequences = []
+    for rep in range(num_repetitions):
+        current_frequencies = list(frequencies)  # Copy the sequence
+        if shuffle:
+            random.shuffle(current_frequencies)  # Shuffle if required
+        played_sequences.append(current_frequencies)  # Store played order
+    return played_sequences
+
+
+def condition_parts(condition, frequency_pool, tone_duration):
+    """Return the parts [(part name, played sequences), ...] of a trial and the REG1 frequency (or None)."""
+    if condition == "REG10":
+        # REG10: 10 tones sequence repeated 12 times (6 seconds)
+        sequence = generate_sequence(frequency_pool, 10, with_replacement=False)
+        return [("REG10", repeat_sequence(sequence, 12))], None
+
+    if condition == "RAND20":
+        # RAND20: 20 tones sequence repeated 6 times (6 seconds), shuffled per repetition
+        sequence = generate_sequence(frequency_pool, 20, with_replacement=True)
+        return [("RAND20", repeat_sequence(sequence, 6, shuffle=True))], None
+
+    if condition == "REG10-RAND20":
+        # First 3 seconds: REG10 (6 repetitions), second 3 seconds: RAND20 (3 repetitions)
+        sequence1 = generate_sequence(frequency_pool, 10, with_replacement=False)
+        sequence2 = generate_sequence(frequency_pool, 20, with_replacement=True)
+        return [("REG10 part", repeat_sequence(sequence1, 6)),
+                ("RAND20 part", repeat_sequence(sequence2, 3, shuffle=True))], None
+
+    if condition == "RAND20-REG10":
+        # First 3 seconds: RAND20 (3 repetitions), second 3 seconds: REG10 (6 repetitions)
+        sequence1 = generate_sequence(frequency_pool, 20, with_replacement=True)
+        sequence2 = generate_sequence(frequency_pool, 10, with_replacement=False)
+        return [("RAND20 part", repeat_sequence(sequence1, 3, shuffle=True)),
+                ("REG10 part", repeat_sequence(sequence2, 6))], None
+
+    if condition == "RAND20-REG1":
+        # First 3 seconds: RAND20 (3 repetitions), second 3 seconds: REG1 (single tone repeated)
+        sequence1 = generate_sequence(frequency_pool, 20, with_replacement=True)
+        reg1_frequency = random.choice(frequency_pool)  # Pick a tone from the pool
+        return [("RAND20 part", repeat_sequence(sequence1, 3, shuffle=True)),
+                ("REG1 part", [[reg1_frequency] * int(round(3 / tone_duration))])], reg1_frequency
+
+    raise ValueError(f'Unknown condition: {condition}')
+
+
+class PlannedTrial:
+    """Sequences, audio buffer and expected tone onsets of one trial."""
+
+    def __init__(self, condition, trial_num, parts, reg1_frequency, waveform, onsets, tone_duration):
+        self.condition = condition
+        self.trial_num = trial_num
+        self.parts = parts
+        self.reg1_frequency = reg1_frequency
+        self.waveform = waveform
+        self.onsets = onsets  # onset of every tone in seconds from the buffer start
+        self.duration = len(onsets) * tone_duration
+
+        # Onset of every part in seconds from the buffer start:
+        self.part_onsets = []
+        onset = 0
+        for _, sequences in parts:
+            self.part_onsets.append(onset)
+            onset += sum(len(sequence) for sequence in sequences) * tone_duration
+
+        if reg1_frequency is None:
+            self.played_sequences = [sequence for _, sequences in parts for sequence in sequences]
+            saved_sequences = self.played_sequences
+        else:
+            # REG1 tones are stored as single values after the RAND20 sequences, only the RAND20 sequences are saved
+            self.played_sequences = parts[0][1] + parts[1][1][0]
+            saved_sequences = parts[0][1]
+        self.num_repetitions = len(self.played_sequences)
+
+        # Comma-separated frequencies of every repetition, padded to the rep_N columns:
+        self.sequence_strings = [", ".join(f"{freq:.1f}" for freq in sequence) for sequence in saved_sequences]
+        self.sequence_strings += ["NA"] * (REPETITION_COLUMNS - len(self.sequence_strings))
+
+    @property
+    def nbytes(self):
+        return self.waveform.nbytes + self.onsets.nbytes
+
+
+class SessionPlan:
+    """All trials of a session in trial order, compiled before the first trial."""
+
+    def __init__(self, trials):
+        self.trials = trials
+
+    def __getitem__(self, index):
+        return self.trials[index]
+
+    def __len__(self):
+        return len(self.trials)
+
+    @property
+    def nbytes(self):
+        return sum(trial.nbytes for trial in self.trials)
+
+    def report(self):
+        duration = sum(trial.duration for trial in self.trials)
+        message = (f'SESSION PLAN: {len(self.trials)} trials, {duration:.1f}s of audio, '
+                   f'{self.nbytes / 1024 ** 2:.1f} MB')
+        print(message)
+        logging.info(message)
+
+
+def compile_session(trial_order, frequency_pool, tone_bank, tone_duration):
+    """Compile every trial of trial_order (dicts with condition and trial_num) into a SessionPlan.
+
+    Waveforms are stored as float32, half the memory of the synthesized float64 tones.
+    """
+    trials = []
+    for trial in trial_order:
+        parts, reg1_frequency = condition_parts(trial["condition"], frequency_pool, tone_duration)
+        frequencies = [freq for _, sequences in parts for sequence in sequences for freq in sequence]
+        waveform, onsets = tone_bank.train(frequencies)
+        trials.append(PlannedTrial(
+            trial["condition"], trial["trial_num"], parts, reg1_frequency,
+            waveform.astype(numpy.float32), onsets, tone_duration))
+    return SessionPlan(trials)
@@ -0,0 +1,115 @@
+from psychopy import core, visual
+import logging
+import os
+import time
+
+from .tracker_cache import TRACKER_CACHE_VARIABLE, connect_eyetrackers
+
+# Battery session of the in-process mode of runner.py: the tasks run one after the other in the runner process
+# and share one window, the LSL marker outlet and the eye tracker found by the runner, set up once per battery.
+# A task script started on its own (or by the runner in subprocess mode) sets them up itself, as before.
+# ioHub is still launched by every task: each task records its own .hdf5 datastore (datastore_name = fileName).
+
+_session = None
+
+
+class BatterySession:
+    """Hardware shared by the tasks of one battery: window, LSL outlet, eye trackers (tobii_research)."""
+
+    def __init__(self, participant_id, timepoint, win, outlet, eyetrackers=None):
+        self.participant_id = participant_id
+        self.timepoint = timepoint
+        self.win = win
+        self.outlet = outlet
+        self.eyetrackers = eyetrackers
+        self.task_name = None
+        self.task_started = None  # time.perf_counter() when the runner started the task
+        self.previous_task_ended = None  # time.perf_counter() when the previous task ended
+        self.latencies = {}  # task name: seconds from the end of the previous task until the task was ready
+
+    def start_task(self, task_name):
+        self.task_name = task_name
+        self.task_started = time.perf_counter()
+
+
+def start_session(session):
+    global _session
+    _session = session
+    return session
+
+
+def current_session():
+    """The battery session in in-process mode, None if the task runs on its own."""
+    return _session
+
+
+def end_session():
+    global _session
+    _session = None
+
+
+def open_window(config):
+    """Presentation window as configured in config.json (the same for all tasks)."""
+    return visual.Window(
+        size=(config["constants"]["monitor"]["width"], config["constants"]["monitor"]["height"]),
+        fullscr=config["constants"]["psychopy_window"]["fullscreen"],
+        screen=config["constants"]["presentation_screen"],
+        color=config["constants"]["psychopy_window"]["background_color"],
+        monitor=config["constants"]["monitor"]["name"],
+        units='pix'
+    )
+
+
+def task_window(config):
+    """The battery window in in-process mode, otherwise a new window."""
+    if _session is None:
+        return open_window(config)
+    _session.win.color = config["constants"]["psychopy_window"]["background_color"]
+    return _session.win
+
+
+def marker_outlet(create_outlet):
+    """The battery LSL marker outlet in in-process mode, otherwise create_outlet() (the outlet of the task)."""
+    if _session is None or _session.outlet is None:
+        return create_outlet()
+    return _session.outlet
+
+
+def find_eyetrackers():
+    """Eye trackers found by the runner in in-process mode, otherwise connected by the address cached by the
+    runner (tracker_cache.py), tobii_research.find_all_eyetrackers() if there is no cache or the address fails."""
+    if _session is not None and _session.eyetrackers:
+        return _session.eyetrackers
+    return connect_eyetrackers(os.environ.get(TRACKER_CACHE_VARIABLE))
+
+
+def task_ready():
+    """Called by a task when its setup is done (recording started), logs the setup time and between-task latency."""
+    if _session is None or _session.task_started is None:
+        return
+    now = time.perf_counter()
+    setup = now - _session.task_started
+    message = f'TASK READY: {_session.task_name}, setup {setup:.3f} s'
+    if _session.previous_task_ended is not None:
+        latency = now - _session.previous_task_ended
+        _session.latencies[_session.task_name] = latency
+        message += f', {latency:.3f} s since the previous task ended'
+    print(message)
+    logging.info(message)
+
+
+def end_task(win=None):
+    """End the task (also on abort): win.close() and core.quit() if the task runs on its own.
+
+    In in-process mode the battery window stays open: ioHub of the task is stopped and SystemExit is raised,
+    the runner continues with the next task.
+    """
+    if _session is None:
+        if win is not None:
+            win.close()
+        core.quit()
+    from psychopy.iohub.client import ioHubConnection
+    if ioHubConnection.ACTIVE_CONNECTION is not None:
+        ioHubConnection.ACTIVE_CONNECTION.quit()
+    _session.previous_task_ended = time.perf_counter()
+    raise SystemExit(0)
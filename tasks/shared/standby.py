@@ -0,0 +1,114 @@
+import importlib
+import json
+import runpy
+import sys
+import time
+from pathlib import Path
+
+# Warm-standby task process of runner.py (config.json "runner" -> "mode": "standby"). The runner starts it with the
+# next task script while the current task or the between-task video is running. It imports PsychoPy,
+# tobii_research and pylsl, reads config.json and the decoded clips of the task in the media cache
+# (tasks/shared/clip_cache.py, TASK_MEDIA), then waits for the go message of the runner on stdin: one JSON line with participant_id and timepoint. The task
+# script then runs in this process, as if started with "python <task script> <participant_id> <timepoint>".
+# Every task still runs in its own interpreter: a crashing task does not stop the battery.
+# An empty line or end of input (runner cancelled the battery) ends the process without running the task.
+#   python tasks/shared/standby.py <task script> <config.json>
+
+# Modules imported by the task scripts, slowest first:
+PRELOAD_MODULES = [
+    'psychopy.visual',
+    'psychopy.sound',
+    'psychopy.iohub',
+    'psychopy.hardware.keyboard',
+    'psychopy.data',
+    'psychopy.event',
+    'psychopy.monitors',
+    'psychtoolbox',
+    'tobii_research',
+    'pylsl',
+    'numpy',
+]
+
+# Media cache folders (cache_paths of clip_cache.py: folder of the source file) read by each task script, tasks
+# without decoded clips are not listed:
+TASK_MEDIA = {
+    'auditory_oddball': ['background'],  # looping background cartoon
+    'rapid-sound-sequences': ['cartoons'],  # fixation cartoons
+}
+
+READ_BLOCK_SIZE = 1 << 24  # 16 MB
+
+
+def set_audio_prefs():
+    # As the prefs saved by runner.py, also set in this process before psychopy.sound is imported:
+    from psychopy import prefs
+    prefs.hardware['audioLib'] = ['ptb', 'sounddevice', 'pyo']
+
+
+def preload_modules(modules=PRELOAD_MODULES):
+    """Import the modules, returns {module: import time in seconds}. Missing modules are skipped."""
+    timings = {}
+    for module in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print(f'standby: {module} not imported ({e})')
+            continue
+        timings[module] = time.perf_counter() - start
+    return timings
+
+
+def warm_media_cache(cache_folder, folders):
+    """Read the clips of the media cache folders once, the task then maps them from the OS file cache.
+
+    Returns the number of bytes read.
+    """
+    paths = []
+    for folder in folders:
+        paths += sorted((Path(cache_folder) / folder).glob('*.npy'))
+    total = 0
+    for path in paths:
+        with open(path, 'rb') as file:
+            while True:
+                block = file.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                total += len(block)
+    return total
+
+
+def wait_for_go(stream=sys.stdin):
+    """Block until the go message of the runner, returns (participant_id, timepoint) or None (cancelled)."""
+    line = stream.readline().strip()
+    if not line:
+        return None
+    message = json.loads(line)
+    return message['participant_id'], message['timepoint']
+
+
+def main():
+    task_script, config_path = sys.argv[1], sys.argv[2]
+    start = time.perf_counter()
+    set_audio_prefs()
+    timings = preload_modules()
+    with open(config_path, 'r') as file:
+        config = json.load(file)
+    media_bytes = 0
+    if config.get('media_cache'):
+        media_bytes = warm_media_cache(config['media_cache'], TASK_MEDIA.get(Path(task_script).stem, []))
+    print(f'standby: {Path(task_script).name} ready in {time.perf_counter() - start:.2f} s '
+          f'(imports {sum(timings.values()):.2f} s, media cache {media_bytes / 1e6:.0f} MB)')
+
+    go = wait_for_go()
+    if go is None:
+        print(f'standby: {Path(task_script).name} cancelled')
+        return
+    participant_id, timepoint = go
+    sys.argv = [task_script, participant_id, timepoint]
+    sys.path.insert(0, str(Path(task_script).resolve().parent))
+    runpy.run_path(task_script, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
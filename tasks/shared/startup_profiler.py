@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+import importlib
+import json
+import os
+import sys
+import time
+
+# Startup instrumentation of the task scripts: import time of every task module and duration of the init phases
+# (config load, window open, tracker discovery, ioHub launch, sound init), saved as one JSON file per session
+# next to the task log (<fileName>_startup.json). Only on if the environment variable STARTUP_PROFILE_VARIABLE is
+# "1" (set by runner.py if config.json "runner" -> "startup_profile" is true), otherwise the profiler does nothing.
+# Only standard library imports: the profiler is imported before the task modules.
+
+STARTUP_PROFILE_VARIABLE = 'LOCUSMENTAL_STARTUP_PROFILE'
+
+# Modules of the task scripts, in import order (psychopy.gui is imported on demand, see lazy_import.py):
+TASK_MODULES = [
+    'numpy',
+    'psychopy.core',
+    'psychopy.visual',
+    'psychopy.event',
+    'psychopy.clock',
+    'psychopy.data',
+    'psychopy.monitors',
+    'psychopy.hardware.keyboard',
+    'psychopy.iohub',
+    'tobii_research',
+    'pylsl',
+]
+AUDIO_MODULES = ['psychopy.sound', 'psychtoolbox']  # tasks with sounds
+
+
+class StartupProfiler:
+    """Import times and init phase durations (seconds) of a task."""
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = os.environ.get(STARTUP_PROFILE_VARIABLE) == '1'
+        self.enabled = enabled
+        self.created = time.perf_counter()
+        self.imports = {}
+        self.phases = {}
+
+    def import_modules(self, modules):
+        """Import the modules one by one and record their import times (modules imported before: not recorded).
+
+        The import statements of the task script then find the modules in sys.modules.
+        """
+        if not self.enabled:
+            return
+        for module in modules:
+            if module in sys.modules:
+                continue
+            start = time.perf_counter()
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                continue  # the import statement of the task reports it
+            self.imports[module] = time.perf_counter() - start
+
+    @contextmanager
+    def phase(self, name):
+        """Time an init phase: with startup.phase('window'): ..."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def save(self, path, **info):
+        """Write the timings to a JSON file, info: additional entries (e.g. task name). Returns the path or None."""
+        if not self.enabled:
+            return None
+        profile = dict(info)
+        profile['imports'] = self.imports
+        profile['imports_total'] = sum(self.imports.values())
+        profile['phases'] = self.phases
+        profile['until_saved'] = time.perf_counter() - self.created  # from the profiler import to save()
+        with open(path, 'w') as file:
+            json.dump(profile, file, indent=2)
+        return path
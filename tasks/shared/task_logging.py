@@ -0,0 +1,129 @@
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import logging
+import queue
+import sys
+
+# Non-blocking logging for the tasks: log records are put in a queue by the experiment thread and written to the
+# log file by a listener thread. Repeated messages of the frame loops (e.g. no data warnings while a participant
+# blinks) are coalesced into episode summaries. In production mode, console output (print) goes to the log file.
+
+LOG_FORMAT = '%(asctime)s:%(levelname)s:%(name)s:%(message)s'
+
+_stop_previous = None  # stops the logging of the previous task (in-process mode of runner.py)
+
+
+class CoalescingHandler(logging.Handler):
+    """Passes records to a target handler, records with the same coalesce key within window seconds are counted.
+
+    Records are coalesced if they are logged with extra={'coalesce': key}. The first record of an episode is
+    written, the following ones are summarized (count, first and last time) when the episode ends.
+    """
+
+    def __init__(self, target, window=1.0):
+        super().__init__()
+        self.target = target
+        self.window = window
+        self._episodes = {}  # key: [first record, count of coalesced records, time of the last record]
+
+    def emit(self, record):
+        self._flush_expired(record.created)
+        key = getattr(record, 'coalesce', None)
+        if key is None:
+            self.target.handle(record)
+            return
+        episode = self._episodes.get(key)
+        if episode is None:
+            self._episodes[key] = [record, 0, record.created]
+            self.target.handle(record)
+        else:
+            episode[1] += 1
+            episode[2] = record.created
+
+    def _flush_expired(self, now):
+        for key, (first, count, last) in list(self._episodes.items()):
+            if now - last > self.window:
+                self._summarize(key)
+
+    def _summarize(self, key):
+        first, count, last = self._episodes.pop(key)
+        if count:
+            summary = logging.makeLogRecord(first.__dict__)
+            summary.msg = f'{key}: {count} more within {round(last - first.created, 3)} s (coalesced)'
+            summary.args = None
+            summary.created = last
+            summary.msecs = (last - int(last)) * 1000
+            self.target.handle(summary)
+
+    def flush(self):
+        for key in list(self._episodes):
+            self._summarize(key)
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        self.target.close()
+        super().close()
+
+
+class _ConsoleToLog:
+    """Replaces sys.stdout in production mode, printed lines are logged (DEBUG, logger 'console')."""
+
+    def __init__(self):
+        self.logger = logging.getLogger('console')
+        self._buffer = ''
+
+    def write(self, text):
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split('\n')
+        for line in lines:
+            if line.strip():
+                self.logger.debug(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def setup_task_logging(filename, production=False, level=logging.DEBUG, coalesce_window=1.0):
+    """Configure the root logger of a task: queue -> listener thread -> coalescing -> log file.
+
+    Replaces logging.basicConfig(level, filename, filemode='w', format) of the task scripts.
+    production=True turns console printing off, printed lines are written to the log file instead.
+    Returns the QueueListener, it is stopped (and all records written) at exit or when the next task of an
+    in-process battery sets up its logging.
+    """
+    global _stop_previous
+    if _stop_previous is not None:
+        _stop_previous()
+    file_handler = logging.FileHandler(filename, mode='w')  # w = write, for each subject a separate log file
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    coalescing_handler = CoalescingHandler(file_handler, coalesce_window)
+    listener = QueueListener(log_queue, coalescing_handler)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+    listener.start()
+
+    stdout = sys.stdout
+    stopped = []
+
+    def stop():
+        if stopped:
+            return
+        stopped.append(True)
+        listener.stop()  # writes all queued records
+        coalescing_handler.close()  # writes open episode summaries
+        sys.stdout = stdout
+
+    atexit.register(stop)
+    _stop_previous = stop
+
+    if production:
+        sys.stdout = _ConsoleToLog()
+    return listener
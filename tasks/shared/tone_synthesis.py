@@ -0,0 +1,109 @@
+from pathlib import Path
+import hashlib
+import logging
+import numpy
+import os
+
+# Synthesis of tone trains for rapid-sound-sequences: all tones of a trial are rendered into one waveform,
+# played as a single sound buffer instead of one sound.Sound per tone.
+# The tones of the frequency pool are synthesized once per session (ToneBank), trials only index into the bank.
+
+TONE_DURATION = 0.05  # 50 ms tones
+RAMP_DURATION = 0.005  # 5 ms fade in/out to reduce clicks
+AMPLITUDE = 0.5
+
+
+def tone_envelope(samples_per_tone, ramp_samples):
+    """Return the envelope of one tone burst: linear fade in and fade out."""
+    envelope = numpy.ones(samples_per_tone)
+    envelope[:ramp_samples] *= numpy.linspace(0, 1, ramp_samples)
+    envelope[samples_per_tone - ramp_samples:] *= numpy.linspace(1, 0, ramp_samples)
+    return envelope
+
+
+def tone_train(frequencies, sample_rate, tone_duration=TONE_DURATION, ramp_duration=RAMP_DURATION, amplitude=AMPLITUDE):
+    """Return the waveform of consecutive tone bursts and the onset of every tone in seconds from the buffer start.
+
+    Every tone has the same number of samples, so the onsets are exact multiples of the tone length.
+    """
+    samples_per_tone = int(round(tone_duration * sample_rate))
+    ramp_samples = int(round(ramp_duration * sample_rate))
+    frequencies = numpy.asarray(frequencies, dtype=float)
+
+    # One row per tone, all tones at once:
+    t = numpy.arange(samples_per_tone) / sample_rate
+    tones = amplitude * numpy.sin(2 * numpy.pi * frequencies[:, None] * t)
+    tones *= tone_envelope(samples_per_tone, ramp_samples)
+
+    onsets = numpy.arange(len(frequencies)) * samples_per_tone / sample_rate
+    return tones.ravel(), onsets
+
+
+def format_onsets(onsets):
+    """Tone onsets as a log string, in ms from the buffer start."""
+    return ', '.join(f'{onset * 1000:.3f}' for onset in onsets)
+
+
+class ToneBank:
+    """Windowed tones of a frequency pool, one row per frequency (pool_size x samples_per_tone).
+
+    Built once per session, trial waveforms are assembled by indexing into the bank.
+    With a cache_folder the bank is saved as .npy, later sessions with the same pool and sample rate load it.
+    """
+
+    def __init__(self, frequency_pool, sample_rate, tone_duration=TONE_DURATION, ramp_duration=RAMP_DURATION,
+                 amplitude=AMPLITUDE, cache_folder=None):
+        self.frequencies = numpy.asarray(frequency_pool, dtype=float)
+        self.sample_rate = sample_rate
+        self.tone_duration = tone_duration
+        self.samples_per_tone = int(round(tone_duration * sample_rate))
+        self._rows = {float(frequency): row for row, frequency in enumerate(self.frequencies)}
+
+        key = numpy.concatenate((self.frequencies, [sample_rate, tone_duration, ramp_duration, amplitude]))
+        self.cache_path = None
+        if cache_folder is not None:
+            digest = hashlib.sha1(key.tobytes()).hexdigest()[:12]
+            self.cache_path = Path(cache_folder) / f'tone_bank_{int(sample_rate)}Hz_{len(self.frequencies)}_{digest}.npy'
+
+        self.tones = self._load()
+        if self.tones is None:
+            waveform, _ = tone_train(self.frequencies, sample_rate, tone_duration, ramp_duration, amplitude)
+            self.tones = waveform.reshape(len(self.frequencies), self.samples_per_tone)
+            self._save()
+            logging.info(f'TONE BANK synthesized: {self.tones.shape}')
+        else:
+            logging.info(f'TONE BANK loaded from {self.cache_path}')
+
+    def _load(self):
+        if self.cache_path is None or not self.cache_path.exists():
+            return None
+        try:
+            tones = numpy.load(self.cache_path)
+        except (OSError, ValueError) as e:
+            logging.warning(f'TONE BANK cache not readable, synthesizing: {e}')
+            return None
+        if tones.shape != (len(self.frequencies), self.samples_per_tone):
+            return None
+        return tones
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first, so that an interrupted session never leaves a broken cache:
+            temporary_path = self.cache_path.with_suffix('.tmp.npy')
+            numpy.save(temporary_path, self.tones)
+            os.replace(temporary_path, self.cache_path)
+        except OSError as e:
+            logging.warning(f'TONE BANK cache not written: {e}')
+
+    def rows(self, frequencies):
+        """Return the bank rows of frequencies from the pool."""
+        return numpy.fromiter((self._rows[float(frequency)] for frequency in frequencies), dtype=int)
+
+    def train(self, frequencies):
+        """Return the waveform of consecutive tones and the onset of every tone in seconds from the buffer start."""
+        rows = self.rows(frequencies)
+        onsets = numpy.arange(len(rows)) * self.samples_per_tone / self.sample_rate
+        return self.tones[rows].ravel(), onsets
@@ -0,0 +1,86 @@
+import json
+import logging
+import time
+from pathlib import Path
+
+# Eye tracker connection cache of a battery: runner.py searches for the eye tracker once (network discovery can
+# take seconds) and saves address, model, serial number, device name and gaze output frequencies in a session
+# file. The tasks connect directly by address (tobii_research.EyeTracker(address)); the discovery only runs again
+# if the cached address fails, the session file is then updated for the following tasks.
+# The runner passes the session file to the tasks in the environment variable TRACKER_CACHE_VARIABLE.
+
+TRACKER_CACHE_VARIABLE = 'LOCUSMENTAL_TRACKER_CACHE'
+
+_frequencies = {}  # address: gaze output frequencies of the eye trackers connected in this process
+
+
+def tracker_details(eyetracker):
+    """Details of a tobii_research.EyeTracker as saved in the cache (asks the tracker for its frequencies)."""
+    return {
+        'address': eyetracker.address,
+        'model': eyetracker.model,
+        'serial_number': eyetracker.serial_number,
+        'device_name': eyetracker.device_name,
+        'gaze_output_frequencies': list(eyetracker.get_all_gaze_output_frequencies()),
+    }
+
+
+def save_tracker_cache(path, eyetracker):
+    """Write the details of an eye tracker to the session file, returns the details."""
+    details = tracker_details(eyetracker)
+    details['saved'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(path.name + '.tmp')
+    with open(temporary_path, 'w') as file:
+        json.dump(details, file, indent=2)
+    temporary_path.replace(path)
+    return details
+
+
+def load_tracker_cache(path):
+    """Details saved in the session file, None if there is no (readable) file."""
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def connect_eyetrackers(cache_path=None):
+    """Eye trackers to use, the first one is used by the tasks.
+
+    [eye tracker at the cached address] if the session file exists and the address connects, otherwise the result
+    of tobii_research.find_all_eyetrackers() (the session file is then written for the first tracker found).
+    """
+    import tobii_research as tr
+
+    details = load_tracker_cache(cache_path) if cache_path else None
+    if details is not None:
+        start = time.perf_counter()
+        try:
+            eyetracker = tr.EyeTracker(details['address'])
+        except Exception as e:
+            logging.warning(f"Cached eye tracker address {details['address']} failed ({e}), searching for eye trackers")
+        else:
+            if eyetracker.serial_number == details['serial_number']:
+                _frequencies[eyetracker.address] = details['gaze_output_frequencies']
+            else:  # another tracker at this address
+                _frequencies[eyetracker.address] = save_tracker_cache(cache_path, eyetracker)['gaze_output_frequencies']
+            logging.info(f'Eye tracker connected by cached address in {time.perf_counter() - start:.3f} s')
+            return [eyetracker]
+
+    start = time.perf_counter()
+    found_eyetrackers = tr.find_all_eyetrackers()
+    logging.info(f'Eye tracker discovery: {len(found_eyetrackers)} found in {time.perf_counter() - start:.3f} s')
+    if found_eyetrackers and cache_path:
+        details = save_tracker_cache(cache_path, found_eyetrackers[0])
+        _frequencies[found_eyetrackers[0].address] = details['gaze_output_frequencies']
+    return found_eyetrackers
+
+
+def gaze_output_frequencies(eyetracker):
+    """Gaze output frequencies of an eye tracker, asked once per process (or taken from the session file)."""
+    if eyetracker.address not in _frequencies:
+        _frequencies[eyetracker.address] = list(eyetracker.get_all_gaze_output_frequencies())
+    return _frequencies[eyetracker.address]
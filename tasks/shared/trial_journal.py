@@ -0,0 +1,133 @@
+from pathlib import Path
+import atexit
+import csv
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+# Append-only trial journal, replaces the backup CSVs that were reopened, written and fsynced for every row.
+# The experiment thread only puts the row in a bounded queue. A writer thread keeps the journal file open,
+# appends one JSON line per row and syncs to disk in groups (every sync_rows rows or sync_interval seconds).
+# After a crash, the wide backup CSV is rebuilt from the journal:
+#   python -m tasks.shared.trial_journal <journal.jsonl> [<backup.csv>]
+
+_CLOSE = object()
+
+
+def _csv_value(value):
+    # Same text as csv.writer writes for the value:
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    return str(value)
+
+
+class TrialJournal:
+    """Backup of the trial rows as a JSON lines file: a header line {"columns": [...]}, then one list per row."""
+
+    def __init__(self, path, columns, queue_size=256, sync_rows=16, sync_interval=2.0):
+        self.path = Path(path)
+        self.columns = list(columns)
+        self.sync_rows = sync_rows
+        self.sync_interval = sync_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+
+        new_file = not self.path.exists() or self.path.stat().st_size == 0
+        self._file = open(self.path, 'a', encoding='utf-8', newline='\n')
+        if new_file:
+            self._file.write(json.dumps({'columns': self.columns}) + '\n')
+            self._sync()
+
+        self._writer = threading.Thread(target=self._run, name='trial-journal', daemon=True)
+        self._writer.start()
+        # Rows still in the queue are written when the task quits, e.g. via core.quit():
+        atexit.register(self.close)
+
+    def write(self, row):
+        """Queue one row (list in column order), blocks only if the writer is queue_size rows behind."""
+        self._queue.put(row)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _run(self):
+        unsynced = 0
+        last_sync = time.monotonic()
+        while True:
+            try:
+                row = self._queue.get(timeout=self.sync_interval)
+            except queue.Empty:
+                row = None
+            if row is _CLOSE:
+                break
+            if row is not None:
+                try:
+                    self._file.write(json.dumps([_csv_value(value) for value in row]) + '\n')
+                    unsynced += 1
+                except (OSError, ValueError) as e:
+                    logging.error(f'TRIAL JOURNAL WRITE FAILED: {e}')
+            # Group commit:
+            if unsynced and (unsynced >= self.sync_rows or time.monotonic() - last_sync >= self.sync_interval):
+                try:
+                    self._sync()
+                except OSError as e:
+                    logging.error(f'TRIAL JOURNAL SYNC FAILED: {e}')
+                unsynced = 0
+                last_sync = time.monotonic()
+
+    def close(self):
+        """Write all queued rows, sync and close the journal."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._writer.join()
+        self._sync()
+        self._file.close()
+
+
+def read_journal(path):
+    """Return the columns and rows of a journal, a truncated last line (crash during write) is skipped."""
+    columns = None
+    rows = []
+    with open(path, encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning(f'TRIAL JOURNAL: skipped incomplete line {line_number} of {path}')
+                continue
+            if isinstance(record, dict):
+                columns = record['columns']
+            else:
+                rows.append(record)
+    return columns, rows
+
+
+def rebuild_csv(journal_path, csv_path=None):
+    """Write the wide backup CSV of a journal, next to the journal by default. Returns the CSV path."""
+    journal_path = Path(journal_path)
+    if csv_path is None:
+        csv_path = journal_path.with_suffix('.csv')
+    columns, rows = read_journal(journal_path)
+    with open(csv_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        if columns is not None:
+            writer.writerow(columns)
+        writer.writerows(rows)
+    return csv_path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print('usage: python -m tasks.shared.trial_journal <journal.jsonl> [<backup.csv>]')
+        sys.exit(1)
+    csv_path = rebuild_csv(*sys.argv[1:])
+    print(f'written: {csv_path}')
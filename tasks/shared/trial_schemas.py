@@ -0,0 +1,186 @@
+from .trial_store import TrialSchema
+
+# Trial data schemas of the task scripts, keyed by script name (Path(__file__).stem).
+# Columns are the addData() names of each script: add a column here when a task starts saving it.
+
+GAZE_EPISODES = {
+    'nodata_episodes': 'string',  # JSON [[start, end, duration], ...]
+    'gaze_offset_episodes': 'string',
+}
+
+BASELINE_FIXATION = {
+    'baseline_fixation_start_timestamp': 'float64',
+    'baseline_fixation_end_timestamp': 'float64',
+    'baseline_fixation_duration': 'float64',
+    'baseline_fixation_actual_isi_duration': 'float64',
+    'baseline_fixation_gaze_offset_duration': 'float64',
+    'baseline_fixation_pause_duration': 'float64',
+    'baseline_fixation_nodata_duration': 'float64',
+}
+
+# --- Auditory oddball ---
+AUDITORY_ODDBALL_OV = {
+    'block_counter': 'int64',
+    'phase': 'string',
+    'trial': 'string',
+    'baseline_trial_counter': 'int64',
+    'oddball_trial_counter': 'int64',
+    'timestamp': 'float64',
+    'timestamp_exp': 'float64',
+    'timestamp_tracker': 'float64',
+    'ISI_expected': 'float64',
+    'ISI_duration': 'float64',
+    'gaze_offset_duration': 'float64',
+    'trial_pause_duration': 'float64',
+    'trial_nodata_duration': 'float64',
+    'stimulus_duration': 'float64',
+    **GAZE_EPISODES,
+}
+
+AUDITORY_ODDBALL = {
+    **AUDITORY_ODDBALL_OV,
+    'ISI_start_time': 'float64',
+    'ISI_end_time': 'float64',
+    'stimulus_start_time': 'float64',
+    'stimulus_end_time': 'float64',
+}
+
+# --- Cued visual search ---
+CUED_VISUAL_SEARCH = {
+    'trial_number': 'int64',
+    'timestamp_exp': 'float64',
+    'trial_start_timestamp': 'float64',
+    'trial_end_timestamp': 'float64',
+    'base_color': 'string',
+    'target_color': 'string',
+    'target_position_index': 'int64',
+    'target_position': 'string',
+    'ISI_start_timestamp': 'float64',
+    'ISI_end_timestamp': 'float64',
+    'ISI_expected': 'float64',
+    'ISI_duration_timestamp': 'float64',
+    'ISI_actual_duration': 'float64',
+    'ISI_Gaze_Offset_Duration': 'float64',
+    'ISI_nodata_Duration': 'float64',
+    'ISI_Pause_Duration': 'float64',
+    'auditory_cue': 'bool',
+    'beep_phase_start_timestamp': 'float64',
+    'beep_phase_end_timestamp': 'float64',
+    'beep_start_timestamp': 'float64',
+    'beep_end_timestamp': 'float64',
+    'actual_beep_duration': 'float64',
+    'expected_beep_duration': 'float64',
+    'nodata_beep_interval': 'float64',
+    'actual_beep_phase_duration': 'float64',
+    'delay_beep_phase': 'float64',
+    'actual_visual_search_duration': 'float64',
+    'nodata_visual_search': 'float64',
+    'trial_duration': 'float64',
+    'Trial_Duration': 'float64',
+    **BASELINE_FIXATION,
+    **GAZE_EPISODES,
+}
+
+# --- Visual oddball ---
+VISUAL_ODDBALL = {
+    'baseline_trial_number': 'int64',
+    'condition': 'string',
+    'timestamp_exp': 'float64',
+    'expected_baseline_fixation_duration': 'float64',
+    'baseline_fixation_duration': 'float64',
+    'baseline_fixation_actual_duration': 'float64',
+    'baseline_fixation_gaze_offset_duration': 'float64',
+    'baseline_fixation_pause_duration': 'float64',
+    'baseline_fixation_nodata_duration': 'float64',
+    'trial_number': 'int64',
+    'stimulus_start_timestamp': 'float64',
+    'stimulus_end_timestamp': 'float64',
+    'stimulus_duration': 'float64',
+    'nodata_stimulus': 'float64',
+    'trial_duration': 'float64',
+    'ISI_start_timestamp': 'float64',
+    'ISI_end_timestamp': 'float64',
+    'expected_isi_duration': 'float64',
+    'ISI_duration_timestamp': 'float64',
+    'actual_isi_duration': 'float64',
+    'gaze_offset_isi_duration': 'float64',
+    'pause_isi_duration': 'float64',
+    'nodata_isi_duration': 'float64',
+    **GAZE_EPISODES,
+}
+
+# --- Rapid sound sequences ---
+REPETITION_COLUMNS = [f'rep_{i + 1}' for i in range(12)]
+
+
+def played_sequences(entry):
+    """Frequencies of every saved repetition (rep_1 ... rep_12 strings) as a list of float lists."""
+    sequences = []
+    for column in REPETITION_COLUMNS:
+        value = entry.get(column)
+        if value in (None, '', 'NA'):
+            continue
+        sequences.append([float(frequency) for frequency in value.split(',')])
+    return sequences
+
+
+RAPID_SOUND_SEQUENCES_TRIALS = {
+    # Trial list of the TrialHandler:
+    'condition': 'string',
+    'trial_num': 'int64',
+    'expected_duration': 'float64',
+    # Trial data:
+    'timestamp_exp': 'float64',
+    'trial_start_time': 'float64',
+    'trial_end_time': 'float64',
+    'Trial Number': 'int64',
+    'start_timestamp_0': 'float64',
+    'transition_timestamp_1': 'float64',
+    'end_timestamp_2': 'float64',
+    'Condition': 'string',
+    'expected_stimulus_duration': 'float64',
+    'Stimulus_Duration': 'float64',
+    'nodata_stimulus': 'float64',
+    'pause_stimulus ': 'float64',
+    'gaze_offset_stimuli': 'float64',
+    'Trial_Duration': 'float64',
+    'num_repetitions': 'int64',
+    'REG1 Frequency': 'float64',
+    **BASELINE_FIXATION,
+    **GAZE_EPISODES,
+}
+
+RAPID_SOUND_SEQUENCES = {
+    **RAPID_SOUND_SEQUENCES_TRIALS,
+    'cartoon_start': 'float64',
+    'cartoon_actual_duration': 'float64',
+    'Gaze_Offset_Cartoon_Duration': 'float64',
+    'nodata_cartoon_Duration': 'float64',
+    'Pause_cartoon_Duration': 'float64',
+}
+
+RAPID_SOUND_SEQUENCES_OV = {
+    **RAPID_SOUND_SEQUENCES_TRIALS,
+    'ISI_expected': 'float64',
+    'ISI_duration_timestamp': 'float64',
+    'ISI_actual_duration': 'float64',
+    'ISI_Gaze_Offset_Duration': 'float64',
+    'ISI_nodata_Duration': 'float64',
+    'ISI_Pause_Duration': 'float64',
+}
+
+_SEQUENCES = {'sequences': ('list<list<float64>>', played_sequences)}
+
+
+TRIAL_SCHEMAS = {
+    'auditory_oddball': TrialSchema('auditory_oddball', AUDITORY_ODDBALL),
+    'auditory_oddball_ov': TrialSchema('auditory_oddball_ov', AUDITORY_ODDBALL_OV),
+    'cued-visual-search-animation': TrialSchema('cued-visual-search-animation', CUED_VISUAL_SEARCH),
+    'cued-visual-search-ov': TrialSchema('cued-visual-search-ov', CUED_VISUAL_SEARCH),
+    'visual_oddball': TrialSchema('visual_oddball', VISUAL_ODDBALL),
+    'visual_oddball_ov': TrialSchema('visual_oddball_ov', VISUAL_ODDBALL),
+    'rapid-sound-sequences': TrialSchema(
+        'rapid-sound-sequences', RAPID_SOUND_SEQUENCES, derived=_SEQUENCES, dropped=REPETITION_COLUMNS),
+    'rapid-sound-sequences_ov': TrialSchema(
+        'rapid-sound-sequences_ov', RAPID_SOUND_SEQUENCES_OV, derived=_SEQUENCES, dropped=REPETITION_COLUMNS),
+}
@@ -0,0 +1,134 @@
+import json
+import logging
+
+# Typed columnar copy of the trial data (Parquet), written next to the ExperimentHandler .csv/.psydat output.
+# Every task has a fixed schema (trial_schemas.py): columns are typed, missing values are null and frequency
+# sequences are numeric list columns. Data that does not fit the schema (new or renamed columns, wrong types)
+# is reported when the file is written, so schema drift between task versions is noticed at once.
+# pyarrow is optional: without it the tasks run as before and no .parquet file is written.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Columns of the ExperimentHandler entries that are never part of a schema:
+IGNORED_COLUMNS = {'notes'}
+
+_MISSING = (None, '', 'NA', 'None')
+
+
+class TrialSchemaError(ValueError):
+    """Trial data does not match the task schema."""
+
+
+class TrialSchema:
+    """Fixed columns of one task.
+
+    columns: {column name: type name}, type names: 'float64', 'int64', 'bool', 'string'.
+    derived: {column name: (type name, function(entry) -> value)}, e.g. numeric lists parsed from string columns.
+    dropped: columns of the trial data that are only stored as derived columns.
+    """
+
+    def __init__(self, name, columns, derived=None, dropped=()):
+        self.name = name
+        self.columns = dict(columns)
+        self.derived = dict(derived or {})
+        self.dropped = set(dropped)
+
+    def arrow_schema(self):
+        fields = [pyarrow.field(name, _arrow_type(type_name)) for name, type_name in self.columns.items()]
+        fields += [pyarrow.field(name, _arrow_type(type_name)) for name, (type_name, _) in self.derived.items()]
+        return pyarrow.schema(fields)
+
+
+def _arrow_type(type_name):
+    if type_name.startswith('list<') and type_name.endswith('>'):
+        return pyarrow.list_(_arrow_type(type_name[5:-1]))
+    return {
+        'float64': pyarrow.float64(),
+        'float32': pyarrow.float32(),
+        'int64': pyarrow.int64(),
+        'bool': pyarrow.bool_(),
+        'string': pyarrow.string(),
+    }[type_name]
+
+
+def _convert(value, type_name):
+    if isinstance(value, str) and value in _MISSING or value is None:
+        return None
+    if type_name in ('float64', 'float32'):
+        return float(value)
+    if type_name == 'int64':
+        if float(value) != int(float(value)):
+            raise ValueError(f'not an integer: {value!r}')
+        return int(float(value))
+    if type_name == 'bool':
+        if isinstance(value, str):
+            return {'True': True, 'False': False}[value]
+        return bool(value)
+    if type_name == 'string':
+        return str(value)
+    return value  # list types come from derived columns
+
+
+def _bookkeeping(column, extra_info):
+    # Loop information added by the ExperimentHandler (e.g. trials.thisN) and session information (extraInfo):
+    return '.' in column or column in IGNORED_COLUMNS or column in extra_info
+
+
+def check_columns(entries, schema, extra_info=None):
+    """Raise TrialSchemaError for columns of the entries that are not in the schema."""
+    extra_info = extra_info or {}
+    known = set(schema.columns) | schema.dropped
+    unknown = sorted({
+        column for entry in entries for column in entry
+        if column not in known and not _bookkeeping(column, extra_info)})
+    if unknown:
+        raise TrialSchemaError(f'{schema.name}: columns not in the schema: {unknown}')
+
+
+def entries_to_columns(entries, schema):
+    """Return {column: list of values} of the ExperimentHandler entries, converted to the schema types."""
+    columns = {name: [] for name in list(schema.columns) + list(schema.derived)}
+    for row, entry in enumerate(entries):
+        for name, type_name in schema.columns.items():
+            try:
+                columns[name].append(_convert(entry.get(name), type_name))
+            except (KeyError, TypeError, ValueError) as e:
+                raise TrialSchemaError(f'{schema.name}: row {row}, column {name!r} is not {type_name}: {e}')
+        for name, (type_name, function) in schema.derived.items():
+            columns[name].append(function(entry))
+    return columns
+
+
+def write_trial_store(exp, path, schema):
+    """Write the entries of an ExperimentHandler as a Parquet file, returns the path or None.
+
+    Errors are printed and logged, not raised: the .csv/.psydat output is written before.
+    """
+    if pyarrow is None:
+        logging.warning('TRIAL STORE: pyarrow is not installed, no .parquet file written')
+        return None
+    extra_info = exp.extraInfo if isinstance(exp.extraInfo, dict) else {}
+    entries = [entry for entry in exp.entries if entry]
+    metadata = {
+        'task_schema': schema.name,
+        'extra_info': json.dumps(extra_info, default=str),
+    }
+    try:
+        check_columns(entries, schema, extra_info)
+        table = pyarrow.Table.from_pydict(entries_to_columns(entries, schema), schema=schema.arrow_schema())
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+        pyarrow.parquet.write_table(table, str(path))
+    except Exception as e:  # also errors of the derived columns and of the file write (OSError)
+        print(f'TRIAL STORE NOT WRITTEN: {e}')
+        logging.error(f'TRIAL STORE NOT WRITTEN: {e}')
+        return None
+    logging.info(f'TRIAL STORE: {len(entries)} rows written to {path}')
+    return path
+
+
+def read_trials(path, columns=None):
+    """Read a trial store, only the requested columns are loaded."""
+    return pyarrow.parquet.read_table(str(path), columns=columns)
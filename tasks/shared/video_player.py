@@ -0,0 +1,155 @@
+from psychopy import core, event, visual
+from PIL import Image
+import logging
+import queue
+import threading
+
+from .clip_cache import video_file_clip
+
+# Between-task videos in the PsychoPy window of an in-process battery (runner.py, "between_task_video": "in_window").
+# A decoder thread opens the next video while the task before it is still running: the sound track is decoded
+# and the first buffer_seconds of frames (scaled to the decoding width) are buffered, then the thread waits for
+# playback and keeps the buffer filled. Playback shows the frame due at each flip (late frames are dropped, the
+# last frame is held if the decoder falls behind) and ends exactly after the duration of the video.
+
+DEFAULT_WIDTH = 1280  # decoding width in pixels, the frames are scaled to the window width on the GPU
+DEFAULT_BUFFER_SECONDS = 2.0
+AUDIO_SAMPLE_RATE = 48000
+
+_END = object()  # end of the frames
+
+
+def video_duration(filename):
+    """Duration of a video file in seconds (None if the file cannot be opened)."""
+    try:
+        clip = video_file_clip()(str(filename), audio=False)
+    except Exception as e:  # also ImportError: moviepy missing
+        logging.error(f'VIDEO DURATION: {filename}: {e}')
+        return None
+    try:
+        return clip.duration
+    finally:
+        clip.close()
+
+
+class PrefetchedVideo:
+    """A video decoded ahead of its playback by a worker thread, see play()."""
+
+    def __init__(self, filename, width=DEFAULT_WIDTH, buffer_seconds=DEFAULT_BUFFER_SECONDS):
+        self.filename = filename
+        self.width = width
+        self.buffer_seconds = buffer_seconds
+        self.duration = None
+        self.frame_rate = None
+        self.audio = None  # (samples, channels) array of the sound track, None if the video has no sound
+        self.error = None
+        self.opened = threading.Event()  # duration, frame rate and sound are available (or error is set)
+        self._frames = None
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name='video-prefetch', daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        try:
+            clip = video_file_clip()(str(self.filename), target_resolution=(None, self.width))
+        except Exception as e:
+            self.error = e
+            self.opened.set()
+            return
+        try:
+            self.duration = clip.duration
+            self.frame_rate = clip.fps
+            if clip.audio is not None:
+                self.audio = clip.audio.to_soundarray(fps=AUDIO_SAMPLE_RATE)
+            self._frames = queue.Queue(maxsize=max(1, int(self.buffer_seconds * self.frame_rate)))
+            self.opened.set()
+            for frame in clip.iter_frames(dtype='uint8'):
+                if not self._put(frame):
+                    return
+            self._put(_END)
+        except Exception as e:
+            self.error = e
+            logging.error(f'VIDEO DECODING FAILED: {self.filename}: {e}')
+            self.opened.set()
+            if self._frames is not None:
+                self._put(_END)
+        finally:
+            clip.close()
+
+    def _put(self, item):
+        # Blocks while the buffer is full, False if the playback was stopped:
+        while not self._stop.is_set():
+            try:
+                self._frames.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def close(self):
+        self._stop.set()
+
+    def play(self, win, timeout=30, skip_keys=('escape',)):
+        """Play the video in win, returns the playback duration in seconds (None if the video could not be played).
+
+        Waits up to timeout seconds for the decoder if the video was not prefetched in time.
+        A key of skip_keys ends the video early.
+        """
+        wait_start = core.getTime()
+        if not self.opened.wait(timeout) or self.error is not None:
+            logging.error(f'VIDEO NOT PLAYED: {self.filename}: {self.error or "decoder timeout"}')
+            self.close()
+            return None
+        wait = core.getTime() - wait_start
+
+        first = self._frames.get()
+        if first is _END:
+            self.close()
+            return None
+        height, width = first.shape[:2]
+        size = (win.size[0], win.size[0] * height / width)  # full window width, aspect ratio kept
+        image = visual.ImageStim(win, image=Image.fromarray(first), size=size, units='pix')
+        shown_index = 0  # frame index of the image
+        ended = False
+
+        sound = None
+        if self.audio is not None:
+            from psychopy import sound as psychopy_sound
+            sound = psychopy_sound.Sound(value=self.audio, sampleRate=AUDIO_SAMPLE_RATE, stereo=self.audio.shape[1] > 1)
+            sound.play(when=win.getFutureFlipTime(clock='ptb'))
+
+        event.clearEvents()
+        image.draw()
+        start = win.flip()  # time of the first frame
+        playback_time = 0.0
+        while playback_time < self.duration:
+            # Frame due at the next flip, late frames are skipped:
+            due_index = int((playback_time + win.monitorFramePeriod) * self.frame_rate)
+            latest = None
+            while not ended and shown_index < due_index:
+                try:
+                    frame = self._frames.get_nowait()
+                except queue.Empty:
+                    break  # decoder behind: the latest frame is held
+                if frame is _END:
+                    ended = True
+                    break
+                shown_index += 1
+                latest = frame
+            if latest is not None:
+                image.image = Image.fromarray(latest)  # texture upload of one frame
+            image.draw()
+            playback_time = win.flip() - start
+            if skip_keys and event.getKeys(list(skip_keys)):
+                logging.info(f'VIDEO SKIPPED: {self.filename} after {playback_time:.2f} s')
+                break
+
+        if sound is not None:
+            sound.stop()
+        win.flip()  # clear the last frame
+        self.close()
+        print(f'Video {self.filename}: waited {wait:.3f} sec for the decoder, played {playback_time:.2f} of '
+              f'{self.duration:.2f} sec')
+        logging.info(f'VIDEO PLAYED: {self.filename}, wait {round(wait, 3)}, played {round(playback_time, 3)}, '
+                     f'duration {round(self.duration, 3)}')
+        return playback_time